@@ -0,0 +1,202 @@
+# ====================================================
+# CLIENTE HTTP DE LA API - Conexiones reutilizadas, reintentos y hedging
+# ====================================================
+# predict_wait_time_api hacía un requests.post nuevo por clic: handshake TLS
+# con API Gateway en cada predicción y, con una Lambda en frío, hasta 30 s
+# colgado sin reintentar. Este cliente:
+#   - mantiene una requests.Session por proceso con pool de conexiones
+#     keep-alive (API_POOL_SIZE),
+#   - separa timeout de conexión y de lectura (API_CONNECT_TIMEOUT,
+#     API_READ_TIMEOUT),
+#   - reintenta como mucho API_MAX_RETRIES veces los 5xx, timeouts y errores
+#     de conexión, con backoff exponencial y jitter completo
+#     (uniforme en [0, API_BACKOFF_BASE * 2^intento], tope API_BACKOFF_MAX),
+#   - si la primera petición no ha respondido tras API_HEDGE_AFTER_MS (el p95
+#     de la API en caliente), lanza una segunda idéntica y se queda con la
+#     primera respuesta válida. La predicción es idempotente, así que el
+#     duplicado solo cuesta una invocación más. API_HEDGE_AFTER_MS=0 lo
+#     desactiva.
+# Los 4xx no se reintentan: se devuelven como HTTPError igual que antes.
+
+import json
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+API_CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", "3.05"))
+API_READ_TIMEOUT = float(os.getenv("API_READ_TIMEOUT", "10"))
+API_MAX_RETRIES = int(os.getenv("API_MAX_RETRIES", "2"))
+API_BACKOFF_BASE = float(os.getenv("API_BACKOFF_BASE", "0.25"))
+API_BACKOFF_MAX = float(os.getenv("API_BACKOFF_MAX", "4"))
+API_HEDGE_AFTER_MS = float(os.getenv("API_HEDGE_AFTER_MS", "1500"))
+API_POOL_SIZE = int(os.getenv("API_POOL_SIZE", "8"))
+
+
+class RetryableStatus(requests.exceptions.HTTPError):
+    """Respuesta 5xx que se puede reintentar"""
+
+
+class ApiClient:
+    """Cliente de la API de predicción con sesión persistente, reintentos y petición de cobertura"""
+
+    def __init__(self, url, connect_timeout=API_CONNECT_TIMEOUT, read_timeout=API_READ_TIMEOUT,
+                 max_retries=API_MAX_RETRIES, backoff_base=API_BACKOFF_BASE, backoff_max=API_BACKOFF_MAX,
+                 hedge_after_ms=API_HEDGE_AFTER_MS, pool_size=API_POOL_SIZE):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after_ms / 1000
+        self.stats = {"peticiones": 0, "reintentos": 0, "hedges": 0, "hedges_ganados": 0}
+
+        self.session = requests.Session()
+        # Sin reintentos de urllib3: los gestiona _post_with_retries (también los POST)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="api-hedge")
+
+    def _post_once(self, payload):
+        self.stats["peticiones"] += 1
+        response = self.session.post(self.url, data=json.dumps(payload), timeout=self.timeout)
+        if response.status_code >= 500:
+            raise RetryableStatus(f"{response.status_code} Server Error for url: {self.url}", response=response)
+        response.raise_for_status()
+        return response.json()
+
+    def _backoff(self, intento):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** intento))
+
+    def _post_with_retries(self, payload):
+        for intento in range(self.max_retries + 1):
+            try:
+                return self._post_once(payload)
+            except (RetryableStatus, requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+                if intento == self.max_retries:
+                    raise
+            self.stats["reintentos"] += 1
+            time.sleep(self._backoff(intento))
+
+    def post(self, payload, hedge=True):
+        """
+        POST de payload; devuelve el JSON de la primera respuesta válida.
+
+        hedge=False: sin petición de cobertura, en el hilo que llama. Para
+        fan-outs propios, que si no ocuparían el pool de cobertura y harían
+        esperar en cola a los hedges (contando esa espera en su temporizador).
+        """
+        if not hedge or self.hedge_after <= 0:
+            return self._post_with_retries(payload)
+
+        principal = self._executor.submit(self._post_with_retries, payload)
+        hechas, _ = wait([principal], timeout=self.hedge_after)
+        if hechas:
+            return principal.result()
+
+        self.stats["hedges"] += 1
+        cobertura = self._executor.submit(self._post_with_retries, payload)
+        pendientes = {principal, cobertura}
+        error = None
+        while pendientes:
+            hechas, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+            for futuro in hechas:
+                if futuro.exception() is None:
+                    # La otra petición sigue en segundo plano (acotada por el timeout) y se descarta
+                    if futuro is cobertura:
+                        self.stats["hedges_ganados"] += 1
+                    return futuro.result()
+                error = error or futuro.exception()
+        raise error
+
+
+# Cliente del proceso (se crea en el primer uso y se reutiliza entre reruns)
+_clientes = {}
+
+
+def get_api_client(url):
+    """Cliente persistente para url (uno por URL y proceso)"""
+    if url not in _clientes:
+        _clientes[url] = ApiClient(url)
+    return _clientes[url]
+
+
+# Comprobación contra un servidor HTTP local: keep-alive, reintentos de 5xx y hedging
+if __name__ == "__main__":
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    estado = {"conexiones": set(), "fallos_pendientes": 0, "lentas_pendientes": 0}
+    cerrojo = threading.Lock()
+
+    class Stub(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            cuerpo = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            with cerrojo:
+                estado["conexiones"].add(self.client_address)
+                fallar = estado["fallos_pendientes"] > 0
+                lenta = estado["lentas_pendientes"] > 0
+                estado["fallos_pendientes"] -= fallar
+                estado["lentas_pendientes"] -= lenta
+            if lenta:
+                time.sleep(1.0)
+            if fallar:
+                respuesta, codigo = b'{"error": "cold"}', 503
+            else:
+                respuesta, codigo = json.dumps({"ok": True, "eco": json.loads(cuerpo)}).encode(), 200
+            self.send_response(codigo)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(respuesta)))
+            self.end_headers()
+            self.wfile.write(respuesta)
+
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), Stub)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{servidor.server_address[1]}/predict"
+    errores = 0
+
+    # Keep-alive: 20 peticiones seguidas reutilizan una sola conexión
+    cliente = ApiClient(url, hedge_after_ms=0)
+    for i in range(20):
+        cliente.post({"i": i})
+    print(f"Conexiones para 20 peticiones: {len(estado['conexiones'])}")
+    errores += len(estado["conexiones"]) != 1
+
+    # Reintentos: dos 503 seguidos y después 200
+    estado["fallos_pendientes"] = 2
+    cliente = ApiClient(url, hedge_after_ms=0, backoff_base=0.01)
+    resultado = cliente.post({"reintento": True})
+    print(f"Tras dos 503: {resultado}, stats {cliente.stats}")
+    errores += cliente.stats["reintentos"] != 2 or not resultado["ok"]
+
+    # Sin reintentos suficientes se propaga el 5xx
+    estado["fallos_pendientes"] = 3
+    try:
+        ApiClient(url, hedge_after_ms=0, max_retries=1, backoff_base=0.01).post({})
+        errores += 1
+    except requests.exceptions.HTTPError as e:
+        print(f"Reintentos agotados: {e}")
+    estado["fallos_pendientes"] = 0
+
+    # Hedging: la primera petición tarda 1 s, la de cobertura sale a los 100 ms y gana
+    estado["lentas_pendientes"] = 1
+    cliente = ApiClient(url, hedge_after_ms=100)
+    inicio = time.perf_counter()
+    cliente.post({"hedge": True})
+    ms = (time.perf_counter() - inicio) * 1000
+    print(f"Con hedging: {ms:.0f} ms, stats {cliente.stats}")
+    errores += cliente.stats["hedges_ganados"] != 1 or ms > 800
+
+    servidor.shutdown()
+    print("OK" if errores == 0 else f"{errores} comprobaciones fallidas")
+    raise SystemExit(1 if errores else 0)
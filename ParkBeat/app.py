@@ -4,28 +4,138 @@ import numpy as np
 import base64
 from datetime import datetime, date, time, timedelta
 import plotly.graph_objects as go
-from predict import load_model_artifacts  # Solo para obtener listas de atracciones/zonas
+from serving_metadata import load_serving_metadata  # Solo listas de atracciones/zonas (sin modelo ni históricos)
 import warnings
 import os
 import requests
 import json
+from concurrent.futures import ThreadPoolExecutor
+from api_client import get_api_client
+from forecast_table import CLIMA_APP  # Clima por defecto precalculado en la tabla de previsiones
 
 warnings.filterwarnings('ignore')
 
 # Configurar URL de la API (puedes usar variable de entorno o hardcodear)
 API_URL = os.getenv('API_URL', 'https://hok3cqu9h4.execute-api.eu-west-3.amazonaws.com/prod/predict')
 
+# Listas de respaldo (nombres exactos de la API Queue-Times) si no hay metadatos de serving
+ATRACCIONES_FALLBACK = [
+    "A Toda Máquina",
+    "Academia de Pilotos Baby Looney Tunes",
+    "Batman Gotham City Escape",
+    "Cartoon Carousel",
+    "Cataratas Salvajes",
+    "Cine Tour",
+    "Coaster Express",
+    "Convoy de Camiones",
+    "Correcaminos Bip Bip",
+    "Emergencias Pato Lucas",
+    "Escuela de Conducción Yabba-Dabba-Doo",
+    "He Visto un Lindo Gatito",
+    "Hotel Embrujado",
+    "La Aventura de Scooby-Doo",
+    "La Captura de Gossamer",
+    "La Venganza del Enigma",
+    "Lex Luthor Invertatron",
+    "Looney Tunes Correo Aéreo",
+    "Los Carros de la Mina",
+    "Marvin el Marciano Cohetes Espaciales",
+    "Mr. Freeze Fábrica de Hielo",
+    "Oso Yogui",
+    "Pato Lucas Coches Locos",
+    "Piolín y Silvestre Paseo en Autobús",
+    "Rápidos ACME",
+    "Río Bravo",
+    "Scooby-Doo's Tea Party Mistery",
+    "Shadows of Arkham",
+    "Stunt Fall",
+    "Superman La Atracción de Acero",
+    "The Joker Coches de Choque",
+    "Tom & Jerry Picnic en el Parque",
+    "Wile E. Coyote Zona de Explosión"
+]
+
+ZONAS_FALLBACK = [
+    "Cartoon Village",
+    "DC Super Heroes World",
+    "Movie World Studios",
+    "Old West Territory",
+    "Warner Beach"
+]
+
+# Mapeo de respaldo atracción -> zona
+ZONA_POR_ATRACCION_FALLBACK = {
+    # Cartoon Village
+    "A Toda Máquina": "Cartoon Village",
+    "Academia de Pilotos Baby Looney Tunes": "Cartoon Village",
+    "Cartoon Carousel": "Cartoon Village",
+    "Convoy de Camiones": "Cartoon Village",
+    "Correcaminos Bip Bip": "Cartoon Village",
+    "Emergencias Pato Lucas": "Cartoon Village",
+    "Escuela de Conducción Yabba-Dabba-Doo": "Cartoon Village",
+    "He Visto un Lindo Gatito": "Cartoon Village",
+    "La Aventura de Scooby-Doo": "Cartoon Village",
+    "La Captura de Gossamer": "Cartoon Village",
+    "Looney Tunes Correo Aéreo": "Cartoon Village",
+    "Marvin el Marciano Cohetes Espaciales": "Cartoon Village",
+    "Pato Lucas Coches Locos": "Cartoon Village",
+    "Piolín y Silvestre Paseo en Autobús": "Cartoon Village",
+    "Rápidos ACME": "Cartoon Village",
+    "Scooby-Doo's Tea Party Mistery": "Cartoon Village",
+    "Tom & Jerry Picnic en el Parque": "Cartoon Village",
+    "Wile E. Coyote Zona de Explosión": "Cartoon Village",
+    # DC Super Heroes World
+    "Batman Gotham City Escape": "DC Super Heroes World",
+    "La Venganza del Enigma": "DC Super Heroes World",
+    "Lex Luthor Invertatron": "DC Super Heroes World",
+    "Mr. Freeze Fábrica de Hielo": "DC Super Heroes World",
+    "Shadows of Arkham": "DC Super Heroes World",
+    "Superman La Atracción de Acero": "DC Super Heroes World",
+    "The Joker Coches de Choque": "DC Super Heroes World",
+    # Movie World Studios
+    "Cine Tour": "Movie World Studios",
+    "Hotel Embrujado": "Movie World Studios",
+    "Oso Yogui": "Movie World Studios",
+    "Stunt Fall": "Movie World Studios",
+    # Old West Territory
+    "Cataratas Salvajes": "Old West Territory",
+    "Coaster Express": "Old West Territory",
+    "Los Carros de la Mina": "Old West Territory",
+    "Río Bravo": "Old West Territory",
+    # Warner Beach
+}
+
+
+@st.cache_resource
+def load_app_metadata():
+    """
+    Listas de atracciones/zonas y zona de cada atracción, cargadas una vez por proceso.
+
+    Solo lee serving_metadata.pkl (no el modelo ni df_processed), así que las
+    reruns de Streamlit no dependen del tamaño de los datos de entrenamiento.
+    """
+    error = None
+    try:
+        metadata = load_serving_metadata() or {}
+    except Exception as e:
+        metadata, error = {}, str(e)
+
+    fallback = not metadata.get("atracciones")
+    return {
+        "atracciones": list(metadata.get("atracciones") or ATRACCIONES_FALLBACK),
+        "zonas": list(metadata.get("zonas") or ZONAS_FALLBACK),
+        "zona_por_atraccion": dict(metadata.get("zona_por_atraccion") or ZONA_POR_ATRACCION_FALLBACK),
+        "n_registros": metadata.get("n_registros", 0),
+        "fallback": fallback,
+        "error": error,
+    }
+
+
 def predict_wait_time_api(input_dict):
     """Llama a la API de Lambda para obtener predicción"""
     try:
-        response = requests.post(
-            API_URL,
-            json=input_dict,
-            headers={'Content-Type': 'application/json'},
-            timeout=30
-        )
-        response.raise_for_status()
-        resultado = response.json()
+        # Sesión persistente del proceso: keep-alive, reintentos con backoff y hedging
+        resultado = get_api_client(API_URL).post(input_dict)
         
         # Adaptar formato si es necesario (API Gateway a veces envuelve en 'body')
         if isinstance(resultado, dict) and 'body' in resultado:
@@ -43,6 +153,133 @@ def predict_wait_time_api(input_dict):
         st.error(f"❌ Error inesperado: {str(e)}")
         return None
 
+# Mapa del día: horario de apertura en tramos de 15 minutos
+DIA_HORA_INICIO = os.getenv('DIA_HORA_INICIO', '10:00')
+DIA_HORA_FIN = os.getenv('DIA_HORA_FIN', '20:00')
+DIA_PASO_MINUTOS = int(os.getenv('DIA_PASO_MINUTOS', '15'))
+DIA_CONCURRENCIA = int(os.getenv('DIA_CONCURRENCIA', '8'))
+
+
+def _tramos_del_dia():
+    h, m = map(int, DIA_HORA_INICIO.split(":"))
+    h_fin, m_fin = map(int, DIA_HORA_FIN.split(":"))
+    return [f"{t // 60:02d}:{t % 60:02d}" for t in range(h * 60 + m, h_fin * 60 + m_fin, DIA_PASO_MINUTOS)]
+
+
+def _predicciones_concurrentes(inputs):
+    """Una petición por input, en paralelo sobre la sesión persistente (API sin modo lote)"""
+    cliente = get_api_client(API_URL)
+
+    def una(input_dict):
+        try:
+            # Sin hedging: el fan-out ya usa DIA_CONCURRENCIA hilos y coparía el pool de cobertura
+            resultado = cliente.post(input_dict, hedge=False)
+            if isinstance(resultado, dict) and 'body' in resultado:
+                resultado = json.loads(resultado['body'])
+            return {**resultado, "status": resultado.get("status", "success"),
+                    "atraccion": input_dict["atraccion"], "hora": input_dict["hora"]}
+        except requests.exceptions.RequestException as e:
+            return {"status": "error", "error": str(e), "atraccion": input_dict["atraccion"], "hora": input_dict["hora"]}
+
+    with ThreadPoolExecutor(max_workers=DIA_CONCURRENCIA) as pool:
+        return list(pool.map(una, inputs))
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def fetch_day_predictions(fecha_str, temperatura, humedad, sensacion_termica, codigo_clima, atracciones, zonas):
+    """
+    Predicciones de todas las atracciones en cada tramo del día, como DataFrame
+    (atraccion, hora, minutos). Cacheadas por fecha, clima y lista de atracciones.
+
+    Usa una sola petición en lote (rejilla) y, si la API desplegada no la
+    acepta, peticiones individuales concurrentes.
+    """
+    tramos = _tramos_del_dia()
+    clima = {"temperatura": temperatura, "humedad": humedad,
+             "sensacion_termica": sensacion_termica, "codigo_clima": codigo_clima}
+    payload = {"grid": {
+        "fecha": fecha_str,
+        "atracciones": [{"atraccion": a, "zona": z} for a, z in zip(atracciones, zonas)],
+        "hora_inicio": DIA_HORA_INICIO,
+        "hora_fin": DIA_HORA_FIN,
+        "paso_minutos": DIA_PASO_MINUTOS,
+        **clima,
+    }}
+    try:
+        resultado = get_api_client(API_URL).post(payload)
+        if isinstance(resultado, dict) and 'body' in resultado:
+            resultado = json.loads(resultado['body'])
+        resultados = resultado.get("resultados")
+        if resultados is None:
+            raise ValueError("La API no devolvió resultados en lote")
+    except (requests.exceptions.HTTPError, ValueError):
+        inputs = [{"atraccion": a, "zona": z, "fecha": fecha_str, "hora": h, **clima}
+                  for a, z in zip(atracciones, zonas) for h in tramos]
+        resultados = _predicciones_concurrentes(inputs)
+
+    filas = [
+        {"atraccion": r.get("atraccion"), "hora": str(r.get("hora"))[:5], "minutos": r.get("minutos_predichos")}
+        for r in resultados if r.get("status") == "success"
+    ]
+    return pd.DataFrame(filas, columns=["atraccion", "hora", "minutos"])
+
+
+def render_day_heatmap(fecha_seleccionada, clima, atracciones, zona_por_atraccion):
+    """Vista del día completo: mapa de calor atracción × hora"""
+    st.markdown("### 🗓️ Tiempos de espera de todo el día")
+    st.markdown(
+        f"Todas las atracciones de {DIA_HORA_INICIO} a {DIA_HORA_FIN} en tramos de "
+        f"{DIA_PASO_MINUTOS} minutos para el **{fecha_seleccionada.strftime('%d/%m/%Y')}**."
+    )
+
+    if st.button("🗓️ Cargar mapa del día", use_container_width=True, key="day_heatmap_button"):
+        st.session_state["mostrar_mapa_dia"] = True
+    if not st.session_state.get("mostrar_mapa_dia"):
+        return
+
+    with st.spinner("🔮 Calculando el día completo..."):
+        try:
+            df_dia = fetch_day_predictions(
+                fecha_seleccionada.strftime("%Y-%m-%d"),
+                clima["temperatura"], clima["humedad"], clima["sensacion_termica"], clima["codigo_clima"],
+                tuple(atracciones), tuple(zona_por_atraccion.get(a, "") for a in atracciones),
+            )
+        except requests.exceptions.RequestException as e:
+            st.error(f"❌ Error al llamar a la API: {str(e)}")
+            return
+
+    if df_dia.empty:
+        st.warning("⚠️ La API no devolvió predicciones para este día.")
+        return
+
+    tabla = df_dia.pivot_table(index="atraccion", columns="hora", values="minutos", aggfunc="mean")
+    tabla = tabla.reindex(columns=_tramos_del_dia())
+    # Atracciones con más espera media arriba
+    tabla = tabla.loc[tabla.mean(axis=1).sort_values(ascending=True).index]
+
+    fig = go.Figure(go.Heatmap(
+        z=tabla.to_numpy(),
+        x=tabla.columns.tolist(),
+        y=tabla.index.tolist(),
+        colorscale=[[0.0, "#2ecc71"], [0.25, "#f6d365"], [0.5, "#f7971e"], [1.0, "#ff416c"]],
+        zmin=0,
+        zmax=max(60, float(np.nanmax(tabla.to_numpy()))),
+        colorbar=dict(title="min"),
+        hovertemplate="%{y}<br>%{x}: %{z:.0f} min<extra></extra>",
+    ))
+    fig.update_layout(
+        height=max(400, 22 * len(tabla) + 120),
+        margin=dict(l=10, r=10, t=30, b=10),
+        xaxis=dict(title="Hora", tickangle=-45),
+        yaxis=dict(title=None),
+    )
+    st.plotly_chart(fig, use_container_width=True)
+
+    faltan = len(atracciones) * len(_tramos_del_dia()) - len(df_dia)
+    if faltan > 0:
+        st.caption(f"{faltan} tramos sin predicción.")
+
+
 def get_base64_image(image_path):
     """Convierte una imagen a base64"""
     with open(image_path, "rb") as img_file:
@@ -324,131 +561,16 @@ def main():
     estimación del tiempo de espera esperado.
     """)
     
-    # Cargar modelo SOLO para obtener listas de atracciones/zonas
-    with st.spinner("Cargando modelo y datos..."):
-        try:
-            artifacts = load_model_artifacts()
-            
-            # Verificar si artifacts es válido
-            if not artifacts:
-                st.warning("⚠️ No se pudieron cargar los artefactos. Usando listas limitadas.")
-                df = pd.DataFrame()
-            elif isinstance(artifacts, dict):
-                df = artifacts.get("df_processed", pd.DataFrame())
-                
-              
-                
-        except Exception as e:
-            st.warning(f"⚠️ Error al cargar el modelo: {str(e)}")
-            st.info("💡 La aplicación continuará con listas limitadas de atracciones.")
-            df = pd.DataFrame()
-
-    @st.cache_data
-    def get_attractions():
-        if not df.empty and "atraccion" in df.columns:
-            return sorted(df["atraccion"].dropna().astype(str).unique().tolist())
-        else:
-            # Lista fallback con nombres exactos de la API Queue-Times
-            return [
-                "A Toda Máquina",
-                "Academia de Pilotos Baby Looney Tunes",
-                "Batman Gotham City Escape",
-                "Cartoon Carousel",
-                "Cataratas Salvajes",
-                "Cine Tour",
-                "Coaster Express",
-                "Convoy de Camiones",
-                "Correcaminos Bip Bip",
-                "Emergencias Pato Lucas",
-                "Escuela de Conducción Yabba-Dabba-Doo",
-                "He Visto un Lindo Gatito",
-                "Hotel Embrujado",
-                "La Aventura de Scooby-Doo",
-                "La Captura de Gossamer",
-                "La Venganza del Enigma",
-                "Lex Luthor Invertatron",
-                "Looney Tunes Correo Aéreo",
-                "Los Carros de la Mina",
-                "Marvin el Marciano Cohetes Espaciales",
-                "Mr. Freeze Fábrica de Hielo",
-                "Oso Yogui",
-                "Pato Lucas Coches Locos",
-                "Piolín y Silvestre Paseo en Autobús",
-                "Rápidos ACME",
-                "Río Bravo",
-                "Scooby-Doo's Tea Party Mistery",
-                "Shadows of Arkham",
-                "Stunt Fall",
-                "Superman La Atracción de Acero",
-                "The Joker Coches de Choque",
-                "Tom & Jerry Picnic en el Parque",
-                "Wile E. Coyote Zona de Explosión"
-            ]
-
-    @st.cache_data
-    def get_zones():
-        if not df.empty and "zona" in df.columns:
-            return sorted(df["zona"].dropna().astype(str).unique().tolist())
-        else:
-            return [
-                "Cartoon Village",
-                "DC Super Heroes World",
-                "Movie World Studios",
-                "Old West Territory",
-                "Warner Beach"
-            ]
-
-    def get_zone_for_attraction(attraction):
-        if not df.empty and "atraccion" in df.columns and "zona" in df.columns:
-            row = df[df["atraccion"] == attraction]
-            return row["zona"].iloc[0] if not row.empty else ""
-        else:
-            # Mapeo fallback con nombres exactos de la API Queue-Times
-            zone_map = {
-                # Cartoon Village
-                "A Toda Máquina": "Cartoon Village",
-                "Academia de Pilotos Baby Looney Tunes": "Cartoon Village",
-                "Cartoon Carousel": "Cartoon Village",
-                "Convoy de Camiones": "Cartoon Village",
-                "Correcaminos Bip Bip": "Cartoon Village",
-                "Emergencias Pato Lucas": "Cartoon Village",
-                "Escuela de Conducción Yabba-Dabba-Doo": "Cartoon Village",
-                "He Visto un Lindo Gatito": "Cartoon Village",
-                "La Aventura de Scooby-Doo": "Cartoon Village",
-                "La Captura de Gossamer": "Cartoon Village",
-                "Looney Tunes Correo Aéreo": "Cartoon Village",
-                "Marvin el Marciano Cohetes Espaciales": "Cartoon Village",
-                "Pato Lucas Coches Locos": "Cartoon Village",
-                "Piolín y Silvestre Paseo en Autobús": "Cartoon Village",
-                "Rápidos ACME": "Cartoon Village",
-                "Scooby-Doo's Tea Party Mistery": "Cartoon Village",
-                "Tom & Jerry Picnic en el Parque": "Cartoon Village",
-                "Wile E. Coyote Zona de Explosión": "Cartoon Village",
-                # DC Super Heroes World
-                "Batman Gotham City Escape": "DC Super Heroes World",
-                "La Venganza del Enigma": "DC Super Heroes World",
-                "Lex Luthor Invertatron": "DC Super Heroes World",
-                "Mr. Freeze Fábrica de Hielo": "DC Super Heroes World",
-                "Shadows of Arkham": "DC Super Heroes World",
-                "Superman La Atracción de Acero": "DC Super Heroes World",
-                "The Joker Coches de Choque": "DC Super Heroes World",
-                # Movie World Studios
-                "Cine Tour": "Movie World Studios",
-                "Hotel Embrujado": "Movie World Studios",
-                "Oso Yogui": "Movie World Studios",
-                "Stunt Fall": "Movie World Studios",
-                # Old West Territory
-                "Cataratas Salvajes": "Old West Territory",
-                "Coaster Express": "Old West Territory",
-                "Los Carros de la Mina": "Old West Territory",
-                "Río Bravo": "Old West Territory",
-                # Warner Beach
-                
-            }
-            return zone_map.get(attraction, "")
+    # Metadatos de la app (cacheados por proceso): no se carga nada pesado al renderizar
+    app_metadata = load_app_metadata()
+    if app_metadata["error"]:
+        st.warning(f"⚠️ Error al cargar el modelo: {app_metadata['error']}")
+        st.info("💡 La aplicación continuará con listas limitadas de atracciones.")
+    elif app_metadata["fallback"]:
+        st.warning("⚠️ No se pudieron cargar los artefactos. Usando listas limitadas.")
 
-    atracciones = get_attractions()
-    zonas = get_zones()
+    atracciones = app_metadata["atracciones"]
+    zonas = app_metadata["zonas"]
 
     st.markdown("##  Configura tu predicción")
     
@@ -465,7 +587,7 @@ def main():
                 key="attraction_select"
             )
             
-            zona_auto = get_zone_for_attraction(atraccion_seleccionada)
+            zona_auto = app_metadata["zona_por_atraccion"].get(atraccion_seleccionada, "")
             if zona_auto:
                 st.info(f"📍 **Zona:** {zona_auto}")
 
@@ -505,7 +627,7 @@ def main():
                 "Temperatura (°C)", 
                 min_value=-5, 
                 max_value=45, 
-                value=22,
+                value=CLIMA_APP["temperatura"],
                 help="Temperatura en grados Celsius",
                 key="temp_slider"
             )
@@ -515,7 +637,7 @@ def main():
                 "Humedad (%)", 
                 min_value=0, 
                 max_value=100, 
-                value=60,
+                value=CLIMA_APP["humedad"],
                 key="humidity_slider"
             )
 
@@ -523,14 +645,14 @@ def main():
             "Sensación térmica (°C)", 
             min_value=-10, 
             max_value=50, 
-            value=22,
+            value=CLIMA_APP["sensacion_termica"],
             key="feels_like_slider"
         )
 
         codigo_clima = st.selectbox(
             "Condición meteorológica",
             options=[1, 2, 3, 4, 5],
-            index=2,
+            index=CLIMA_APP["codigo_clima"] - 1,
             format_func=lambda x: {
                 1: "☀️ Soleado - Excelente",
                 2: "⛅ Parcialmente nublado - Bueno",
@@ -541,252 +663,265 @@ def main():
             key="weather_select"
         )
 
-    predecir = st.button(
-        "🚀 Calcular tiempo de espera",
-        type="primary",
-        use_container_width=True,
-        key="predict_button_main"
-    )
+    clima = {
+        "temperatura": temperatura,
+        "humedad": humedad,
+        "sensacion_termica": sensacion_termica,
+        "codigo_clima": codigo_clima,
+    }
 
-    if predecir:
-        hora_str = hora_seleccionada.strftime("%H:%M:%S")
-        fecha_str = fecha_seleccionada.strftime("%Y-%m-%d")
+    tab_prediccion, tab_dia = st.tabs(["🎯 Predicción", "🗓️ Día completo"])
+
+    with tab_dia:
+        render_day_heatmap(fecha_seleccionada, clima, atracciones, app_metadata["zona_por_atraccion"])
+
+    with tab_prediccion:
+        predecir = st.button(
+            "🚀 Calcular tiempo de espera",
+            type="primary",
+            use_container_width=True,
+            key="predict_button_main"
+        )
+
+        if predecir:
+            hora_str = hora_seleccionada.strftime("%H:%M:%S")
+            fecha_str = fecha_seleccionada.strftime("%Y-%m-%d")
         
-        input_data = {
-            "atraccion": atraccion_seleccionada,
-            "zona": zona_auto,
-            "fecha": fecha_str,
-            "hora": hora_str,
-            "temperatura": temperatura,
-            "humedad": humedad,
-            "sensacion_termica": sensacion_termica,
-            "codigo_clima": codigo_clima
-        }
+            input_data = {
+                "atraccion": atraccion_seleccionada,
+                "zona": zona_auto,
+                "fecha": fecha_str,
+                "hora": hora_str,
+                "temperatura": temperatura,
+                "humedad": humedad,
+                "sensacion_termica": sensacion_termica,
+                "codigo_clima": codigo_clima
+            }
 
-        with st.spinner("🔮 Calculando predicción..."):
-            try:
-                resultado = predict_wait_time_api(input_data)
+            with st.spinner("🔮 Calculando predicción..."):
+                try:
+                    resultado = predict_wait_time_api(input_data)
                 
-                if resultado is None:
-                    st.error("❌ No se pudo obtener la predicción. Verifica la conexión con la API.")
-                    st.stop()
+                    if resultado is None:
+                        st.error("❌ No se pudo obtener la predicción. Verifica la conexión con la API.")
+                        st.stop()
                 
-                minutos_pred = resultado.get("minutos_predichos", 0)
+                    minutos_pred = resultado.get("minutos_predichos", 0)
                 
-                if minutos_pred < 15:
-                    gradient = "linear-gradient(135deg, #16a085 0%, #2ecc71 100%)"
-                    emoji, nivel = "🟢", "Bajo"
-                elif minutos_pred < 30:
-                    gradient = "linear-gradient(135deg, #f6d365 0%, #fda085 100%)"
-                    emoji, nivel = "🟡", "Moderado"
-                elif minutos_pred < 60:
-                    gradient = "linear-gradient(135deg, #f7971e 0%, #ffd200 100%)"
-                    emoji, nivel = "🟠", "Alto"
-                else:
-                    gradient = "linear-gradient(135deg, #ff416c 0%, #ff4b2b 100%)"
-                    emoji, nivel = "🔴", "Muy Alto"
-
-                st.markdown("## 📊 Resultados de la predicción")
+                    if minutos_pred < 15:
+                        gradient = "linear-gradient(135deg, #16a085 0%, #2ecc71 100%)"
+                        emoji, nivel = "🟢", "Bajo"
+                    elif minutos_pred < 30:
+                        gradient = "linear-gradient(135deg, #f6d365 0%, #fda085 100%)"
+                        emoji, nivel = "🟡", "Moderado"
+                    elif minutos_pred < 60:
+                        gradient = "linear-gradient(135deg, #f7971e 0%, #ffd200 100%)"
+                        emoji, nivel = "🟠", "Alto"
+                    else:
+                        gradient = "linear-gradient(135deg, #ff416c 0%, #ff4b2b 100%)"
+                        emoji, nivel = "🔴", "Muy Alto"
+
+                    st.markdown("## 📊 Resultados de la predicción")
                 
-                st.markdown(f"""
-                <div style="
-                    background-color: var(--background-color);
-                    border: 2px solid var(--border-color);
-                    border-radius: 15px;
-                    padding: 2rem;
-                    margin: 1rem 0;
-                    box-shadow: 0 8px 25px rgba(0,0,0,0.1);
-                ">
+                    st.markdown(f"""
                     <div style="
-                        text-align: center;
-                        padding: 1.5rem 1rem;
+                        background-color: var(--background-color);
+                        border: 2px solid var(--border-color);
+                        border-radius: 15px;
+                        padding: 2rem;
+                        margin: 1rem 0;
+                        box-shadow: 0 8px 25px rgba(0,0,0,0.1);
                     ">
                         <div style="
-                            font-size: 1.2rem;
-                            color: var(--text-color);
-                            margin-bottom: 0.5rem;
-                            font-weight: 500;
-                        ">
-                            {emoji} Tiempo de espera estimado
-                        </div>
-                        <div style="
-                            font-size: 4rem;
-                            font-weight: 800;
-                            margin: 0.5rem 0;
-                            background: {gradient};
-                            -webkit-background-clip: text;
-                            -webkit-text-fill-color: transparent;
-                            background-clip: text;
+                            text-align: center;
+                            padding: 1.5rem 1rem;
                         ">
-                            {minutos_pred:.0f} min
-                        </div>
-                        <div style="
-                            font-size: 1.2rem;
-                            color: var(--text-color);
-                            opacity: 0.9;
-                            margin-top: 0.5rem;
-                        ">
-                            {nivel} • {atraccion_seleccionada}
+                            <div style="
+                                font-size: 1.2rem;
+                                color: var(--text-color);
+                                margin-bottom: 0.5rem;
+                                font-weight: 500;
+                            ">
+                                {emoji} Tiempo de espera estimado
+                            </div>
+                            <div style="
+                                font-size: 4rem;
+                                font-weight: 800;
+                                margin: 0.5rem 0;
+                                background: {gradient};
+                                -webkit-background-clip: text;
+                                -webkit-text-fill-color: transparent;
+                                background-clip: text;
+                            ">
+                                {minutos_pred:.0f} min
+                            </div>
+                            <div style="
+                                font-size: 1.2rem;
+                                color: var(--text-color);
+                                opacity: 0.9;
+                                margin-top: 0.5rem;
+                            ">
+                                {nivel} • {atraccion_seleccionada}
+                            </div>
                         </div>
                     </div>
-                </div>
-                """, unsafe_allow_html=True)
+                    """, unsafe_allow_html=True)
 
-                tab1, tab2, tab3 = st.tabs(["📝 Información", "🔍 Contexto", "💡 Recomendaciones"])
+                    tab1, tab2, tab3 = st.tabs(["📝 Información", "🔍 Contexto", "💡 Recomendaciones"])
 
-                with tab1:
-                    st.markdown("### 📝 Información de la predicción")
-                    info_cols = st.columns(2)
+                    with tab1:
+                        st.markdown("### 📝 Información de la predicción")
+                        info_cols = st.columns(2)
                     
-                    with info_cols[0]:
-                        st.markdown("#### 📅 Fecha y hora")
-                        dia_semana_result = resultado.get('dia_semana', dia_semana_es.get(dia_nombre, 'N/A'))
-                        st.markdown(f"""
-                        <div style="
-                            background-color: var(--background-color);
-                            border: 1px solid var(--border-color);
-                            border-radius: 12px;
-                            padding: 1.25rem;
-                            margin: 0.5rem 0;
-                        ">
-                            <p style="color: var(--text-color); margin: 0.5rem 0;">
-                                <strong>Día de la semana:</strong> {dia_semana_result}<br>
-                                <strong>Día del mes:</strong> {resultado.get('dia_mes', fecha_seleccionada.day)}<br>
-                                <strong>Hora seleccionada:</strong> {hora_seleccionada.strftime('%H:%M')}
-                            </p>
-                        </div>
-                        """, unsafe_allow_html=True)
+                        with info_cols[0]:
+                            st.markdown("#### 📅 Fecha y hora")
+                            dia_semana_result = resultado.get('dia_semana', dia_semana_es.get(dia_nombre, 'N/A'))
+                            st.markdown(f"""
+                            <div style="
+                                background-color: var(--background-color);
+                                border: 1px solid var(--border-color);
+                                border-radius: 12px;
+                                padding: 1.25rem;
+                                margin: 0.5rem 0;
+                            ">
+                                <p style="color: var(--text-color); margin: 0.5rem 0;">
+                                    <strong>Día de la semana:</strong> {dia_semana_result}<br>
+                                    <strong>Día del mes:</strong> {resultado.get('dia_mes', fecha_seleccionada.day)}<br>
+                                    <strong>Hora seleccionada:</strong> {hora_seleccionada.strftime('%H:%M')}
+                                </p>
+                            </div>
+                            """, unsafe_allow_html=True)
                     
-                    with info_cols[1]:
-                        weather_emoji = {
-                            1: '☀️ Soleado',
-                            2: '⛅ Parcial',
-                            3: '☁️ Nublado',
-                            4: '🌧️ Lluvia',
-                            5: '⛈️ Tormenta'
-                        }.get(codigo_clima, 'N/A')
+                        with info_cols[1]:
+                            weather_emoji = {
+                                1: '☀️ Soleado',
+                                2: '⛅ Parcial',
+                                3: '☁️ Nublado',
+                                4: '🌧️ Lluvia',
+                                5: '⛈️ Tormenta'
+                            }.get(codigo_clima, 'N/A')
                         
-                        st.markdown("#### 🌦️ Condiciones")
-                        st.markdown(f"""
-                        <div style="
-                            background-color: var(--background-color);
-                            border: 1px solid var(--border-color);
-                            border-radius: 12px;
-                            padding: 1.25rem;
-                            margin: 0.5rem 0;
-                        ">
-                            <p style="color: var(--text-color); margin: 0.5rem 0;">
-                                <strong>Temperatura:</strong> {temperatura}°C<br>
-                                <strong>Humedad:</strong> {humedad}%<br>
-                                <strong>Sensación térmica:</strong> {sensacion_termica}°C<br>
-                                <strong>Condición:</strong> {weather_emoji}
-                            </p>
-                        </div>
-                        """, unsafe_allow_html=True)
-
-                with tab2:
-                    st.markdown("### 🔍 Contexto")
-                    
-                    context_items = [
-                        ("📅 Fin de semana", resultado.get('es_fin_de_semana', es_fin_semana)),
-                        ("🌉 Es puente", resultado.get('es_puente', False)),                 
-                    ]
-                    
-                    cols = st.columns(2)
-                    for i, (label, value) in enumerate(context_items):
-                        with cols[i % 2]:
+                            st.markdown("#### 🌦️ Condiciones")
                             st.markdown(f"""
                             <div style="
                                 background-color: var(--background-color);
                                 border: 1px solid var(--border-color);
                                 border-radius: 12px;
-                                padding: 1rem;
+                                padding: 1.25rem;
                                 margin: 0.5rem 0;
                             ">
+                                <p style="color: var(--text-color); margin: 0.5rem 0;">
+                                    <strong>Temperatura:</strong> {temperatura}°C<br>
+                                    <strong>Humedad:</strong> {humedad}%<br>
+                                    <strong>Sensación térmica:</strong> {sensacion_termica}°C<br>
+                                    <strong>Condición:</strong> {weather_emoji}
+                                </p>
+                            </div>
+                            """, unsafe_allow_html=True)
+
+                    with tab2:
+                        st.markdown("### 🔍 Contexto")
+                    
+                        context_items = [
+                            ("📅 Fin de semana", resultado.get('es_fin_de_semana', es_fin_semana)),
+                            ("🌉 Es puente", resultado.get('es_puente', False)),                 
+                        ]
+                    
+                        cols = st.columns(2)
+                        for i, (label, value) in enumerate(context_items):
+                            with cols[i % 2]:
+                                st.markdown(f"""
                                 <div style="
-                                    display: flex;
-                                    justify-content: space-between;
-                                    align-items: center;
+                                    background-color: var(--background-color);
+                                    border: 1px solid var(--border-color);
+                                    border-radius: 12px;
+                                    padding: 1rem;
+                                    margin: 0.5rem 0;
                                 ">
-                                    <span style="color: var(--text-color);">{label}</span>
-                                    <span style="
-                                        color: {'#16a085' if value else 'var(--text-color)'};
-                                        font-weight: 600;
-                                        opacity: {1 if value else 0.7};
+                                    <div style="
+                                        display: flex;
+                                        justify-content: space-between;
+                                        align-items: center;
                                     ">
-                                        {'Sí' if value else 'No'}
-                                    </span>
+                                        <span style="color: var(--text-color);">{label}</span>
+                                        <span style="
+                                            color: {'#16a085' if value else 'var(--text-color)'};
+                                            font-weight: 600;
+                                            opacity: {1 if value else 0.7};
+                                        ">
+                                            {'Sí' if value else 'No'}
+                                        </span>
+                                    </div>
                                 </div>
-                            </div>
-                            """, unsafe_allow_html=True)
+                                """, unsafe_allow_html=True)
 
                     
 
-                with tab3:
-                    st.markdown("### 💡 Recomendaciones")
+                    with tab3:
+                        st.markdown("### 💡 Recomendaciones")
                     
-                    recommendations = []
+                        recommendations = []
                     
-                    if minutos_pred < 15:
-                        recommendations.append(("✅", "Excelente momento", 
-                            f"El tiempo de espera es bajo ({minutos_pred:.1f} min). Aprovecha para subir ahora."))
-                    elif minutos_pred < 30:
-                        recommendations.append(("👍", "Buen momento", 
-                            f"El tiempo de espera es moderado ({minutos_pred:.1f} min). Un buen momento para hacer cola."))
-                    elif minutos_pred < 60:
-                        recommendations.append(("⚠️", "Tiempo de espera alto", 
-                            f"El tiempo de espera es alto ({minutos_pred:.1f} min). Considera planificar para otro momento o usar acceso rápido si está disponible."))
-                    else:
-                        recommendations.append(("🚫", "Tiempo de espera muy alto", 
-                            f"El tiempo de espera es muy alto ({minutos_pred:.1f} min). Te recomendamos cambiar de atracción o volver en otro momento."))
+                        if minutos_pred < 15:
+                            recommendations.append(("✅", "Excelente momento", 
+                                f"El tiempo de espera es bajo ({minutos_pred:.1f} min). Aprovecha para subir ahora."))
+                        elif minutos_pred < 30:
+                            recommendations.append(("👍", "Buen momento", 
+                                f"El tiempo de espera es moderado ({minutos_pred:.1f} min). Un buen momento para hacer cola."))
+                        elif minutos_pred < 60:
+                            recommendations.append(("⚠️", "Tiempo de espera alto", 
+                                f"El tiempo de espera es alto ({minutos_pred:.1f} min). Considera planificar para otro momento o usar acceso rápido si está disponible."))
+                        else:
+                            recommendations.append(("🚫", "Tiempo de espera muy alto", 
+                                f"El tiempo de espera es muy alto ({minutos_pred:.1f} min). Te recomendamos cambiar de atracción o volver en otro momento."))
                     
-                    if resultado.get('es_hora_pico'):
-                        recommendations.append(("⏰", "Hora pico", 
-                            "Estás en horario de mayor afluencia (11:00-16:00). Las esperas suelen ser más largas."))
+                        if resultado.get('es_hora_pico'):
+                            recommendations.append(("⏰", "Hora pico", 
+                                "Estás en horario de mayor afluencia (11:00-16:00). Las esperas suelen ser más largas."))
                     
-                    if resultado.get('es_fin_de_semana', es_fin_semana):
-                        recommendations.append(("📅", "Fin de semana", 
-                            "Los fines de semana suelen tener más visitantes. Si puedes, considera visitar entre semana."))
+                        if resultado.get('es_fin_de_semana', es_fin_semana):
+                            recommendations.append(("📅", "Fin de semana", 
+                                "Los fines de semana suelen tener más visitantes. Si puedes, considera visitar entre semana."))
                     
-                    for emoji, title, text in recommendations:
-                        with st.expander(f"{emoji} {title}", expanded=True):
-                            st.markdown(f"<div style='padding: 0.5rem 0; color: var(--text-color);'>{text}</div>", unsafe_allow_html=True)
+                        for emoji, title, text in recommendations:
+                            with st.expander(f"{emoji} {title}", expanded=True):
+                                st.markdown(f"<div style='padding: 0.5rem 0; color: var(--text-color);'>{text}</div>", unsafe_allow_html=True)
 
-            except Exception as e:
-                st.error(f"❌ Error al realizar la predicción: {str(e)}")
-                st.exception(e)  
+                except Exception as e:
+                    st.error(f"❌ Error al realizar la predicción: {str(e)}")
+                    st.exception(e)  
 
-    if not predecir:
-        st.markdown("""
-        ## 🎯 ¿Cómo funciona?
+        if not predecir:
+            st.markdown("""
+            ## 🎯 ¿Cómo funciona?
         
-        1. **Selecciona una atracción** de la lista desplegable
-        2. **Elige la fecha y hora** de tu visita
-        3. **Ajusta las condiciones meteorológicas** si lo deseas
-        4. Haz clic en **Calcular tiempo de espera**
+            1. **Selecciona una atracción** de la lista desplegable
+            2. **Elige la fecha y hora** de tu visita
+            3. **Ajusta las condiciones meteorológicas** si lo deseas
+            4. Haz clic en **Calcular tiempo de espera**
         
-        ¡Obtendrás una predicción precisa basada en datos históricos y condiciones actuales!
+            ¡Obtendrás una predicción precisa basada en datos históricos y condiciones actuales!
         
-        ### 📈 Estadísticas rápidas
-        """)
+            ### 📈 Estadísticas rápidas
+            """)
         
-        if not df.empty:
-            col1, col2, col3 = st.columns(3)
+            if app_metadata["n_registros"]:
+                col1, col2, col3 = st.columns(3)
             
-            with col1:
-                st.metric("Atracciones disponibles", len(atracciones))
+                with col1:
+                    st.metric("Atracciones disponibles", len(atracciones))
             
-            with col2:
-                st.metric("Zonas del parque", len(zonas))
+                with col2:
+                    st.metric("Zonas del parque", len(zonas))
             
-            with col3:
-                st.metric("Registros históricos", f"{len(df):,}")
-        else:
-            col1, col2 = st.columns(2)
-            with col1:
-                st.metric("Atracciones disponibles", len(atracciones))
-            with col2:
-                st.metric("Zonas del parque", len(zonas))
+                with col3:
+                    st.metric("Registros históricos", f"{app_metadata['n_registros']:,}")
+            else:
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.metric("Atracciones disponibles", len(atracciones))
+                with col2:
+                    st.metric("Zonas del parque", len(zonas))
 
     st.markdown("---")
     st.markdown("""
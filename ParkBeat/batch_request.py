@@ -0,0 +1,121 @@
+# ====================================================
+# PETICIONES EN LOTE - Array de inputs o rejilla compacta
+# ====================================================
+# Para dibujar la curva de un día el cliente hacía una llamada HTTP por
+# atracción y tramo horario. lambda_handler acepta además:
+#   - un array de inputs:             [{...}, {...}]  o  {"items": [{...}, ...]}
+#   - una rejilla compacta:           {"grid": {"fecha": "2025-07-15",
+#                                               "atracciones": ["Tornado", ...],
+#                                               "hora_inicio": "10:00",
+#                                               "hora_fin": "20:00",
+#                                               "paso_minutos": 15,
+#                                               "temperatura": 22, ...}}
+# La rejilla se expande a atracciones × tramos en [hora_inicio, hora_fin)
+# (atracción a atracción, así cada curva queda contigua). Sin "atracciones"
+# se usan todas las de los metadatos de serving; cada atracción puede ser un
+# nombre (zona tomada de los metadatos) o un dict con "atraccion" y "zona".
+#
+# Los errores que afectan a toda la petición (formato, tamaño) se devuelven
+# como BatchRequestError; los de un elemento concreto (campos que faltan,
+# atracción desconocida) se validan por elemento con validate_item, para que
+# un input malo no tumbe el resto del lote.
+
+import os
+from datetime import date
+
+MAX_BATCH_ITEMS = int(os.getenv("MAX_BATCH_ITEMS", "2500"))
+CAMPOS_REQUERIDOS = ["fecha", "hora", "atraccion", "zona"]
+CAMPOS_CLIMA = ["temperatura", "humedad", "sensacion_termica", "codigo_clima"]
+
+
+class BatchRequestError(ValueError):
+    """Petición en lote mal formada (se responde 400 a la petición entera)"""
+
+
+def is_batch_request(body):
+    return isinstance(body, list) or (isinstance(body, dict) and ("items" in body or "grid" in body))
+
+
+def _hora_a_minutos(valor, campo):
+    try:
+        horas, minutos = str(valor).strip().split(":")[:2]
+        total = int(horas) * 60 + int(minutos)
+    except (TypeError, ValueError):
+        raise BatchRequestError(f"grid.{campo} debe tener formato HH:MM")
+    if not 0 <= total <= 24 * 60:
+        raise BatchRequestError(f"grid.{campo} fuera de rango: {valor}")
+    return total
+
+
+def _expand_grid(grid, zona_por_atraccion, max_items):
+    if not isinstance(grid, dict):
+        raise BatchRequestError("grid debe ser un objeto")
+    try:
+        fecha = date.fromisoformat(str(grid.get("fecha"))).isoformat()
+    except ValueError:
+        raise BatchRequestError("grid.fecha debe tener formato YYYY-MM-DD")
+
+    inicio = _hora_a_minutos(grid.get("hora_inicio", "10:00"), "hora_inicio")
+    fin = _hora_a_minutos(grid.get("hora_fin", "20:00"), "hora_fin")
+    try:
+        paso = int(grid.get("paso_minutos", 15))
+    except (TypeError, ValueError):
+        raise BatchRequestError("grid.paso_minutos debe ser un entero")
+    if paso <= 0:
+        raise BatchRequestError("grid.paso_minutos debe ser mayor que 0")
+    minutos = list(range(inicio, fin, paso))
+    if not minutos:
+        raise BatchRequestError("grid.hora_fin debe ser posterior a grid.hora_inicio")
+
+    atracciones = grid.get("atracciones")
+    if atracciones is None:
+        atracciones = sorted(zona_por_atraccion)
+    if not isinstance(atracciones, list) or not atracciones:
+        raise BatchRequestError("grid.atracciones debe ser una lista no vacía")
+
+    n = len(atracciones) * len(minutos)
+    if n > max_items:
+        raise BatchRequestError(f"La rejilla genera {n} predicciones (máximo {max_items})")
+
+    clima = {campo: grid[campo] for campo in CAMPOS_CLIMA if campo in grid}
+    items = []
+    for atraccion in atracciones:
+        if isinstance(atraccion, dict):
+            base = {**clima, **atraccion}
+        else:
+            base = {**clima, "atraccion": atraccion}
+            # Zona de los metadatos; si no se conoce, validate_item marcará el elemento
+            if atraccion in zona_por_atraccion:
+                base["zona"] = zona_por_atraccion[atraccion]
+        for m in minutos:
+            items.append({**base, "fecha": fecha, "hora": f"{m // 60:02d}:{m % 60:02d}"})
+    return items
+
+
+def expand_batch_request(body, zona_por_atraccion=None, max_items=MAX_BATCH_ITEMS):
+    """
+    Lista de inputs individuales de una petición en lote (array, items o grid).
+
+    Lanza BatchRequestError si la petición no tiene un formato válido o supera
+    max_items; no valida cada elemento (ver validate_item).
+    """
+    zona_por_atraccion = zona_por_atraccion or {}
+    if isinstance(body, dict) and "grid" in body:
+        return _expand_grid(body["grid"], zona_por_atraccion, max_items)
+
+    items = body if isinstance(body, list) else body.get("items")
+    if not isinstance(items, list) or not items:
+        raise BatchRequestError("items debe ser una lista no vacía de inputs")
+    if len(items) > max_items:
+        raise BatchRequestError(f"El lote tiene {len(items)} inputs (máximo {max_items})")
+    return items
+
+
+def validate_item(item):
+    """Mensaje de error del input (None si es válido)"""
+    if not isinstance(item, dict):
+        return "Cada input debe ser un objeto"
+    missing = [f for f in CAMPOS_REQUERIDOS if f not in item]
+    if missing:
+        return f'Faltan campos: {", ".join(missing)}'
+    return None
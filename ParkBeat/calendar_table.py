@@ -0,0 +1,186 @@
+# ====================================================
+# CALENDARIO PRECALCULADO - Festivos, puentes y temporada por fecha
+# ====================================================
+# es_festivo_espana y es_puente se evaluaban fila a fila (df["fecha"].apply
+# en train_model.py, UDFs de Python en Spark y llamadas escalares en
+# predict.py y la Lambda), y es_puente creaba dos pd.Timedelta por fila.
+# Aquí se calcula una vez, con operaciones vectorizadas, una tabla con una
+# fila por día para [CALENDAR_YEAR_START, CALENDAR_YEAR_END]:
+#   fecha -> es_festivo, es_puente, temporada, semana_año (ISO), trimestre
+# y las features se obtienen indexando por número de día (fecha - origen),
+# sin llamadas de Python por fila. Si llega una fecha fuera del rango la
+# tabla se amplía para cubrirla.
+#
+# Las reglas son las de train_model.py:
+#   - festivos nacionales fijos (FESTIVOS_FIJOS),
+#   - puente: festivo, viernes antes de festivo, o lunes/domingo después de festivo,
+#   - temporada por mes (3 muy alta, 2 alta, 1 media, 0 baja).
+
+import os
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+CALENDAR_YEAR_START = int(os.getenv("CALENDAR_YEAR_START", "2015"))
+CALENDAR_YEAR_END = int(os.getenv("CALENDAR_YEAR_END", "2035"))
+
+FESTIVOS_FIJOS = [
+    (1, 1),    # Año Nuevo
+    (1, 6),    # Reyes
+    (5, 1),    # Día del Trabajo
+    (10, 12),  # Día de la Hispanidad
+    (11, 1),   # Todos los Santos
+    (12, 6),   # Constitución
+    (12, 8),   # Inmaculada
+    (12, 25),  # Navidad
+]
+
+# Temporada por número de mes (índice 0 sin uso): verano y Halloween muy alta,
+# primavera y Navidad alta, marzo/septiembre/noviembre media, resto baja
+TEMPORADA_POR_MES = np.array([0, 0, 0, 1, 2, 2, 2, 3, 3, 1, 3, 1, 2], dtype=np.int64)
+
+COLUMNAS_CALENDARIO = ["es_festivo", "es_puente", "temporada", "semana_año", "trimestre"]
+
+_ORDINAL_EPOCH = date(1970, 1, 1).toordinal()
+
+# Tabla del proceso (se construye en el primer uso)
+_tabla = None
+
+
+def build_calendar_table(año_inicio=CALENDAR_YEAR_START, año_fin=CALENDAR_YEAR_END):
+    """Tabla de calendario (dict de arrays alineados por día) para los años [año_inicio, año_fin]"""
+    # Un día de margen a cada lado para que los puentes del 1 de enero y el
+    # 31 de diciembre vean el día anterior/siguiente
+    idx = pd.date_range(f"{año_inicio - 1}-12-31", f"{año_fin + 1}-01-01", freq="D")
+    mes = idx.month.to_numpy(dtype=np.int64)
+    dia_semana = idx.weekday.to_numpy(dtype=np.int64)
+
+    festivo = np.isin(mes * 100 + idx.day.to_numpy(dtype=np.int64), [m * 100 + d for m, d in FESTIVOS_FIJOS])
+    anterior = np.r_[False, festivo[:-1]]
+    siguiente = np.r_[festivo[1:], False]
+    puente = (
+        festivo
+        | ((dia_semana == 4) & siguiente)  # Viernes antes de festivo
+        | ((dia_semana == 0) & anterior)  # Lunes después de festivo
+        | ((dia_semana == 6) & anterior)  # Domingo después de festivo (sábado)
+    )
+
+    dentro = slice(1, -1)
+    fechas = idx.to_numpy().astype("datetime64[D]")[dentro]
+    return {
+        "año_inicio": año_inicio,
+        "año_fin": año_fin,
+        "origen": int(fechas[0].astype(np.int64)),
+        "fecha": fechas,
+        "es_festivo": festivo[dentro].astype(np.int64),
+        "es_puente": puente[dentro].astype(np.int64),
+        "temporada": TEMPORADA_POR_MES[mes[dentro]],
+        "semana_año": idx.isocalendar().week.to_numpy(dtype=np.int64)[dentro],
+        "trimestre": idx.quarter.to_numpy(dtype=np.int64)[dentro],
+    }
+
+
+def get_calendar_table(año_min=None, año_max=None):
+    """Tabla del proceso, ampliada si [año_min, año_max] se sale del rango actual"""
+    global _tabla
+    if _tabla is None:
+        _tabla = build_calendar_table()
+    año_min = _tabla["año_inicio"] if año_min is None else año_min
+    año_max = _tabla["año_fin"] if año_max is None else año_max
+    if año_min < _tabla["año_inicio"] or año_max > _tabla["año_fin"]:
+        _tabla = build_calendar_table(min(año_min, _tabla["año_inicio"]), max(año_max, _tabla["año_fin"]))
+    return _tabla
+
+
+def calendar_columns(fechas):
+    """
+    Columnas de calendario (arrays int64) para un array de fechas.
+
+    Las fechas nulas (NaT) reciben 0 en todas las columnas; "valida" marca
+    las que no lo son.
+    """
+    if isinstance(fechas, np.ndarray) and fechas.dtype.kind == "M":
+        dias = fechas.astype("datetime64[D]")
+    else:
+        dias = pd.DatetimeIndex(fechas).to_numpy().astype("datetime64[D]")
+    valida = ~np.isnat(dias)
+    columnas = {col: np.zeros(len(dias), dtype=np.int64) for col in COLUMNAS_CALENDARIO}
+    columnas["valida"] = valida
+    if not valida.any():
+        return columnas
+
+    años = dias[valida].astype("datetime64[Y]").astype(np.int64) + 1970
+    tabla = get_calendar_table(int(años.min()), int(años.max()))
+    posiciones = dias[valida].astype(np.int64) - tabla["origen"]
+    for col in COLUMNAS_CALENDARIO:
+        columnas[col][valida] = tabla[col][posiciones]
+    return columnas
+
+
+def calendar_row(fecha):
+    """Columnas de calendario (ints) de una sola fecha (Timestamp, datetime o date)"""
+    tabla = get_calendar_table(fecha.year, fecha.year)
+    posicion = date(fecha.year, fecha.month, fecha.day).toordinal() - _ORDINAL_EPOCH - tabla["origen"]
+    return {col: int(tabla[col][posicion]) for col in COLUMNAS_CALENDARIO}
+
+
+def calendar_frame(año_inicio, año_fin):
+    """La tabla como DataFrame (fecha como datetime.date) para unirla con un DataFrame de Spark"""
+    tabla = get_calendar_table(año_inicio, año_fin)
+    dentro = (tabla["fecha"] >= np.datetime64(f"{año_inicio}-01-01")) & (tabla["fecha"] <= np.datetime64(f"{año_fin}-12-31"))
+    frame = pd.DataFrame({col: tabla[col][dentro] for col in COLUMNAS_CALENDARIO})
+    frame.insert(0, "fecha", pd.to_datetime(tabla["fecha"][dentro]).date)
+    return frame
+
+
+# Comprobación: la tabla coincide con las funciones fila a fila de train_model.py
+if __name__ == "__main__":
+    import time
+
+    def es_festivo_espana(fecha):
+        return 1 if (fecha.month, fecha.day) in FESTIVOS_FIJOS else 0
+
+    def es_puente(fecha):
+        if es_festivo_espana(fecha):
+            return 1
+        dia_anterior = fecha - pd.Timedelta(days=1)
+        dia_siguiente = fecha + pd.Timedelta(days=1)
+        if fecha.weekday() == 4 and es_festivo_espana(dia_siguiente):
+            return 1
+        if fecha.weekday() in (0, 6) and es_festivo_espana(dia_anterior):
+            return 1
+        return 0
+
+    def get_temporada(mes):
+        if mes in [7, 8, 10]:
+            return 3
+        if mes in [4, 5, 6, 12]:
+            return 2
+        if mes in [3, 9, 11]:
+            return 1
+        return 0
+
+    fechas = pd.Series(pd.date_range("2010-01-01", "2040-12-31", freq="D"))
+    inicio = time.perf_counter()
+    esperado = pd.DataFrame({
+        "es_festivo": fechas.apply(es_festivo_espana),
+        "es_puente": fechas.apply(es_puente),
+        "temporada": fechas.dt.month.apply(get_temporada),
+        "semana_año": fechas.dt.isocalendar().week.astype(np.int64),
+        "trimestre": fechas.dt.quarter,
+    })
+    t_apply = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    columnas = calendar_columns(fechas)
+    t_tabla = time.perf_counter() - inicio
+
+    diferencias = sum(int((columnas[col] != esperado[col].to_numpy()).sum()) for col in COLUMNAS_CALENDARIO)
+    muestra = pd.Timestamp("2025-12-05")
+    print(f"Días comprobados: {len(fechas)} (tabla ampliada a {_tabla['año_inicio']}-{_tabla['año_fin']})")
+    print(f"Diferencias con las funciones fila a fila: {diferencias}")
+    print(f"apply fila a fila: {t_apply * 1000:.0f} ms, tabla: {t_tabla * 1000:.1f} ms")
+    print(f"{muestra.date()}: {calendar_row(muestra)}")
+    print(f"NaT: {calendar_columns([pd.NaT, muestra])}")
+    raise SystemExit(0 if diferencias == 0 else 1)
@@ -0,0 +1,293 @@
+# ====================================================
+# CONSTRUCCIÓN DE FEATURES - Una sola implementación por columnas
+# ====================================================
+# Las ~110 features del modelo estaban escritas cuatro veces: train_model.py
+# (vectorizado sobre el DataFrame), predict.py y lambda_function.py (un dict
+# escalar por input) y train_model_pyspark.py (columnas de Spark y UDFs), y
+# ya no coincidían: los umbrales de es_hora_apertura, es_hora_pico y
+# es_hora_valle_manana de serving no eran los de entrenamiento, predict.py
+# dejaba fin_de_semana y hora_hist* a 0 y la Lambda ignoraba la
+# sensacion_termica del input.
+#
+# Aquí se calculan una sola vez, columna a columna con NumPy, para un lote de
+# cualquier tamaño:
+#   - build_base_features: fecha, hora, clima y atracción -> calendario, hora
+#     del día, cíclicas, interacciones, clima y flags especiales. La usan el
+#     entrenamiento (pandas y Spark, vía mapInPandas) y el serving.
+#   - build_historical_features / build_encoding_features: históricos hist_*
+#     con fallback global y target/frequency encoding (solo serving; en
+#     entrenamiento salen de los merges y del encoding sobre el split).
+#   - build_serving_features: inputs de la API (lista de dicts) -> columnas;
+#     build_serving_row es el envoltorio de una fila sobre el mismo código.
+#
+# Las definiciones son las de entrenamiento, que son con las que se ajustó
+# el modelo desplegado.
+
+import numpy as np
+import pandas as pd
+
+from calendar_table import calendar_columns
+from hist_index import get_hist_indexes
+from serving_stats import get_serving_stats
+
+# Franjas horarias (sobre la hora entera) con las que se entrenó el modelo
+HORA_APERTURA = (12, 13)      # apertura: 12 <= hora < 13
+HORA_PICO = (12, 16)          # pico: 12 <= hora <= 16
+HORA_VALLE_MANANA_FIN = 14    # valle de mañana: hora < 14
+HORA_VALLE_TARDE_INICIO = 18  # valle de tarde: hora > 18
+
+# Flags que train_model.py añade después de los merges de históricos
+FLAGS_ESPECIALES = [
+    "is_batman_octubre",
+    "is_octubre",
+    "is_noviembre",
+    "is_octubre_fin_semana",
+    "is_noviembre_fin_semana",
+]
+
+# Tablas hist_*: (sufijo de las columnas, claves además de la atracción, estadísticos)
+HIST_FEATURES = {
+    "hist_mes": ("mes", ["mes"], ["count", "mean", "median", "std", "p75", "p90", "p95"]),
+    "hist_hora": ("hora", ["hora_int"], ["count", "mean", "median", "std", "p75", "p90"]),
+    "hist_dia_semana": ("dia", ["dia_semana_num"], ["count", "mean", "median", "std", "p75", "p90"]),
+    "hist_mes_dia": ("mes_dia", ["mes", "dia_semana_num"], ["count", "mean", "median", "p75", "p90"]),
+    "hist_hora_dia": ("hora_dia", ["hora_int", "dia_semana_num"], ["count", "mean", "median", "p75"]),
+    "hist_mes_hora": ("mes_hora", ["mes", "hora_int"], ["count", "mean", "median", "p75"]),
+}
+
+# Columna con la hora de la fila histórica que crean los merges (siempre hay
+# coincidencia en entrenamiento, así que vale hora_int)
+HORA_HIST = ["hora_hist", "hora_hist_hd", "hora_hist_mh"]
+
+
+def parse_hora(valor):
+    """'HH:MM[:SS]' o número -> hora decimal (NaN si no se puede parsear)"""
+    try:
+        if pd.isna(valor):
+            return np.nan
+        if isinstance(valor, (int, float)):
+            return int(valor)
+        s = str(valor).strip()
+        if ":" in s:
+            parts = s.split(":")
+            hora = int(float(parts[0]))
+            minuto = int(float(parts[1])) if len(parts) > 1 else 0
+            return hora + minuto / 60.0
+        return int(float(s))
+    except (TypeError, ValueError, OverflowError):
+        return np.nan
+
+
+def parse_horas(valores, relleno=np.nan):
+    """Parsea un array de horas; cada valor distinto se parsea una sola vez"""
+    cache = {}
+    horas = np.empty(len(valores), dtype=np.float64)
+    for i, valor in enumerate(valores):
+        clave = valor if isinstance(valor, str) else repr(valor)
+        if clave not in cache:
+            hora = parse_hora(valor)
+            cache[clave] = relleno if pd.isna(hora) else hora
+        horas[i] = cache[clave]
+    return horas
+
+
+def parse_fechas(valores):
+    """Parsea una lista de fechas (las inválidas, fecha actual); cada valor distinto una sola vez"""
+    cache = {}
+    fechas = []
+    for valor in valores:
+        clave = valor if isinstance(valor, str) else repr(valor)
+        if clave not in cache:
+            fecha = pd.to_datetime(valor, errors="coerce")
+            cache[clave] = pd.Timestamp.now() if pd.isna(fecha) else fecha
+        fechas.append(cache[clave])
+    return fechas
+
+
+def _a_dias(fechas):
+    if isinstance(fechas, np.ndarray) and fechas.dtype.kind == "M":
+        return fechas.astype("datetime64[D]")
+    return pd.DatetimeIndex(fechas).to_numpy().astype("datetime64[D]")
+
+
+def build_base_features(fechas, hora, temperatura, humedad, sensacion_termica, codigo_clima, atracciones):
+    """
+    Features que no dependen de los artefactos, como dict {columna: array}.
+
+    hora y el clima deben llegar ya parseados y sin NaN; las fechas nulas
+    (NaT) dejan a NaN las componentes de fecha, como hacía .dt en pandas.
+    El orden de las claves es el de las columnas de train_model.py.
+    """
+    dias = _a_dias(fechas)
+    hora = np.asarray(hora, dtype=np.float64)
+    codigo_clima = np.asarray(codigo_clima, dtype=np.float64)
+
+    # Componentes de fecha con aritmética de datetime64 (1970-01-01 fue jueves)
+    cal = calendar_columns(dias)
+    año = dias.astype("datetime64[Y]").astype(np.int64) + 1970
+    meses = dias.astype("datetime64[M]")
+    mes = meses.astype(np.int64) % 12 + 1
+    dia_mes = (dias - meses).astype(np.int64) + 1
+    dia_semana = (dias.astype(np.int64) + 3) % 7
+    semana_año, trimestre = cal["semana_año"], cal["trimestre"]
+    if not cal["valida"].all():
+        nulas = ~cal["valida"]
+        año, mes, dia_mes, dia_semana, semana_año, trimestre = (
+            np.where(nulas, np.nan, c) for c in (año, mes, dia_mes, dia_semana, semana_año, trimestre)
+        )
+
+    fin_de_semana = (dia_semana >= 5).astype(np.int64)
+    temporada = cal["temporada"]
+    es_festivo, es_puente = cal["es_festivo"], cal["es_puente"]
+
+    hora_int = hora.astype(np.int64)
+    es_hora_apertura = ((hora_int >= HORA_APERTURA[0]) & (hora_int < HORA_APERTURA[1])).astype(np.int64)
+    es_hora_pico = ((hora_int >= HORA_PICO[0]) & (hora_int <= HORA_PICO[1])).astype(np.int64)
+    es_hora_valle_manana = (hora_int < HORA_VALLE_MANANA_FIN).astype(np.int64)
+    es_hora_valle_tarde = (hora_int > HORA_VALLE_TARDE_INICIO).astype(np.int64)
+
+    es_batman = np.fromiter(("Batman" in str(a) for a in atracciones), dtype=bool, count=len(dias))
+
+    return {
+        "hora": hora,
+        "mes": mes,
+        "fin_de_semana": fin_de_semana,
+        "temperatura": np.asarray(temperatura, dtype=np.float64),
+        "humedad": np.asarray(humedad, dtype=np.float64),
+        "sensacion_termica": np.asarray(sensacion_termica, dtype=np.float64),
+        "codigo_clima": codigo_clima,
+        "temporada": temporada,
+        "dia_mes": dia_mes,
+        "dia_semana_num": dia_semana,
+        "semana_año": semana_año,
+        "trimestre": trimestre,
+        "año": año,
+        "es_lunes": (dia_semana == 0).astype(np.int64),
+        "es_martes": (dia_semana == 1).astype(np.int64),
+        "es_miercoles": (dia_semana == 2).astype(np.int64),
+        "es_jueves": (dia_semana == 3).astype(np.int64),
+        "es_viernes": (dia_semana == 4).astype(np.int64),
+        "es_sabado": (dia_semana == 5).astype(np.int64),
+        "es_domingo": (dia_semana == 6).astype(np.int64),
+        "es_fin_de_semana": fin_de_semana,
+        "es_dia_laborable": np.isin(dia_semana, [0, 1, 2, 3, 4]).astype(np.int64),
+        **{f"es_mes_{i}": (mes == i).astype(np.int64) for i in range(1, 13)},
+        "hora_sin": np.sin(2 * np.pi * hora / 24),
+        "hora_cos": np.cos(2 * np.pi * hora / 24),
+        "mes_sin": np.sin(2 * np.pi * mes / 12),
+        "mes_cos": np.cos(2 * np.pi * mes / 12),
+        "dia_semana_sin": np.sin(2 * np.pi * dia_semana / 7),
+        "dia_semana_cos": np.cos(2 * np.pi * dia_semana / 7),
+        "dia_mes_sin": np.sin(2 * np.pi * dia_mes / 31),
+        "dia_mes_cos": np.cos(2 * np.pi * dia_mes / 31),
+        "semana_año_sin": np.sin(2 * np.pi * semana_año / 52),
+        "semana_año_cos": np.cos(2 * np.pi * semana_año / 52),
+        "hora_mes": hora * mes,
+        "hora_dia_semana": hora * dia_semana,
+        "mes_dia_semana": mes * dia_semana,
+        "fin_semana_mes": fin_de_semana * mes,
+        "temporada_dia_semana": temporada * dia_semana,
+        "es_buen_clima": np.isin(codigo_clima, [1, 2, 3]).astype(np.int64),
+        "es_mal_clima": (codigo_clima > 3).astype(np.int64),
+        "hora_int": hora_int,
+        "es_hora_apertura": es_hora_apertura,
+        "es_hora_pico": es_hora_pico,
+        "es_hora_valle_manana": es_hora_valle_manana,
+        "es_hora_valle_tarde": es_hora_valle_tarde,
+        "es_hora_valle": es_hora_valle_manana | es_hora_valle_tarde,
+        "es_festivo": es_festivo,
+        "es_puente": es_puente,
+        "hora_apertura_fin_semana": es_hora_apertura * fin_de_semana,
+        "hora_pico_puente": es_hora_pico * es_puente,
+        "puente_fin_semana": es_puente * fin_de_semana,
+        "is_batman_octubre": (es_batman & (mes == 10)).astype(np.int64),
+        "is_octubre": (mes == 10).astype(np.int64),
+        "is_noviembre": (mes == 11).astype(np.int64),
+        "is_octubre_fin_semana": ((mes == 10) & (fin_de_semana == 1)).astype(np.int64),
+        "is_noviembre_fin_semana": ((mes == 11) & (fin_de_semana == 1)).astype(np.int64),
+    }
+
+
+def build_historical_features(hist_index, serving_stats, atracciones, base):
+    """Columnas hist_* de cada fila (índice O(1) por clave) con el fallback global si no hay histórico"""
+    fallbacks = {
+        "count": 0,
+        "mean": serving_stats["global_mean"],
+        "median": serving_stats["global_median"],
+        "std": serving_stats["global_std"],
+        "p75": serving_stats["global_p75"],
+        "p90": serving_stats["global_p90"],
+        "p95": serving_stats["global_p95"],
+    }
+    columnas = {}
+    for tabla, (sufijo, claves, stats) in HIST_FEATURES.items():
+        index = hist_index[tabla]
+        filas = [index.get(clave) for clave in zip(atracciones, *(base[c].tolist() for c in claves))]
+        for stat in stats:
+            nombre = f"{stat}_{sufijo}"
+            columnas[nombre] = np.array(
+                [fila[nombre] if fila is not None and nombre in fila else fallbacks[stat] for fila in filas],
+                dtype=np.float64,
+            )
+    for nombre in HORA_HIST:
+        columnas[nombre] = base["hora_int"]
+    return columnas
+
+
+def build_encoding_features(encoding_maps, serving_stats, atracciones, zonas):
+    """Target encoding (media suavizada; media global si no se vio) y frecuencia de zona y atracción"""
+    global_mean = serving_stats["global_mean"]
+    zona_map = encoding_maps.get("zona", {})
+    atraccion_map = encoding_maps.get("atraccion", {})
+    return {
+        "zona_enc": np.array([zona_map.get(z, global_mean) for z in zonas], dtype=np.float64),
+        "zona_freq": np.array([serving_stats["zona_freq"].get(z, 0) for z in zonas], dtype=np.float64),
+        "atraccion_enc": np.array([atraccion_map.get(a, global_mean) for a in atracciones], dtype=np.float64),
+        "atraccion_freq": np.array([serving_stats["atraccion_freq"].get(a, 0) for a in atracciones], dtype=np.float64),
+    }
+
+
+def build_serving_features(inputs, artifacts):
+    """
+    Features de una lista de inputs de la API, como dict {columna: array}.
+
+    Devuelve también un contexto con las columnas ya parseadas (fechas,
+    horas, mes, día de semana...) para los ajustes posteriores.
+    """
+    serving_stats = get_serving_stats(artifacts)
+    temperatura_defecto = serving_stats["temperatura_median"] if serving_stats["temperatura_median"] is not None else 20
+    humedad_defecto = serving_stats["humedad_median"] if serving_stats["humedad_median"] is not None else 60
+
+    fechas = parse_fechas([d.get("fecha") for d in inputs])
+    horas = parse_horas([d.get("hora", "12:00:00") for d in inputs], relleno=12.0)
+    temperatura = np.array([d.get("temperatura", temperatura_defecto) for d in inputs], dtype=np.float64)
+    humedad = np.array([d.get("humedad", humedad_defecto) for d in inputs], dtype=np.float64)
+    sensacion_termica = np.array(
+        [d.get("sensacion_termica", t) for d, t in zip(inputs, temperatura)], dtype=np.float64
+    )
+    codigo_clima = np.array([d.get("codigo_clima", 3) for d in inputs], dtype=np.float64)
+    atracciones = [d.get("atraccion", "") for d in inputs]
+    zonas = [d.get("zona", "") for d in inputs]
+
+    columnas = build_base_features(fechas, horas, temperatura, humedad, sensacion_termica, codigo_clima, atracciones)
+    columnas.update(build_historical_features(get_hist_indexes(artifacts), serving_stats, atracciones, columnas))
+    columnas.update(build_encoding_features(artifacts["encoding_maps"], serving_stats, atracciones, zonas))
+
+    contexto = {
+        "fechas": fechas,
+        "horas": horas.tolist(),
+        "hora_int": columnas["hora_int"],
+        "mes": columnas["mes"],
+        "dia_mes": columnas["dia_mes"],
+        "dia_semana": columnas["dia_semana_num"],
+        "es_fin_de_semana": columnas["es_fin_de_semana"].astype(bool),
+        "es_puente": columnas["es_puente"].astype(bool),
+        "atracciones": atracciones,
+    }
+    return columnas, contexto
+
+
+def build_serving_row(input_dict, artifacts):
+    """Features de un solo input como dict {columna: valor} (mismo código que el lote)"""
+    columnas, _ = build_serving_features([input_dict], artifacts)
+    return {nombre: valores[0] for nombre, valores in columnas.items()}
@@ -0,0 +1,128 @@
+# ====================================================
+# LAYOUT DE FEATURES - Vector de entrada sin DataFrame
+# ====================================================
+# Precalcula (al cargar los artefactos) la posición de cada feature en el
+# orden del scaler, el valor por defecto de las columnas que no calcula
+# prepare_input_for_prediction y los parámetros del StandardScaler. En cada
+# predicción basta con copiar la fila de defaults, escribir las features por
+# índice y escalar con NumPy: sin pd.DataFrame ni reglas por nombre de columna.
+# Si el ensemble de árboles se exportó con el scaler plegado en los umbrales,
+# model_input no escala: el ensemble recibe directamente las features.
+
+import numpy as np
+
+from serving_stats import get_serving_stats
+
+# Relleno de columnas no calculadas
+RELLENO_CERO = "cero"      # predict.py: las columnas que falten valen 0
+RELLENO_REGLAS = "reglas"  # lambda_function.py: reglas por nombre (hora, media, mediana, freq...)
+
+
+def build_feature_layout(columnas, scaler, serving_stats, relleno=RELLENO_CERO, escalado_plegado=False):
+    """Compila posiciones, defaults y parámetros de escalado para el orden de columnas dado"""
+    columnas = list(columnas)
+    defaults = np.zeros(len(columnas), dtype=np.float64)
+    cols_hora = []  # Columnas cuyo default es la hora del input
+    cols_mes = []   # (posición, mes) de las columnas es_mes_N
+
+    if relleno == RELLENO_REGLAS:
+        # Mismas reglas que aplicaba lambda_function.py columna a columna en cada petición
+        global_mean = serving_stats["global_mean"]
+        global_median = serving_stats["global_median"]
+        for i, col in enumerate(columnas):
+            if col.startswith("es_mes_"):
+                cols_mes.append((i, int(col.split("_")[-1])))
+            elif "_hist" in col:
+                # Columnas creadas por merges con sufijos
+                if "hora" in col:
+                    cols_hora.append(i)
+                else:
+                    defaults[i] = global_median
+            elif "freq" in col:
+                defaults[i] = 0
+            elif "mean" in col:
+                defaults[i] = global_mean
+            else:
+                defaults[i] = global_median
+
+    # Parámetros del StandardScaler (X - mean_) / scale_, igual que scaler.transform
+    mean = getattr(scaler, "mean_", None) if getattr(scaler, "with_mean", False) else None
+    scale = getattr(scaler, "scale_", None) if getattr(scaler, "with_std", False) else None
+
+    return {
+        "columnas": columnas,
+        "posicion": {col: i for i, col in enumerate(columnas)},
+        "defaults": defaults,
+        "cols_hora": np.array(cols_hora, dtype=np.intp),
+        "cols_mes": cols_mes,
+        "mean": mean,
+        "scale": scale,
+        "scaler": scaler,
+        "escalado_plegado": escalado_plegado,
+    }
+
+
+def fill_feature_row(layout, features, hora=None, mes=None):
+    """Escribe las features calculadas en una fila float64 preasignada con los defaults"""
+    row = layout["defaults"].copy()
+    if len(layout["cols_hora"]):
+        row[layout["cols_hora"]] = hora
+    for i, m in layout["cols_mes"]:
+        row[i] = 1 if mes == m else 0
+
+    posicion = layout["posicion"]
+    for nombre, valor in features.items():
+        i = posicion.get(nombre)
+        if i is not None:
+            row[i] = valor
+    return row
+
+
+def fill_feature_matrix(layout, columnas, n, hora=None, mes=None):
+    """Versión por lotes de fill_feature_row: columnas es un dict {feature: array de longitud n}"""
+    X = np.tile(layout["defaults"], (n, 1))
+    if len(layout["cols_hora"]):
+        X[:, layout["cols_hora"]] = np.asarray(hora, dtype=np.float64)[:, None]
+    for i, m in layout["cols_mes"]:
+        X[:, i] = np.asarray(mes) == m
+
+    posicion = layout["posicion"]
+    for nombre, valores in columnas.items():
+        i = posicion.get(nombre)
+        if i is not None:
+            X[:, i] = valores
+    return X
+
+
+def scale_features(layout, X):
+    """Escala una fila o matriz de features con los parámetros del StandardScaler"""
+    X = np.array(X, dtype=np.float64, ndmin=2)
+    if not hasattr(layout["scaler"], "with_mean"):
+        # Scaler que no es un StandardScaler: delegar en su transform
+        return layout["scaler"].transform(X)
+    if layout["mean"] is not None:
+        X -= layout["mean"]
+    if layout["scale"] is not None:
+        X /= layout["scale"]
+    return X
+
+
+def model_input(layout, X):
+    """Entrada de predict_model: features sin escalar si el scaler está plegado en el ensemble"""
+    if layout["escalado_plegado"]:
+        return np.array(X, dtype=np.float64, ndmin=2)
+    return scale_features(layout, X)
+
+
+def get_feature_layout(artifacts, relleno=RELLENO_CERO):
+    """Devuelve el layout compilado para el tipo de relleno, construyéndolo una sola vez"""
+    clave = f"feature_layout_{relleno}"
+    if clave not in artifacts:
+        scaler = artifacts["scaler"]
+        columnas = artifacts.get("columnas_entrenamiento")
+        if not columnas:
+            columnas = list(scaler.feature_names_in_)
+        ensemble = artifacts.get("tree_ensemble")
+        plegado = ensemble is not None and bool(ensemble["escalado_plegado"])
+        artifacts[clave] = build_feature_layout(columnas, scaler, get_serving_stats(artifacts), relleno, plegado)
+    return artifacts[clave]
@@ -0,0 +1,207 @@
+# ====================================================
+# TABLA DE PREVISIONES - Próximos N días precalculados
+# ====================================================
+# Casi todo el tráfico pregunta por los próximos días, para las ~33
+# atracciones, en tramos de 15 minutos y con el clima por defecto de la app o
+# sin clima (defaults de serving): una rejilla finita. Este job recorre la
+# rejilla clima × día × tramo × atracción con predict_wait_time (el de la
+# Lambda) y guarda las respuestas en un .npz columnar (float64 + categorías
+# codificadas, solo necesita NumPy para leerse).
+#
+# lambda_handler responde desde la tabla con una búsqueda O(1) y solo hace
+# inferencia en vivo con clima personalizado o fechas fuera del horizonte.
+#
+# Uso: python forecast_table.py  (FORECAST_DIAS, FORECAST_INICIO y
+# FORECAST_SALIDA permiten cambiar horizonte, fecha inicial y fichero)
+
+import os
+from datetime import date, timedelta
+
+import numpy as np
+
+from prediction_cache import CAMPOS_CLIMA
+
+FORECAST_VERSION = 3
+
+# Clima por defecto de la app (valores iniciales de los sliders de app.py)
+CLIMA_APP = {"temperatura": 22, "humedad": 60, "sensacion_termica": 22, "codigo_clima": 3}
+# Peticiones sin clima: los campos se omiten (None en la clave canónica de
+# prediction_cache) y el modelo aplica los defaults de serving
+CLIMA_SERVING = {campo: None for campo in CAMPOS_CLIMA}
+CLIMAS_DEFECTO = [CLIMA_APP, CLIMA_SERVING]
+
+# Columnas numéricas de la respuesta (float64: se guardan exactas, incluido -0.0).
+# La Lambda puede devolver un int (p. ej. el mínimo de 5 minutos): se marca aparte
+# para que el JSON servido desde la tabla sea idéntico al de la inferencia en vivo
+COLUMNAS_VALOR = ["minutos_predichos", "prediccion_raw", "prediccion_combinada", "historico_base"]
+COLUMNAS_CATEGORICAS = ["ajuste_aplicado", "especificidad_historico"]
+
+
+def _slots(hora_inicio, hora_fin, slot_minutes):
+    """Minutos desde medianoche de cada tramo en [hora_inicio, hora_fin)"""
+    inicio = int(hora_inicio.split(":")[0]) * 60 + int(hora_inicio.split(":")[1])
+    fin = int(hora_fin.split(":")[0]) * 60 + int(hora_fin.split(":")[1])
+    return list(range(inicio, fin, slot_minutes))
+
+
+def _clima_clave(clima):
+    """Tupla de clima en el orden de la clave canónica (None si el campo se omite)"""
+    return tuple(None if clima.get(campo) is None else int(clima[campo]) for campo in CAMPOS_CLIMA)
+
+
+def build_forecast_table(predict_fn, atracciones_zonas, fecha_inicio, dias=7,
+                         hora_inicio="10:00", hora_fin="23:00", slot_minutes=15, climas=None):
+    """
+    Materializa predict_fn(input) para cada clima × día × tramo × atracción.
+
+    atracciones_zonas: lista de (atraccion, zona). Las filas se guardan en
+    orden (((clima * dias + dia) * n_slots) + slot) * n_atracciones + atraccion.
+    """
+    claves_clima = [_clima_clave(c) for c in (CLIMAS_DEFECTO if climas is None else climas)]
+    slots = _slots(hora_inicio, hora_fin, slot_minutes)
+    atracciones = [a for a, _ in atracciones_zonas]
+    zonas = [z for _, z in atracciones_zonas]
+
+    valores = {col: [] for col in COLUMNAS_VALOR}
+    categoricas = {col: [] for col in COLUMNAS_CATEGORICAS}
+    for clave_clima in claves_clima:
+        # Mismo input que el canónico de prediction_cache: sin los campos de clima omitidos
+        clima = {campo: v for campo, v in zip(CAMPOS_CLIMA, clave_clima) if v is not None}
+        for d in range(dias):
+            fecha_str = (fecha_inicio + timedelta(days=d)).isoformat()
+            for minutos in slots:
+                hora_str = f"{minutos // 60:02d}:{minutos % 60:02d}:00"
+                for atraccion, zona in atracciones_zonas:
+                    resultado = predict_fn({
+                        "fecha": fecha_str,
+                        "hora": hora_str,
+                        "atraccion": atraccion,
+                        "zona": zona,
+                        **clima,
+                    })
+                    for col in COLUMNAS_VALOR:
+                        valores[col].append(resultado[col])
+                    for col in COLUMNAS_CATEGORICAS:
+                        categoricas[col].append(resultado[col])
+
+    table = {
+        "version": np.array(FORECAST_VERSION),
+        "fecha_inicio": np.array(fecha_inicio.isoformat()),
+        "dias": np.array(dias),
+        "slot_minutes": np.array(slot_minutes),
+        "slots": np.array(slots, dtype=np.int16),
+        # Un clima por fila (NaN: campo omitido)
+        "climas": np.array([[np.nan if v is None else v for v in c] for c in claves_clima], dtype=np.float64),
+        "atracciones": np.array(atracciones),
+        "zonas": np.array(zonas),
+    }
+    for col in COLUMNAS_VALOR:
+        table[col] = np.asarray(valores[col], dtype=np.float64)
+        enteros = np.array([isinstance(v, (int, np.integer)) for v in valores[col]], dtype=bool)
+        if enteros.any():
+            table[f"{col}_entero"] = enteros
+    for col in COLUMNAS_CATEGORICAS:
+        vocabulario, codigos = np.unique(np.asarray(categoricas[col]), return_inverse=True)
+        table[f"{col}_vocab"] = vocabulario
+        table[col] = codigos.astype(np.int16)
+    return table
+
+
+def save_forecast_table(table, destino):
+    """Guarda la tabla como .npz comprimido (destino: ruta o fichero binario)"""
+    np.savez_compressed(destino, **table)
+
+
+def load_forecast_table(origen):
+    """Carga la tabla y prepara los índices de búsqueda (origen: ruta o fichero binario)"""
+    with np.load(origen, allow_pickle=False) as data:
+        table = {k: data[k] for k in data.files}
+    if int(table["version"]) != FORECAST_VERSION:
+        raise ValueError(f"Versión de tabla de previsiones no soportada: {int(table['version'])}")
+
+    slots = table["slots"].tolist()
+    table["_inicio"] = date.fromisoformat(str(table["fecha_inicio"]))
+    table["_slot_index"] = {m: i for i, m in enumerate(slots)}
+    table["_atraccion_index"] = {a: i for i, a in enumerate(table["atracciones"].tolist())}
+    table["_zonas"] = table["zonas"].tolist()
+    table["_clima_index"] = {
+        tuple(None if np.isnan(v) else int(v) for v in fila): i for i, fila in enumerate(table["climas"])
+    }
+    return table
+
+
+def lookup_forecast(table, clave):
+    """
+    Busca la respuesta precalculada para la clave canónica de prediction_cache
+    (fecha, minutos, atraccion, zona, temperatura, humedad, sensacion_termica, codigo_clima).
+    Devuelve None si la clave no está en la rejilla (clima no precalculado,
+    fecha fuera del horizonte, tramo o atracción desconocidos).
+    """
+    fecha_str, minutos, atraccion, zona, *clima = clave
+    c = table["_clima_index"].get(tuple(clima))
+    if c is None:
+        return None
+    d = (date.fromisoformat(fecha_str) - table["_inicio"]).days
+    if not 0 <= d < int(table["dias"]):
+        return None
+    s = table["_slot_index"].get(minutos)
+    a = table["_atraccion_index"].get(atraccion)
+    if s is None or a is None or table["_zonas"][a] != zona:
+        return None
+
+    fila = ((c * int(table["dias"]) + d) * len(table["_slot_index"]) + s) * len(table["_atraccion_index"]) + a
+    valores = {}
+    for col in COLUMNAS_VALOR:
+        valor = float(table[col][fila])
+        entero = table.get(f"{col}_entero")
+        valores[col] = int(valor) if entero is not None and entero[fila] else valor
+
+    # Mismo contenido y orden de claves que la respuesta de predict_wait_time en la Lambda
+    return {
+        "minutos_predichos": valores["minutos_predichos"],
+        "status": "success",
+        "atraccion": atraccion,
+        "prediccion_raw": valores["prediccion_raw"],
+        "prediccion_combinada": valores["prediccion_combinada"],
+        "historico_base": valores["historico_base"],
+        "ajuste_aplicado": str(table["ajuste_aplicado_vocab"][table["ajuste_aplicado"][fila]]),
+        "especificidad_historico": str(table["especificidad_historico_vocab"][table["especificidad_historico"][fila]]),
+    }
+
+
+# Job: materializar la tabla con los artefactos locales y el predict_wait_time de la Lambda
+if __name__ == "__main__":
+    import sys
+    import time
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-3")
+    from predict import load_model_artifacts
+    from lambda_function import predict_wait_time
+    from serving_metadata import get_serving_metadata
+
+    dias = int(os.getenv("FORECAST_DIAS", "7"))
+    fecha_inicio = date.fromisoformat(os.getenv("FORECAST_INICIO", date.today().isoformat()))
+    salida = os.getenv("FORECAST_SALIDA", "models/forecast_table.npz")
+
+    artifacts = load_model_artifacts()
+    if artifacts["scaler"] is None:
+        print("❌ No se encontraron los artefactos del modelo (ejecuta primero train_model.py)")
+        sys.exit(1)
+
+    atracciones_zonas = sorted(get_serving_metadata(artifacts)["zona_por_atraccion"].items())
+
+    print("=" * 70)
+    print(f"📅 TABLA DE PREVISIONES: {dias} días desde {fecha_inicio}, {len(atracciones_zonas)} atracciones")
+    print("=" * 70)
+
+    inicio = time.perf_counter()
+    table = build_forecast_table(
+        lambda input_dict: predict_wait_time(input_dict, artifacts),
+        atracciones_zonas, fecha_inicio, dias=dias,
+    )
+    save_forecast_table(table, salida)
+
+    filas = len(table["minutos_predichos"])
+    print(f"✅ {filas} predicciones en {time.perf_counter() - inicio:.1f}s → {salida} "
+          f"({os.path.getsize(salida) / 1024:.0f} KB)")
+    print(f"   Subir a S3: aws s3 cp {salida} s3://<bucket>/models/forecast_table.npz")
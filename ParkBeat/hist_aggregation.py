@@ -0,0 +1,330 @@
+# ====================================================
+# AGREGACIÓN DE HISTÓRICOS - count/mean/std/cuantiles por segmentos NumPy
+# ====================================================
+# Las seis tablas hist_* de train_model.py se calculaban con
+# groupby(...).agg(...) y un lambda np.percentile por cuantil: una llamada de
+# Python por grupo y cuantil, y cada tabla volvía a ordenar los mismos datos.
+#
+# Aquí:
+#   1. tiempo_espera se ordena una sola vez (argsort global),
+#   2. cada clave (atracción + mes/hora/día...) se codifica como un entero
+#      en orden lexicográfico de sus columnas (pd.factorize ordenado) y las
+#      filas, ya ordenadas por valor, se reparten por código con un argsort
+#      estable de enteros pequeños (radix sort, O(n)): cada grupo queda
+#      contiguo y ordenado por tiempo_espera sin volver a comparar valores,
+#   3. count, mean, std y los cuantiles salen de operaciones por segmento
+#      (np.add.reduceat e índices de inicio de grupo), sin Python por grupo.
+# Los cuantiles usan la interpolación lineal de np.percentile (mismo índice
+# virtual y mismo _lerp), así que coinciden bit a bit con el groupby
+# anterior; mean y std coinciden hasta el redondeo de la suma.
+#
+# Las filas con alguna clave nula se descartan (como dropna=True de groupby)
+# y el orden de salida es el de groupby(sort=True).
+#
+# attach_hist_features sustituye a los seis df.merge de train_model.py: el
+# grupo de cada fila (calculado en la misma pasada) indexa directamente las
+# columnas de cada tabla con np.take y las escribe en df sin copiarlo. Los
+# huecos (grupo sin estadístico o fila sin grupo) se rellenan en la tabla, una
+# vez por grupo, y no columna a columna por nombre sobre todo el DataFrame.
+
+import numpy as np
+import pandas as pd
+
+from feature_builder import HIST_FEATURES, HORA_HIST
+
+CUANTILES = {"median": 50, "p75": 75, "p90": 90, "p95": 95}
+
+# Columna con la hora de la tabla que añadían los merges (sufijos _hist, _hist_hd, _hist_mh)
+COLUMNA_HORA_HIST = dict(zip([n for n, (_, claves, _) in HIST_FEATURES.items() if "hora_int" in claves], HORA_HIST))
+
+# Columnas clave renombradas en las tablas hist_* (como en train_model.py)
+RENOMBRAR_CLAVES = {"hora_int": "hora"}
+
+
+def _codigos_grupo(codigos_columnas):
+    """Código entero por fila (orden lexicográfico de las columnas) a partir de los códigos de cada columna"""
+    codigos = np.zeros(len(codigos_columnas[0][0]), dtype=np.int64)
+    for c, u in codigos_columnas:
+        codigos = codigos * len(u) + c
+    return codigos
+
+
+def _particion_estable(codigos):
+    """Permutación estable que agrupa los códigos (radix sort si caben en 16 bits)"""
+    maximo = int(codigos.max()) if len(codigos) else 0
+    tipo = np.uint16 if maximo < 2 ** 16 else (np.uint32 if maximo < 2 ** 32 else np.int64)
+    return np.argsort(codigos.astype(tipo, copy=False), kind="stable")
+
+
+def indices_cuantil(counts, q):
+    """Posiciones (anterior, siguiente) e interpolación gamma de np.percentile(q) en grupos de counts valores"""
+    virtual = (counts - 1) * (q / 100)
+    anterior = np.floor(virtual)
+    gamma = virtual - anterior
+    anterior = anterior.astype(np.int64)
+    siguiente = np.minimum(anterior + 1, counts - 1)
+    return anterior, siguiente, gamma
+
+
+def lerp_cuantil(a, b, gamma):
+    """Mismo _lerp que NumPy: a + (b-a)*t, o b - (b-a)*(1-t) si t >= 0.5"""
+    diff = b - a
+    return np.where(gamma >= 0.5, b - diff * (1 - gamma), a + diff * gamma)
+
+
+def _cuantil_segmentos(valores, inicios, counts, q):
+    """np.percentile(grupo, q) con interpolación lineal para cada segmento ordenado"""
+    anterior, siguiente, gamma = indices_cuantil(counts, q)
+    return lerp_cuantil(valores[inicios + anterior], valores[inicios + siguiente], gamma)
+
+
+def aggregate_segments(valores_ordenados, inicios, counts, stats):
+    """Estadísticos de cada segmento contiguo y ordenado de valores_ordenados"""
+    resultado = {}
+    if "count" in stats:
+        resultado["count"] = counts.astype(np.int64)
+    suma = np.add.reduceat(valores_ordenados, inicios)
+    media = suma / counts
+    if "mean" in stats:
+        resultado["mean"] = media
+    for stat in stats:
+        if stat in CUANTILES:
+            resultado[stat] = _cuantil_segmentos(valores_ordenados, inicios, counts, CUANTILES[stat])
+        elif stat == "std":
+            desv = valores_ordenados - np.repeat(media, counts)
+            ss = np.add.reduceat(desv * desv, inicios)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                resultado["std"] = np.where(counts > 1, np.sqrt(ss / (counts - 1)), np.nan)
+    return {stat: resultado[stat] for stat in stats}
+
+
+def aggregate_hist_tables(df, tablas=HIST_FEATURES, columna="tiempo_espera", renombrar=RENOMBRAR_CLAVES,
+                          devolver_grupos=False):
+    """
+    Tablas hist_* ({nombre: DataFrame}) con el layout de train_model.py:
+    atraccion, claves (hora_int renombrada a hora) y <stat>_<sufijo>.
+
+    Con devolver_grupos=True devuelve también, por tabla, la fila de la
+    tabla que corresponde a cada fila de df (-1 si no tiene grupo).
+    """
+    valores = df[columna].to_numpy(dtype=np.float64)
+    # Única ordenación por valor; el resto son particiones estables por clave
+    orden_valor = np.argsort(valores)
+    orden_valor = orden_valor[~np.isnan(valores[orden_valor])]
+    valores_por_valor = valores[orden_valor]
+
+    # Cada columna clave se codifica una sola vez (en el orden por valor), para todas las tablas
+    codigos_columna = {}
+    for _, claves, _ in tablas.values():
+        for col in ["atraccion"] + claves:
+            if col not in codigos_columna:
+                c, u = pd.factorize(df[col], sort=True)
+                codigos_columna[col] = (c[orden_valor], u)
+
+    resultado, grupos = {}, {}
+    for nombre, (sufijo, claves, stats) in tablas.items():
+        columnas = ["atraccion"] + claves
+        codigos_columnas = [codigos_columna[col] for col in columnas]
+        codigos = _codigos_grupo(codigos_columnas)
+        valores_tabla, filas = valores_por_valor, orden_valor
+        # Claves nulas (código -1): fuera, como dropna=True de groupby
+        validas = np.logical_and.reduce([c >= 0 for c, _ in codigos_columnas])
+        if not validas.all():
+            codigos, valores_tabla, filas = codigos[validas], valores_tabla[validas], filas[validas]
+
+        orden = _particion_estable(codigos)
+        codigos_ordenados = codigos[orden]
+        valores_ordenados = valores_tabla[orden]
+
+        if len(orden):
+            inicios = np.flatnonzero(np.r_[True, codigos_ordenados[1:] != codigos_ordenados[:-1]])
+        else:
+            inicios = np.zeros(0, dtype=np.int64)
+        counts = np.diff(np.r_[inicios, len(orden)])
+        if devolver_grupos:
+            grupo = np.full(len(df), -1, dtype=np.int64)
+            grupo[filas[orden]] = np.repeat(np.arange(len(inicios)), counts)
+            grupos[nombre] = grupo
+
+        # Columnas clave de cada grupo, deshaciendo el código mixto (última columna primero)
+        claves_grupo = []
+        codigo_grupo = codigos_ordenados[inicios]
+        for _, u in reversed(codigos_columnas):
+            codigo_grupo, c = np.divmod(codigo_grupo, len(u))
+            claves_grupo.append(u.take(c))
+        tabla = {renombrar.get(col, col): v for col, v in zip(columnas, reversed(claves_grupo))}
+        if len(orden):
+            agregados = aggregate_segments(valores_ordenados, inicios, counts, stats)
+        else:
+            agregados = {stat: np.zeros(0) for stat in stats}
+        tabla.update({f"{stat}_{sufijo}": valores_stat for stat, valores_stat in agregados.items()})
+        resultado[nombre] = pd.DataFrame(tabla)
+    return (resultado, grupos) if devolver_grupos else resultado
+
+
+def attach_hist_features(df, hist_tablas, grupos, rellenos, tablas=HIST_FEATURES):
+    """
+    Añade a df, en su sitio, las columnas de las tablas hist_* en el orden en
+    que las añadían los merges (incluidas hora_hist*). grupos son posiciones de
+    fila, así que el índice de df no interviene.
+
+    rellenos: valor por estadístico ("count", "mean", "std", "p75"...) para los
+    grupos sin valor y las filas sin grupo.
+
+    Cada columna se escribe con np.take directamente en df: no se construye un
+    DataFrame intermedio ni se copian las columnas que ya tenía df.
+    """
+    # Tabla a tabla: valores de cada columna (con el relleno en una posición extra)
+    # tomados por el índice de fila de la tabla, que se libera antes de la siguiente
+    for nombre, (sufijo, claves, stats) in tablas.items():
+        tabla, grupo = hist_tablas[nombre], grupos[nombre]
+        sin_grupo = grupo < 0
+        hay_sin_grupo = sin_grupo.any()
+        # Las filas sin grupo apuntan a la posición extra
+        indice = np.where(sin_grupo, len(tabla), grupo) if hay_sin_grupo else grupo
+        if nombre in COLUMNA_HORA_HIST:
+            horas = tabla["hora"].to_numpy()
+            if hay_sin_grupo:
+                horas = np.r_[horas.astype(np.float64), np.nan]
+            df[COLUMNA_HORA_HIST[nombre]] = np.take(horas, indice)
+        for stat in stats:
+            valores = tabla[f"{stat}_{sufijo}"].to_numpy()
+            relleno = rellenos[stat]
+            if valores.dtype.kind == "f":
+                valores = np.where(np.isnan(valores), relleno, valores)
+            df[f"{stat}_{sufijo}"] = np.take(np.r_[valores, relleno], indice)
+
+
+# Comprobación y benchmark frente al groupby con lambdas y los merges de train_model.py:
+#   python hist_aggregation.py [filas]
+if __name__ == "__main__":
+    import sys
+    import time
+    import tracemalloc
+
+    def hist_tables_groupby(df):
+        """Implementación anterior (groupby + lambda np.percentile por cuantil)"""
+        tablas = {}
+        for nombre, (sufijo, claves, stats) in HIST_FEATURES.items():
+            aggs = {}
+            for stat in stats:
+                if stat in CUANTILES and stat != "median":
+                    aggs[f"{stat}_{sufijo}"] = (lambda q: lambda x: np.percentile(x, q))(CUANTILES[stat])
+                else:
+                    aggs[f"{stat}_{sufijo}"] = stat
+            tabla = df.groupby(["atraccion"] + claves)["tiempo_espera"].agg(**aggs).reset_index()
+            tablas[nombre] = tabla.rename(columns={"hora_int": "hora"})
+        return tablas
+
+    def attach_merges(df, tablas, rellenos):
+        """Implementación anterior (seis df.merge y fillna por nombre de columna)"""
+        df = df.merge(tablas["hist_mes"], on=["atraccion", "mes"], how="left")
+        df = df.merge(tablas["hist_hora"], left_on=["atraccion", "hora_int"], right_on=["atraccion", "hora"], how="left", suffixes=("", "_hist"))
+        df = df.merge(tablas["hist_dia_semana"], on=["atraccion", "dia_semana_num"], how="left")
+        df = df.merge(tablas["hist_mes_dia"], on=["atraccion", "mes", "dia_semana_num"], how="left")
+        df = df.merge(tablas["hist_hora_dia"], left_on=["atraccion", "hora_int", "dia_semana_num"], right_on=["atraccion", "hora", "dia_semana_num"], how="left", suffixes=("", "_hist_hd"))
+        df = df.merge(tablas["hist_mes_hora"], left_on=["atraccion", "mes", "hora_int"], right_on=["atraccion", "mes", "hora"], how="left", suffixes=("", "_hist_mh"))
+        for col in df.columns:
+            for stat in ["count", "mean", "median", "std", "p75", "p90", "p95"]:
+                if (col.startswith("count_") if stat == "count" else stat in col):
+                    df[col] = df[col].fillna(rellenos[stat])
+                    break
+        return df
+
+    def attach_indexado(df, tablas, grupos, rellenos):
+        # Misma salida que los merges (índice 0..n-1); reset_index no copia los datos
+        df = df.reset_index(drop=True)
+        attach_hist_features(df, tablas, grupos, rellenos)
+        return df
+
+    def comparar_frames(a, b):
+        assert list(a.columns) == list(b.columns), (list(a.columns), list(b.columns))
+        return sum(
+            int((~((a[c].to_numpy() == b[c].to_numpy()) | (pd.isna(a[c]).to_numpy() & pd.isna(b[c]).to_numpy()))).sum())
+            for c in a.columns
+        )
+
+    def pico_mb(funcion, *args):
+        tracemalloc.start()
+        inicio = time.perf_counter()
+        resultado = funcion(*args)
+        segundos = time.perf_counter() - inicio
+        pico = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+        return resultado, segundos, pico
+
+    def datos_sinteticos(n, semilla=0):
+        rng = np.random.default_rng(semilla)
+        atracciones = np.array([f"Atracción {i:02d}" for i in range(33)], dtype=object)
+        hora = rng.integers(9 * 4, 22 * 4, n) / 4
+        return pd.DataFrame({
+            "atraccion": atracciones[rng.integers(0, 33, n)],
+            "mes": rng.integers(1, 13, n),
+            "hora": hora,
+            "hora_int": hora.astype(np.int64),
+            "dia_semana_num": rng.integers(0, 7, n),
+            "tiempo_espera": rng.gamma(2.0, 12.0, n).round(),
+        })
+
+    def comparar(esperado, obtenido):
+        diferencia_max, cuantiles_distintos = 0.0, 0
+        for nombre in HIST_FEATURES:
+            a, b = esperado[nombre], obtenido[nombre]
+            assert list(a.columns) == list(b.columns), (nombre, list(a.columns), list(b.columns))
+            assert len(a) == len(b), nombre
+            for col in a.columns:
+                if not pd.api.types.is_float_dtype(a[col]) or col.startswith("count_"):
+                    assert (a[col].to_numpy() == b[col].to_numpy()).all(), (nombre, col)
+                    continue
+                x, y = a[col].to_numpy(dtype=np.float64), b[col].to_numpy(dtype=np.float64)
+                if col.split("_")[0] in CUANTILES:
+                    cuantiles_distintos += int((~((x == y) | (np.isnan(x) & np.isnan(y)))).sum())
+                else:
+                    diferencia_max = max(diferencia_max, float(np.nanmax(np.abs(x - y), initial=0)))
+        return diferencia_max, cuantiles_distintos
+
+    filas = int(sys.argv[1]) if len(sys.argv) > 1 else 3_000_000
+    errores = 0
+
+    # Exactitud sobre un conjunto pequeño (grupos de 1, 2... filas incluidos)
+    pequeño = datos_sinteticos(5_000, semilla=1)
+    diferencia, distintos = comparar(hist_tables_groupby(pequeño), aggregate_hist_tables(pequeño))
+    print(f"5.000 filas: cuantiles distintos {distintos}, diferencia máxima mean/std {diferencia:.2e}")
+    errores += distintos > 0 or diferencia > 1e-9
+
+    grande = datos_sinteticos(filas)
+    inicio = time.perf_counter()
+    esperado = hist_tables_groupby(grande)
+    t_groupby = time.perf_counter() - inicio
+    inicio = time.perf_counter()
+    obtenido = aggregate_hist_tables(grande)
+    t_segmentos = time.perf_counter() - inicio
+    diferencia, distintos = comparar(esperado, obtenido)
+    grupos = sum(len(t) for t in obtenido.values())
+    print(f"{filas:,} filas, {grupos:,} grupos en 6 tablas: cuantiles distintos {distintos}, "
+          f"diferencia máxima mean/std {diferencia:.2e}")
+    print(f"groupby + lambdas: {t_groupby:.2f} s, segmentos NumPy: {t_segmentos:.2f} s "
+          f"({t_groupby / t_segmentos:.1f}x)")
+    errores += distintos > 0 or diferencia > 1e-9
+
+    # Añadir históricos: índices de grupo + take frente a merges + fillna.
+    # Con claves nulas (filas sin grupo) y grupos de una fila (std NaN)
+    rellenos = {"count": 0, "mean": -1.0, "median": -2.0, "std": -3.0, "p75": -4.0, "p90": -5.0, "p95": -6.0}
+    pequeño["mes"] = pequeño["mes"].astype(np.float64).mask(np.arange(len(pequeño)) % 97 == 0)
+    tablas, grupos = aggregate_hist_tables(pequeño, devolver_grupos=True)
+    distintos = comparar_frames(attach_merges(pequeño, tablas, rellenos), attach_indexado(pequeño, tablas, grupos, rellenos))
+    print(f"5.000 filas con claves nulas: valores distintos merges/indexado {distintos}")
+    errores += distintos > 0
+
+    tablas, grupos = aggregate_hist_tables(grande, devolver_grupos=True)
+    mb_frame = grande.memory_usage(deep=False).sum() / 2 ** 20
+    con_merges, t_merges, pico_merges = pico_mb(attach_merges, grande, tablas, rellenos)
+    indexado, t_indexado, pico_indexado = pico_mb(attach_indexado, grande, tablas, grupos, rellenos)
+    distintos = comparar_frames(con_merges, indexado)
+    mb_resultado = indexado.memory_usage(deep=False).sum() / 2 ** 20 - mb_frame
+    print(f"Añadir históricos a {filas:,} filas (columnas nuevas {mb_resultado:.0f} MB, entrada {mb_frame:.0f} MB): "
+          f"valores distintos {distintos}")
+    print(f"merges + fillna: {t_merges:.2f} s, pico {pico_merges:.0f} MB; "
+          f"grupos + take: {t_indexado:.2f} s, pico {pico_indexado:.0f} MB")
+    errores += distintos > 0
+    raise SystemExit(1 if errores else 0)
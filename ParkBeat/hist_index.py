@@ -0,0 +1,56 @@
+# ====================================================
+# ÍNDICE DE HISTÓRICOS - Búsqueda O(1) por clave
+# ====================================================
+# Convierte las tablas hist_* (DataFrames) en diccionarios indexados por
+# tupla (atraccion, mes, hora, dia_semana_num...) al cargar los artefactos,
+# para que cada predicción no tenga que filtrar las tablas completas.
+
+# Claves de cada tabla histórica (mismo orden que los groupby de train_model.py)
+HIST_KEYS = {
+    "hist_mes": ["atraccion", "mes"],
+    "hist_hora": ["atraccion", "hora"],
+    "hist_dia_semana": ["atraccion", "dia_semana_num"],
+    "hist_mes_dia": ["atraccion", "mes", "dia_semana_num"],
+    "hist_hora_dia": ["atraccion", "hora", "dia_semana_num"],
+    "hist_mes_hora": ["atraccion", "mes", "hora"],
+}
+
+
+def build_hist_index(hist_df, keys):
+    """Convierte una tabla hist_* en un dict {(atraccion, ...): {columna: valor}}"""
+    if hist_df is None or hist_df.empty:
+        return {}
+
+    # Los históricos generados con PySpark usan 'hora_int' en lugar de 'hora'
+    keys = [k if k in hist_df.columns or k != "hora" else "hora_int" for k in keys]
+    if any(k not in hist_df.columns for k in keys):
+        return {}
+
+    value_cols = [c for c in hist_df.columns if c not in keys]
+    key_values = zip(*(hist_df[k].tolist() for k in keys))
+    records = hist_df[value_cols].to_dict("records")
+
+    index = {}
+    for key, row in zip(key_values, records):
+        try:
+            key = (key[0],) + tuple(int(v) for v in key[1:])
+        except (TypeError, ValueError):
+            continue
+        # Igual que .values[0]: si hubiera claves repetidas, gana la primera fila
+        index.setdefault(key, row)
+    return index
+
+
+def build_hist_indexes(artifacts):
+    """Construye el índice de todas las tablas hist_* presentes en los artefactos"""
+    return {
+        name: build_hist_index(artifacts.get(name), keys)
+        for name, keys in HIST_KEYS.items()
+    }
+
+
+def get_hist_indexes(artifacts):
+    """Devuelve el índice de históricos, construyéndolo una sola vez si no existe"""
+    if "hist_index" not in artifacts:
+        artifacts["hist_index"] = build_hist_indexes(artifacts)
+    return artifacts["hist_index"]
@@ -0,0 +1,285 @@
+# ====================================================
+# SKETCHES DE HISTÓRICOS - Estadísticos hist_* actualizables por ingesta
+# ====================================================
+# Las tablas hist_* (count, mean, std y p50/p75/p90/p95 por atracción y
+# mes/hora/día) solo se recalculaban reagregando todo el dataset en
+# train_model.py. Aquí se guarda, por tabla y clave, un resumen fusionable:
+#   - count, mean y M2 (Welford; la fusión de dos resúmenes es la de Chan),
+#   - un histograma disperso de tiempo_espera en bins de SKETCH_RESOLUTION
+#     minutos, en arrays (clave, bin, count) ordenados.
+# Los tiempos de espera son minutos enteros (múltiplos de 5 en queue-times),
+# así que con la resolución por defecto (1 minuto) el histograma es exacto:
+# los cuantiles coinciden con np.percentile, y el tamaño queda acotado por
+# los valores distintos de cada clave, no por el número de filas. Un t-digest o
+# un KLL darían cuantiles aproximados sin ahorrar espacio con estos datos.
+#
+# train_model.py construye los sketches con el mismo df que las tablas
+# (models/hist_sketches.pkl). En cada ingesta, update_hist_sketches lee las
+# filas de tiempos_final.csv posteriores a su marca de agua, las resume,
+# fusiona el resumen y reescribe las tablas hist_*.pkl y los históricos del
+# bundle de serving. El coste depende de las filas nuevas y del número de claves,
+# no del histórico. El cubo de cuantiles y df_processed se quedan como en el
+# último entrenamiento completo.
+
+import os
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from feature_builder import HIST_FEATURES, parse_horas
+from hist_aggregation import CUANTILES, RENOMBRAR_CLAVES, indices_cuantil, lerp_cuantil
+from serving_bundle import BUNDLE_FILENAME, load_serving_bundle, save_serving_bundle
+from training_watermark import load_new_rows
+
+SKETCH_RESOLUTION = float(os.getenv("SKETCH_RESOLUTION", "1.0"))
+SKETCH_DATA_PATH = os.getenv("SKETCH_DATA_PATH", "../data/clean/tiempos_final.csv")
+SKETCH_MODELS_DIR = os.getenv("SKETCH_MODELS_DIR", "models")
+
+SKETCHES_FILENAME = "hist_sketches.pkl"
+SKETCH_VERSION = 1
+
+
+def _compactar(clave, bins, counts):
+    """Histograma ordenado por (clave, bin) con los counts de entradas repetidas sumados"""
+    orden = np.lexsort((bins, clave))
+    clave, bins, counts = clave[orden], bins[orden], counts[orden]
+    if len(clave) == 0:
+        return clave, bins, counts
+    inicios = np.flatnonzero(np.r_[True, (clave[1:] != clave[:-1]) | (bins[1:] != bins[:-1])])
+    return clave[inicios], bins[inicios], np.add.reduceat(counts, inicios)
+
+
+def _agrupar_claves(claves):
+    """Código de grupo por fila (orden de groupby(sort=True)) y claves únicas como DataFrame"""
+    grupos = claves.groupby(list(claves.columns), sort=True)
+    return grupos.ngroup().to_numpy(dtype=np.int64), grupos.size().index.to_frame(index=False)
+
+
+def sketch_table(claves, valores, resolucion=SKETCH_RESOLUTION):
+    """Sketch de una tabla a partir de las claves de cada fila (DataFrame) y sus valores"""
+    validas = claves.notna().all(axis=1).to_numpy() & ~np.isnan(valores)
+    claves, valores = claves[validas], valores[validas]
+    codigos, unicas = _agrupar_claves(claves)
+
+    count = np.bincount(codigos, minlength=len(unicas)).astype(np.float64)
+    with np.errstate(invalid="ignore"):
+        mean = np.bincount(codigos, weights=valores, minlength=len(unicas)) / count
+    m2 = np.bincount(codigos, weights=(valores - mean[codigos]) ** 2, minlength=len(unicas))
+    bins = np.rint(valores / resolucion).astype(np.int64)
+    hist_clave, hist_bin, hist_count = _compactar(codigos, bins, np.ones(len(codigos), dtype=np.int64))
+    return {
+        "claves": unicas, "count": count, "mean": mean, "m2": m2,
+        "hist_clave": hist_clave, "hist_bin": hist_bin, "hist_count": hist_count,
+    }
+
+
+def merge_sketch_tables(a, b):
+    """Fusión de dos sketches de la misma tabla (count/mean/M2 con la fórmula de Chan)"""
+    ids, unicas = _agrupar_claves(pd.concat([a["claves"], b["claves"]], ignore_index=True))
+    ids_a, ids_b = ids[:len(a["claves"])], ids[len(a["claves"]):]
+
+    def alinear(sketch, ids_sketch, campo):
+        columna = np.zeros(len(unicas))
+        columna[ids_sketch] = sketch[campo]
+        return columna
+
+    n_a, n_b = alinear(a, ids_a, "count"), alinear(b, ids_b, "count")
+    mean_a, mean_b = alinear(a, ids_a, "mean"), alinear(b, ids_b, "mean")
+    count = n_a + n_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * n_b / count
+    m2 = alinear(a, ids_a, "m2") + alinear(b, ids_b, "m2") + delta ** 2 * n_a * n_b / count
+
+    hist_clave, hist_bin, hist_count = _compactar(
+        np.r_[ids_a[a["hist_clave"]], ids_b[b["hist_clave"]]],
+        np.r_[a["hist_bin"], b["hist_bin"]],
+        np.r_[a["hist_count"], b["hist_count"]],
+    )
+    return {
+        "claves": unicas, "count": count, "mean": mean, "m2": m2,
+        "hist_clave": hist_clave, "hist_bin": hist_bin, "hist_count": hist_count,
+    }
+
+
+def sketch_quantile(sketch, q, resolucion):
+    """np.percentile(q) de cada clave a partir del histograma (exacto si los valores caen en bins)"""
+    count = sketch["count"].astype(np.int64)
+    acumulado = np.cumsum(sketch["hist_count"])
+    # Primera posición global de cada clave en el orden (clave, valor)
+    base = np.cumsum(count) - count
+    anterior, siguiente, gamma = indices_cuantil(count, q)
+    valor = sketch["hist_bin"] * resolucion
+    a = valor[np.searchsorted(acumulado, base + anterior, side="right")]
+    b = valor[np.searchsorted(acumulado, base + siguiente, side="right")]
+    return lerp_cuantil(a, b, gamma)
+
+
+def build_hist_sketches(df, watermark, q_low, q_high, tablas=HIST_FEATURES, columna="tiempo_espera",
+                        resolucion=SKETCH_RESOLUTION):
+    """
+    Sketches de todas las tablas desde un df con atraccion, las columnas clave
+    (mes, hora_int, dia_semana_num) y columna. watermark, q_low y q_high son
+    los del entrenamiento (training_state.json): marcan qué filas faltan por
+    añadir y con qué filtro de outliers.
+    """
+    valores = df[columna].to_numpy(dtype=np.float64)
+    sketches = {
+        nombre: sketch_table(df[["atraccion"] + claves], valores, resolucion)
+        for nombre, (_, claves, _) in tablas.items()
+    }
+    # Tipos de las columnas clave en las tablas de entrenamiento (mes es int32, hora int64...)
+    tipos = {col: str(df[col].dtype) for _, claves, _ in tablas.values() for col in claves}
+    return {
+        "version": SKETCH_VERSION,
+        "resolucion": resolucion,
+        "watermark": watermark,
+        "q_low": float(q_low),
+        "q_high": float(q_high),
+        "tipos": tipos,
+        "filas": int(len(df)),
+        "tablas": sketches,
+    }
+
+
+def sketch_key_columns(filas):
+    """Columnas clave de las filas de tiempos_final.csv, como las calcula train_model.py"""
+    fechas = pd.to_datetime(filas["fecha"], errors="coerce")
+    horas = parse_horas(filas["hora"].to_numpy(dtype=object))
+    return pd.DataFrame({
+        "atraccion": filas["atraccion"].to_numpy(),
+        "mes": fechas.dt.month.to_numpy(),
+        "hora_int": np.floor(horas),
+        "dia_semana_num": fechas.dt.dayofweek.to_numpy(),
+        "tiempo_espera": filas["tiempo_espera"].to_numpy(dtype=np.float64),
+    })
+
+
+def hist_tables_from_sketches(sketches, tablas=HIST_FEATURES):
+    """Tablas hist_* ({nombre: DataFrame}) con el layout de aggregate_hist_tables"""
+    resultado = {}
+    for nombre, (sufijo, claves, stats) in tablas.items():
+        sketch = sketches["tablas"][nombre]
+        tabla = sketch["claves"].copy()
+        for col in claves:
+            tabla[col] = tabla[col].astype(sketches["tipos"][col])
+        tabla = tabla.rename(columns=RENOMBRAR_CLAVES)
+        count = sketch["count"]
+        for stat in stats:
+            if stat == "count":
+                tabla[f"count_{sufijo}"] = count.astype(np.int64)
+            elif stat == "mean":
+                tabla[f"mean_{sufijo}"] = sketch["mean"]
+            elif stat == "std":
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    tabla[f"std_{sufijo}"] = np.where(count > 1, np.sqrt(sketch["m2"] / (count - 1)), np.nan)
+            else:
+                tabla[f"{stat}_{sufijo}"] = sketch_quantile(sketch, CUANTILES[stat], sketches["resolucion"])
+        resultado[nombre] = tabla
+    return resultado
+
+
+def save_hist_sketches(sketches, directorio=SKETCH_MODELS_DIR):
+    ruta = os.path.join(directorio, SKETCHES_FILENAME)
+    joblib.dump(sketches, ruta + ".tmp")
+    os.replace(ruta + ".tmp", ruta)
+
+
+def export_hist_tables(hist_tablas, directorio=SKETCH_MODELS_DIR):
+    """Reescribe hist_*.pkl y, si existe, los históricos del bundle de serving"""
+    for nombre, tabla in hist_tablas.items():
+        joblib.dump(tabla, os.path.join(directorio, f"{nombre}.pkl"))
+
+    ruta = os.path.join(directorio, BUNDLE_FILENAME)
+    if not os.path.exists(ruta):
+        return False
+    # Se lee en memoria (no mapeado) porque se va a sustituir el mismo fichero
+    with open(ruta, "rb") as f:
+        artifacts = load_serving_bundle(f.read())
+    del artifacts["hist_index"]
+    artifacts.update(hist_tablas)
+    save_serving_bundle(artifacts, ruta + ".tmp")
+    os.replace(ruta + ".tmp", ruta)
+    return True
+
+
+def update_hist_sketches(ruta=SKETCH_DATA_PATH, directorio=SKETCH_MODELS_DIR):
+    """Añade a los sketches las filas nuevas de ruta y reexporta las tablas; devuelve las filas añadidas"""
+    ruta_sketches = os.path.join(directorio, SKETCHES_FILENAME)
+    if not os.path.exists(ruta_sketches):
+        print(f"No existe {ruta_sketches}: se crea en el próximo train_model.py")
+        return 0
+    sketches = joblib.load(ruta_sketches)
+
+    nuevas = load_new_rows(ruta, sketches)
+    if nuevas.empty:
+        return 0
+    df = sketch_key_columns(nuevas)
+    valores = df["tiempo_espera"].to_numpy()
+    for nombre, (_, claves, _) in HIST_FEATURES.items():
+        lote = sketch_table(df[["atraccion"] + claves], valores, sketches["resolucion"])
+        sketches["tablas"][nombre] = merge_sketch_tables(sketches["tablas"][nombre], lote)
+    sketches["watermark"] = nuevas["_momento"].max().isoformat()
+    sketches["filas"] += int(len(nuevas))
+
+    save_hist_sketches(sketches, directorio)
+    export_hist_tables(hist_tables_from_sketches(sketches), directorio)
+    return int(len(nuevas))
+
+
+# Sin argumentos: actualización de una ingesta (la llama ingestion_pipeline.py)
+# Con "check": sketches fusionados por lotes frente a aggregate_hist_tables sobre todo
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 2 or sys.argv[1] != "check":
+        inicio = time.perf_counter()
+        n = update_hist_sketches()
+        print(f"Sketches de históricos: {n} filas nuevas en {time.perf_counter() - inicio:.2f} s")
+        raise SystemExit(0)
+
+    from hist_aggregation import aggregate_hist_tables
+
+    rng = np.random.default_rng(0)
+    n = 200_000
+    atracciones = np.array([f"Atracción {i:02d}" for i in range(40)], dtype=object)
+    df = pd.DataFrame({
+        "atraccion": atracciones[rng.integers(0, 40, n)],
+        "mes": rng.integers(1, 13, n).astype(np.int32),
+        "hora_int": rng.integers(10, 22, n).astype(np.int64),
+        "dia_semana_num": rng.integers(0, 7, n).astype(np.int32),
+        "tiempo_espera": 5.0 * rng.poisson(4, n),
+    })
+    esperado = aggregate_hist_tables(df)
+
+    # Diez lotes fusionados uno a uno frente a una sola agregación de todo
+    lotes = np.array_split(np.arange(n), 10)
+    sketches = build_hist_sketches(df.iloc[lotes[0]], "", 0, 0)
+    inicio = time.perf_counter()
+    for lote in lotes[1:]:
+        parte = df.iloc[lote]
+        for nombre, (_, claves, _) in HIST_FEATURES.items():
+            nuevo = sketch_table(parte[["atraccion"] + claves], parte["tiempo_espera"].to_numpy(), SKETCH_RESOLUTION)
+            sketches["tablas"][nombre] = merge_sketch_tables(sketches["tablas"][nombre], nuevo)
+    t_lotes = (time.perf_counter() - inicio) / (len(lotes) - 1)
+    inicio = time.perf_counter()
+    tablas = hist_tables_from_sketches(sketches)
+    t_tablas = time.perf_counter() - inicio
+
+    errores = 0
+    for nombre, tabla in tablas.items():
+        referencia = esperado[nombre]
+        cuantiles = [c for c in tabla.columns if c.split("_")[0] in CUANTILES]
+        momentos = [c for c in tabla.columns if c.split("_")[0] in ("mean", "std")]
+        exactas = [c for c in tabla.columns if c not in momentos]
+        distintas = not tabla[exactas].equals(referencia[exactas])
+        diferencia = float(np.nanmax(np.abs(tabla[momentos].to_numpy() - referencia[momentos].to_numpy())))
+        print(f"{nombre}: {len(tabla)} claves, cuantiles/claves/count distintos: {distintas}, "
+              f"diferencia máxima mean/std {diferencia:.2e} ({len(cuantiles)} cuantiles)")
+        errores += distintas or diferencia > 1e-9 or list(tabla.columns) != list(referencia.columns)
+
+    entradas = sum(len(s["hist_count"]) for s in sketches["tablas"].values())
+    print(f"Sketches: {entradas} entradas de histograma para {n} filas")
+    print(f"Fusión de un lote de {len(lotes[1])} filas: {t_lotes * 1000:.1f} ms, tablas hist_*: {t_tablas * 1000:.1f} ms")
+    raise SystemExit(1 if errores else 0)
@@ -0,0 +1,282 @@
+# ====================================================
+# BÚSQUEDA DE HIPERPARÁMETROS - Validación temporal y trials en paralelo
+# ====================================================
+# train_model.py entrena un XGBRegressor con hiperparámetros fijos y valida
+# con un split aleatorio. Con TUNE_HYPERPARAMS=1 usa antes esta búsqueda:
+#   - folds temporales (TimeSeriesSplit sobre las filas de train ordenadas
+#     por fecha y hora): cada fold valida con datos posteriores a los de
+#     entrenamiento, como en producción,
+#   - búsqueda aleatoria (TUNING_TRIALS trials, semilla fija) más la
+#     configuración actual de train_model.py como trial 0,
+#   - las matrices de cada fold se preparan una vez antes de los trials; con
+#     preparar_fold (train_model.py) el target encoding y el StandardScaler se
+#     ajustan solo con las filas de entrenamiento del fold, así que la
+#     validación no se filtra en las features,
+#   - los trials se reparten en un pool de procesos (TUNING_WORKERS); cada
+#     proceso construye una sola vez los QuantileDMatrix de cada fold (los
+#     features ya discretizados en TUNING_MAX_BIN bins) y los reutiliza en
+#     todos sus trials,
+#   - early stopping por fold (TUNING_EARLY_STOPPING rondas sin mejorar) y
+#     poda: un trial se abandona si en algún fold su RMSE supera en más de
+#     TUNING_PRUNE_MARGIN la del mejor trial completo en ese mismo fold,
+#   - se elige la configuración más rápida de predecir (latencia por fila)
+#     entre las que quedan a menos de TUNING_RMSE_TOLERANCE de la mejor RMSE.
+# Escribe la mejor configuración en metrics/tuning_best_config.json y las
+# métricas por trial y fold en metrics/tuning_folds.csv.
+#
+# El pool usa fork (los workers heredan el proceso sin volver a ejecutar
+# train_model.py). Donde no existe fork (Windows) los trials se ejecutan en
+# serie en el proceso actual.
+
+import json
+import math
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.model_selection import TimeSeriesSplit
+
+TUNING_TRIALS = int(os.getenv("TUNING_TRIALS", "40"))
+TUNING_WORKERS = int(os.getenv("TUNING_WORKERS", str(max(1, (os.cpu_count() or 1) // 2))))
+TUNING_FOLDS = int(os.getenv("TUNING_FOLDS", "4"))
+TUNING_MAX_ROUNDS = int(os.getenv("TUNING_MAX_ROUNDS", "2000"))
+TUNING_EARLY_STOPPING = int(os.getenv("TUNING_EARLY_STOPPING", "50"))
+TUNING_PRUNE_MARGIN = float(os.getenv("TUNING_PRUNE_MARGIN", "0.15"))
+TUNING_RMSE_TOLERANCE = float(os.getenv("TUNING_RMSE_TOLERANCE", "0.01"))
+TUNING_MAX_BIN = int(os.getenv("TUNING_MAX_BIN", "256"))
+TUNING_SEED = int(os.getenv("TUNING_SEED", "42"))
+METRICS_DIR = os.getenv("METRICS_DIR", "metrics")
+
+BEST_CONFIG_FILENAME = "tuning_best_config.json"
+FOLDS_FILENAME = "tuning_folds.csv"
+
+# Configuración fija de train_model.py (trial 0 de la búsqueda)
+PARAMS_BASE = {
+    "learning_rate": 0.05,
+    "max_depth": 8,
+    "subsample": 0.85,
+    "colsample_bytree": 0.85,
+    "colsample_bylevel": 0.85,
+    "min_child_weight": 5,
+    "reg_alpha": 0.5,
+    "reg_lambda": 2.0,
+    "gamma": 0.1,
+}
+
+# Parámetros fijos en todos los trials (max_bin debe coincidir con el de los QuantileDMatrix)
+PARAMS_FIJOS = {
+    "objective": "reg:squarederror",
+    "eval_metric": "rmse",
+    "tree_method": "hist",
+    "max_bin": TUNING_MAX_BIN,
+    "verbosity": 0,
+}
+
+
+def sample_params(rng):
+    """Una configuración aleatoria del espacio de búsqueda"""
+    return {
+        "learning_rate": float(math.exp(rng.uniform(math.log(0.02), math.log(0.2)))),
+        "max_depth": int(rng.choice([4, 5, 6, 8, 10])),
+        "subsample": float(rng.uniform(0.6, 1.0)),
+        "colsample_bytree": float(rng.uniform(0.6, 1.0)),
+        "colsample_bylevel": float(rng.uniform(0.6, 1.0)),
+        "min_child_weight": int(rng.choice([1, 3, 5, 10])),
+        "reg_alpha": float(rng.choice([0.0, 0.1, 0.5, 1.0])),
+        "reg_lambda": float(math.exp(rng.uniform(math.log(0.5), math.log(10.0)))),
+        "gamma": float(rng.choice([0.0, 0.1, 0.5])),
+    }
+
+
+def time_series_folds(n, n_splits=TUNING_FOLDS):
+    """Folds (train, validación) de posiciones 0..n-1 ya ordenadas en el tiempo"""
+    return list(TimeSeriesSplit(n_splits=n_splits).split(np.arange(n)))
+
+
+# Estado de cada worker: matrices de los folds (una vez por proceso) y la
+# curva por fold del mejor trial completo (memoria compartida entre procesos)
+_folds = None
+_mejor_curva = None
+
+
+def prepare_folds(X, y, folds, preparar_fold=None):
+    """
+    (X_train, y_train, X_val, y_val) float32 de cada fold. preparar_fold(train_idx,
+    val_idx) devuelve las features del fold ajustadas solo con sus filas de
+    entrenamiento; sin él, X ya son las features finales y se cortan por posición.
+    """
+    y = np.asarray(y, dtype=np.float32)
+    if preparar_fold is None:
+        X = np.asarray(X)
+        preparar_fold = lambda train_idx, val_idx: (X[train_idx], X[val_idx])  # noqa: E731
+    datos = []
+    for train_idx, val_idx in folds:
+        X_train, X_val = preparar_fold(train_idx, val_idx)
+        datos.append((
+            np.ascontiguousarray(X_train, dtype=np.float32), y[train_idx],
+            np.ascontiguousarray(X_val, dtype=np.float32), y[val_idx],
+        ))
+    return datos
+
+
+def _init_worker(datos_folds, mejor_curva, nthread):
+    global _folds, _mejor_curva
+    _mejor_curva = mejor_curva
+    _folds = []
+    for X_train, y_train, X_val, y_val in datos_folds:
+        dtrain = xgb.QuantileDMatrix(X_train, y_train, max_bin=TUNING_MAX_BIN, nthread=nthread)
+        dval = xgb.QuantileDMatrix(X_val, y_val, ref=dtrain, nthread=nthread)
+        _folds.append((dtrain, dval, X_val, y_val))
+    _init_worker.nthread = nthread
+
+
+def _evaluate_trial(trial, params):
+    """Entrena y valida un trial fold a fold; se poda si va peor que el mejor trial completo"""
+    params_xgb = {**PARAMS_FIJOS, **params, "seed": TUNING_SEED, "nthread": _init_worker.nthread}
+    folds = []
+    for k, (dtrain, dval, X_val, y_val) in enumerate(_folds):
+        inicio = time.perf_counter()
+        booster = xgb.train(
+            params_xgb, dtrain, num_boost_round=TUNING_MAX_ROUNDS,
+            evals=[(dval, "val")], early_stopping_rounds=TUNING_EARLY_STOPPING, verbose_eval=False,
+        )
+        t_fit = time.perf_counter() - inicio
+
+        rango = (0, booster.best_iteration + 1)
+        inicio = time.perf_counter()
+        pred = booster.inplace_predict(X_val, iteration_range=rango)
+        latencia_us = (time.perf_counter() - inicio) / len(y_val) * 1e6
+
+        error = y_val - pred
+        rmse = float(np.sqrt(np.mean(error ** 2)))
+        total = float(np.sum((y_val - y_val.mean()) ** 2))
+        folds.append({
+            "fold": k,
+            "rmse": rmse,
+            "mae": float(np.mean(np.abs(error))),
+            "r2": float(1 - np.sum(error ** 2) / total) if total > 0 else float("nan"),
+            "best_iteration": int(booster.best_iteration),
+            "fit_s": t_fit,
+            "latencia_us_fila": latencia_us,
+        })
+
+        with _mejor_curva.get_lock():
+            referencia = _mejor_curva[k]
+        if rmse > referencia * (1 + TUNING_PRUNE_MARGIN):
+            return {"trial": trial, "params": params, "folds": folds, "podado": True}
+
+    resultado = {"trial": trial, "params": params, "folds": folds, "podado": False}
+    rmse_medio = float(np.mean([f["rmse"] for f in folds]))
+    with _mejor_curva.get_lock():
+        # La curva guarda el mejor trial completo (posición extra: su RMSE media)
+        if rmse_medio < _mejor_curva[len(folds)]:
+            for f in folds:
+                _mejor_curva[f["fold"]] = f["rmse"]
+            _mejor_curva[len(folds)] = rmse_medio
+    return resultado
+
+
+def _resumen(resultado):
+    folds = resultado["folds"]
+    return {
+        "trial": resultado["trial"],
+        "rmse": float(np.mean([f["rmse"] for f in folds])),
+        "mae": float(np.mean([f["mae"] for f in folds])),
+        "r2": float(np.mean([f["r2"] for f in folds])),
+        "n_estimators": int(round(np.mean([f["best_iteration"] + 1 for f in folds]))),
+        "latencia_us_fila": float(np.mean([f["latencia_us_fila"] for f in folds])),
+        "params": resultado["params"],
+    }
+
+
+def select_best(resultados, tolerancia=TUNING_RMSE_TOLERANCE):
+    """Trial más rápido de predecir entre los completos a menos de tolerancia de la mejor RMSE"""
+    completos = [_resumen(r) for r in resultados if not r["podado"]]
+    mejor_rmse = min(r["rmse"] for r in completos)
+    candidatos = [r for r in completos if r["rmse"] <= mejor_rmse * (1 + tolerancia)]
+    return min(candidatos, key=lambda r: (r["latencia_us_fila"], r["rmse"]))
+
+
+def run_search(X, y, n_trials=TUNING_TRIALS, n_workers=TUNING_WORKERS, metrics_dir=METRICS_DIR,
+               preparar_fold=None):
+    """
+    Búsqueda sobre X, y (filas ordenadas en el tiempo). Escribe las métricas
+    en metrics_dir y devuelve el resumen del trial elegido (params, n_estimators...).
+    Con preparar_fold, X son las filas sin transformar (ver prepare_folds).
+    """
+    folds = time_series_folds(len(y))
+    datos_folds = prepare_folds(X, y, folds, preparar_fold)
+
+    rng = np.random.default_rng(TUNING_SEED)
+    trials = [PARAMS_BASE] + [sample_params(rng) for _ in range(max(0, n_trials - 1))]
+
+    usar_pool = n_workers > 1 and "fork" in mp.get_all_start_methods()
+    contexto = mp.get_context("fork") if usar_pool else mp.get_context()
+    mejor_curva = contexto.Array("d", [math.inf] * (len(folds) + 1))
+    nthread = max(1, (os.cpu_count() or 1) // (n_workers if usar_pool else 1))
+
+    inicio = time.perf_counter()
+    if usar_pool:
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=contexto, initializer=_init_worker,
+                                 initargs=(datos_folds, mejor_curva, nthread)) as pool:
+            resultados = list(pool.map(_evaluate_trial, range(len(trials)), trials))
+    else:
+        _init_worker(datos_folds, mejor_curva, nthread)
+        resultados = [_evaluate_trial(i, p) for i, p in enumerate(trials)]
+    duracion = time.perf_counter() - inicio
+
+    mejor = select_best(resultados)
+    base = _resumen(resultados[0]) if not resultados[0]["podado"] else None
+    podados = sum(r["podado"] for r in resultados)
+
+    os.makedirs(metrics_dir, exist_ok=True)
+    filas = [
+        {"trial": r["trial"], "podado": r["podado"], **f, **{f"param_{k}": v for k, v in r["params"].items()}}
+        for r in resultados for f in r["folds"]
+    ]
+    pd.DataFrame(filas).to_csv(os.path.join(metrics_dir, FOLDS_FILENAME), index=False)
+    with open(os.path.join(metrics_dir, BEST_CONFIG_FILENAME), "w", encoding="utf-8") as f:
+        json.dump({
+            "mejor": mejor,
+            "base": base,
+            "trials": len(trials),
+            "podados": podados,
+            "folds": len(folds),
+            "workers": n_workers if usar_pool else 1,
+            "duracion_s": round(duracion, 2),
+        }, f, indent=4, ensure_ascii=False)
+
+    print(f"   {len(trials)} trials ({podados} podados) en {duracion:.1f} s con "
+          f"{n_workers if usar_pool else 1} proceso(s)")
+    if base:
+        print(f"   Configuración actual: RMSE {base['rmse']:.3f}, {base['latencia_us_fila']:.2f} µs/fila")
+    print(f"   Elegida (trial {mejor['trial']}): RMSE {mejor['rmse']:.3f}, "
+          f"{mejor['latencia_us_fila']:.2f} µs/fila, {mejor['n_estimators']} árboles")
+    return mejor
+
+
+# Comprobación con datos sintéticos: python hyperparam_search.py [trials] [workers]
+if __name__ == "__main__":
+    import sys
+    import tempfile
+
+    rng = np.random.default_rng(0)
+    n = 20_000
+    t = np.arange(n)
+    X = np.column_stack([rng.normal(size=(n, 8)), (t % 24) / 24, np.sin(t / 500)])
+    y = 20 + 8 * X[:, 0] + 4 * X[:, 1] * X[:, 2] + 10 * X[:, 9] + rng.normal(scale=2, size=n)
+
+    trials = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    directorio = tempfile.mkdtemp()
+    mejor = run_search(X, y, n_trials=trials, n_workers=workers, metrics_dir=directorio)
+    folds = pd.read_csv(os.path.join(directorio, FOLDS_FILENAME))
+    with open(os.path.join(directorio, BEST_CONFIG_FILENAME), encoding="utf-8") as f:
+        guardado = json.load(f)
+    print(f"Filas en {FOLDS_FILENAME}: {len(folds)}, trials con métricas: {folds['trial'].nunique()}")
+    print(f"{BEST_CONFIG_FILENAME}: trial {guardado['mejor']['trial']}, {guardado['mejor']['params']}")
+    raise SystemExit(0 if guardado["mejor"]["trial"] == mejor["trial"] and len(folds) > 0 else 1)
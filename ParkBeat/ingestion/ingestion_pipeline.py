@@ -69,6 +69,15 @@ def download_queue_times():
     except Exception as e:
         log(f"❌ Error durante la ingesta: {e}")
 
+# ---------------- Históricos incrementales ----------------
+def update_hist_sketches():
+    # Añade las filas nuevas de tiempos_final.csv a los sketches y reescribe las tablas hist_*
+    try:
+        subprocess.run([sys.executable, os.path.join(BASE_DIR, "hist_sketches.py")], check=True, cwd=BASE_DIR)
+        log("✅ Históricos actualizados")
+    except subprocess.CalledProcessError as e:
+        log(f"❌ Error actualizando históricos: {e}")
+
 # ---------------- Ejecutar scripts ----------------
 def run_pipeline():
     log("🚀 Ejecutando pipeline completo...")
@@ -83,6 +92,7 @@ def run_pipeline():
                 log(f"❌ Error en {script}: {e}")
         else:
             log(f"❌ No se encontró {script}")
+    update_hist_sketches()
     log("Pipeline completo.\n")
 
 # ---------------- Scheduler ----------------
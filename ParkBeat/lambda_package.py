@@ -34,6 +34,12 @@ if not (PROJECT_DIR / 'lambda_function.py').exists():
 shutil.copy(PROJECT_DIR / 'lambda_function.py', LAMBDA_DIR / 'lambda_function.py')
 print("   ✅ lambda_function.py copiado")
 
+# Módulos compartidos que importa lambda_function.py
+SHARED_MODULES = ['hist_index.py', 'serving_stats.py', 'quantile_cube.py', 'feature_layout.py', 'tree_ensemble.py', 'prediction_cache.py', 'forecast_table.py', 'serving_bundle.py', 's3_artifacts.py', 'serving_metadata.py', 'request_timing.py', 'request_log.py', 'batch_request.py', 'calendar_table.py', 'feature_builder.py']
+for module in SHARED_MODULES:
+    shutil.copy(PROJECT_DIR / module, LAMBDA_DIR / module)
+    print(f"   ✅ {module} copiado")
+
 # NOTA: NO instalamos dependencias aquí porque estarán en el Layer
 # boto3 ya está disponible en el runtime de Lambda, no necesita instalarse
 
@@ -45,6 +51,8 @@ if LAMBDA_ZIP.exists():
 with zipfile.ZipFile(LAMBDA_ZIP, 'w', zipfile.ZIP_DEFLATED) as zipf:
     # Agregar lambda_function.py en la raíz del ZIP
     zipf.write(LAMBDA_DIR / 'lambda_function.py', 'lambda_function.py')
+    for module in SHARED_MODULES:
+        zipf.write(LAMBDA_DIR / module, module)
 
 # Verificar tamaño
 size_mb = LAMBDA_ZIP.stat().st_size / (1024 * 1024)
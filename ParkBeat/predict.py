@@ -7,6 +7,15 @@ import numpy as np
 import joblib
 import os
 from datetime import datetime
+from hist_index import build_hist_indexes, get_hist_indexes
+from serving_stats import get_serving_stats
+from serving_metadata import SERVING_METADATA_FILENAME, build_serving_metadata
+from quantile_cube import get_quantile_cube_index
+from feature_layout import get_feature_layout, fill_feature_row, fill_feature_matrix, model_input
+from tree_ensemble import predict_model
+from calendar_table import calendar_row
+from feature_builder import build_serving_features, build_serving_row, parse_hora
+from serving_bundle import BUNDLE_FILENAME, load_serving_bundle
 
 def load_model_artifacts():
     """Carga todos los artefactos necesarios para hacer predicciones"""
@@ -22,7 +31,7 @@ def load_model_artifacts():
         scaler = None
         encoding_maps = None
         columnas_entrenamiento = None
-        df_processed = pd.DataFrame()
+        df_processed = None
         hist_mes = pd.DataFrame()
         hist_hora = pd.DataFrame()
         hist_dia_semana = pd.DataFrame()
@@ -45,7 +54,7 @@ def load_model_artifacts():
                 "scaler": None,
                 "encoding_maps": {},
                 "columnas_entrenamiento": [],
-                "df_processed": df_processed,
+                "serving_metadata": build_serving_metadata(None),
                 "hist_mes": hist_mes,
                 "hist_hora": hist_hora,
                 "hist_dia_semana": hist_dia_semana,
@@ -54,12 +63,27 @@ def load_model_artifacts():
                 "hist_mes_hora": hist_mes_hora
             }
         
+        # Bundle de serving (un solo fichero mapeado en memoria): si existe, sustituye a los pickles
+        bundle_path = os.path.join(base_path, BUNDLE_FILENAME)
+        if os.path.exists(bundle_path):
+            artifacts = load_serving_bundle(bundle_path)
+            get_feature_layout(artifacts)
+            return artifacts
+        
         # Cargar archivos desde el path encontrado
         model = joblib.load(os.path.join(base_path, "xgb_model_professional.pkl"))
         scaler = joblib.load(os.path.join(base_path, "xgb_scaler_professional.pkl"))
         encoding_maps = joblib.load(os.path.join(base_path, "xgb_encoding_professional.pkl"))
         columnas_entrenamiento = joblib.load(os.path.join(base_path, "xgb_columns_professional.pkl"))
-        df_processed = joblib.load(os.path.join(base_path, "df_processed.pkl"))
+        
+        # Metadatos de serving (stats, listas de atracciones/zonas) en lugar de df_processed.
+        # Con artefactos anteriores se calculan una vez desde df_processed y este se descarta
+        metadata_path = os.path.join(base_path, SERVING_METADATA_FILENAME)
+        if os.path.exists(metadata_path):
+            serving_metadata = joblib.load(metadata_path)
+        else:
+            df_processed = joblib.load(os.path.join(base_path, "df_processed.pkl"))
+            serving_metadata = build_serving_metadata(df_processed)
         
         # Cargar históricos (opcional - puede fallar sin problema)
         try:
@@ -86,20 +110,44 @@ def load_model_artifacts():
             hist_mes_hora = joblib.load(os.path.join(base_path, "hist_mes_hora.pkl"))
         except:
             pass
+        try:
+            quantile_cube = joblib.load(os.path.join(base_path, "quantile_cube.pkl"))
+        except:
+            quantile_cube = None
+        try:
+            tree_ensemble = joblib.load(os.path.join(base_path, "xgb_tree_ensemble.pkl"))
+        except:
+            tree_ensemble = None
         
-        return {
+        artifacts = {
             "model": model,
             "scaler": scaler,
             "encoding_maps": encoding_maps,
             "columnas_entrenamiento": columnas_entrenamiento,
+            "serving_metadata": serving_metadata,
             "df_processed": df_processed,
             "hist_mes": hist_mes,
             "hist_hora": hist_hora,
             "hist_dia_semana": hist_dia_semana,
             "hist_mes_dia": hist_mes_dia,
             "hist_hora_dia": hist_hora_dia,
-            "hist_mes_hora": hist_mes_hora
+            "hist_mes_hora": hist_mes_hora,
+            "quantile_cube": quantile_cube,
+            "tree_ensemble": tree_ensemble
         }
+        
+        # Indexar los históricos una sola vez (búsqueda O(1) por predicción)
+        artifacts["hist_index"] = build_hist_indexes(artifacts)
+        # Fallbacks globales y frecuencias precalculados en serving_metadata
+        get_serving_stats(artifacts)
+        # Cuantiles por nivel de fallback (si no existe el artefacto, se construyen aquí una vez)
+        get_quantile_cube_index(artifacts)
+        # df_processed solo se carga con artefactos antiguos y ya no hace falta
+        del artifacts["df_processed"]
+        # Posiciones y defaults de las features en el orden del scaler
+        get_feature_layout(artifacts)
+        
+        return artifacts
     except Exception as e:
         # Si falla la carga, retornar estructura vacía en lugar de lanzar error
         # Esto permite que la app use listas de fallback
@@ -108,7 +156,7 @@ def load_model_artifacts():
             "scaler": None,
             "encoding_maps": {},
             "columnas_entrenamiento": [],
-            "df_processed": pd.DataFrame(),
+            "serving_metadata": build_serving_metadata(None),
             "hist_mes": pd.DataFrame(),
             "hist_hora": pd.DataFrame(),
             "hist_dia_semana": pd.DataFrame(),
@@ -117,337 +165,13 @@ def load_model_artifacts():
             "hist_mes_hora": pd.DataFrame()
         }
 
-def parse_hora(hora_str):
-    """Parsea la hora a formato numérico"""
-    try:
-        if pd.isna(hora_str):
-            return np.nan
-        if isinstance(hora_str, (int, float)):
-            return int(hora_str)
-        s = str(hora_str).strip()
-        if ":" in s:
-            parts = s.split(":")
-            hora = int(float(parts[0]))
-            minuto = int(float(parts[1])) if len(parts) > 1 else 0
-            return hora + minuto / 60.0
-        return int(float(s))
-    except:
-        return np.nan
-
-def get_temporada(mes):
-    """Determina la temporada del año"""
-    if mes in [7, 8]:
-        return 3  # Muy Alta
-    elif mes in [10]:
-        return 3  # Muy Alta
-    elif mes in [4, 5, 6, 12]:
-        return 2  # Alta
-    elif mes in [3, 9, 11]:
-        return 1  # Media
-    else:
-        return 0  # Baja
-
-def es_festivo_espana(fecha):
-    """Detecta festivos en España"""
-    mes = fecha.month
-    dia = fecha.day
-    if mes == 1 and dia == 1: return 1  # Año Nuevo
-    if mes == 1 and dia == 6: return 1  # Reyes
-    if mes == 5 and dia == 1: return 1  # Día del Trabajo
-    if mes == 10 and dia == 12: return 1  # Día de la Hispanidad
-    if mes == 11 and dia == 1: return 1  # Todos los Santos
-    if mes == 12 and dia == 6: return 1  # Constitución
-    if mes == 12 and dia == 8: return 1  # Inmaculada
-    if mes == 12 and dia == 25: return 1  # Navidad
-    return 0
-
-def es_puente(fecha):
-    """Detecta si un día es parte de un puente (festivo + fin de semana cercano)"""
-    if es_festivo_espana(fecha):
-        return 1
-    dia_anterior = fecha - pd.Timedelta(days=1)
-    dia_siguiente = fecha + pd.Timedelta(days=1)
-    if fecha.weekday() == 4 and es_festivo_espana(dia_siguiente):  # Viernes antes de festivo
-        return 1
-    if fecha.weekday() == 0 and es_festivo_espana(dia_anterior):  # Lunes después de festivo
-        return 1
-    if fecha.weekday() == 6 and es_festivo_espana(dia_anterior):  # Domingo después de festivo (sábado)
-        return 1
-    return 0
-
 def prepare_input_for_prediction(input_dict, artifacts):
     """Prepara un input para predicción aplicando todo el feature engineering"""
-    df_train = artifacts["df_processed"]
-    scaler = artifacts["scaler"]
-    encoding_maps = artifacts["encoding_maps"]
-    columnas_entrenamiento = artifacts["columnas_entrenamiento"]
-    hist_mes = artifacts["hist_mes"]
-    hist_hora = artifacts["hist_hora"]
-    hist_dia_semana = artifacts["hist_dia_semana"]
-    hist_mes_dia = artifacts["hist_mes_dia"]
-    hist_hora_dia = artifacts["hist_hora_dia"]
-    hist_mes_hora = artifacts["hist_mes_hora"]
-    
-    # Parsear fecha
-    fecha = pd.to_datetime(input_dict["fecha"], errors="coerce")
-    if pd.isna(fecha):
-        fecha = pd.Timestamp.now()
-    
-    # Parsear hora
-    hora_str = input_dict.get("hora", "12:00:00")
-    hora = parse_hora(hora_str)
-    if pd.isna(hora):
-        hora = 12.0
-    
-    # Features temporales
-    mes = fecha.month
-    dia_mes = fecha.day
-    dia_semana_num = fecha.weekday()
-    semana_año = fecha.isocalendar().week
-    trimestre = fecha.quarter
-    año = fecha.year
-    
-    # Días de semana
-    es_lunes = 1 if dia_semana_num == 0 else 0
-    es_martes = 1 if dia_semana_num == 1 else 0
-    es_miercoles = 1 if dia_semana_num == 2 else 0
-    es_jueves = 1 if dia_semana_num == 3 else 0
-    es_viernes = 1 if dia_semana_num == 4 else 0
-    es_sabado = 1 if dia_semana_num == 5 else 0
-    es_domingo = 1 if dia_semana_num == 6 else 0
-    es_fin_de_semana = 1 if dia_semana_num in [5, 6] else 0
-    es_dia_laborable = 1 if dia_semana_num in [0, 1, 2, 3, 4] else 0
-    
-    # Features de HORA DEL DÍA
-    hora_int = int(hora)
-    es_hora_apertura = 1 if (hora_int >= 10 and hora_int < 11) else 0
-    es_hora_pico = 1 if (hora_int >= 11 and hora_int <= 16) else 0
-    es_hora_valle_manana = 1 if hora_int < 10 else 0
-    es_hora_valle_tarde = 1 if hora_int > 18 else 0
-    es_hora_valle = 1 if (es_hora_valle_manana or es_hora_valle_tarde) else 0
-    
-    # Features de PUENTES/FESTIVOS
-    es_festivo_val = es_festivo_espana(fecha)
-    es_puente_val = es_puente(fecha)
-    
-    # Interacciones con hora y puentes
-    hora_apertura_fin_semana = es_hora_apertura * es_fin_de_semana
-    hora_pico_puente = es_hora_pico * es_puente_val
-    puente_fin_semana = es_puente_val * es_fin_de_semana
-    
-    # Meses
-    es_mes_dict = {i: 1 if mes == i else 0 for i in range(1, 13)}
-    
-    # Temporada
-    temporada = get_temporada(mes)
-    
-    # Features cíclicas
-    hora_sin = np.sin(2 * np.pi * hora / 24)
-    hora_cos = np.cos(2 * np.pi * hora / 24)
-    mes_sin = np.sin(2 * np.pi * mes / 12)
-    mes_cos = np.cos(2 * np.pi * mes / 12)
-    dia_semana_sin = np.sin(2 * np.pi * dia_semana_num / 7)
-    dia_semana_cos = np.cos(2 * np.pi * dia_semana_num / 7)
-    dia_mes_sin = np.sin(2 * np.pi * dia_mes / 31)
-    dia_mes_cos = np.cos(2 * np.pi * dia_mes / 31)
-    semana_año_sin = np.sin(2 * np.pi * semana_año / 52)
-    semana_año_cos = np.cos(2 * np.pi * semana_año / 52)
-    
-    # Interacciones
-    hora_mes = hora * mes
-    hora_dia_semana = hora * dia_semana_num
-    mes_dia_semana = mes * dia_semana_num
-    fin_semana_mes = es_fin_de_semana * mes
-    temporada_dia_semana = temporada * dia_semana_num
-    
-    # Clima
-    temperatura = input_dict.get("temperatura", df_train["temperatura"].median() if "temperatura" in df_train.columns else 20)
-    humedad = input_dict.get("humedad", df_train["humedad"].median() if "humedad" in df_train.columns else 60)
-    sensacion_termica = input_dict.get("sensacion_termica", temperatura)
-    codigo_clima = input_dict.get("codigo_clima", 3)
-    es_buen_clima = 1 if codigo_clima in [1, 2, 3] else 0
-    es_mal_clima = 1 if codigo_clima > 3 else 0
-    
-    # Atracción y zona
-    atraccion = input_dict.get("atraccion", "")
-    zona = input_dict.get("zona", "")
-    
-    # Features históricas
-    global_median = df_train["tiempo_espera"].median()
-    global_mean = df_train["tiempo_espera"].mean()
-    
-    hist_mes_row = hist_mes[(hist_mes["atraccion"] == atraccion) & (hist_mes["mes"] == mes)]
-    hist_hora_row = hist_hora[(hist_hora["atraccion"] == atraccion) & (hist_hora["hora"] == int(hora))]
-    hist_dia_row = hist_dia_semana[(hist_dia_semana["atraccion"] == atraccion) & (hist_dia_semana["dia_semana_num"] == dia_semana_num)]
-    hist_mes_dia_row = hist_mes_dia[(hist_mes_dia["atraccion"] == atraccion) & (hist_mes_dia["mes"] == mes) & (hist_mes_dia["dia_semana_num"] == dia_semana_num)]
-    hist_hora_dia_row = hist_hora_dia[(hist_hora_dia["atraccion"] == atraccion) & (hist_hora_dia["hora"] == int(hora)) & (hist_hora_dia["dia_semana_num"] == dia_semana_num)]
-    hist_mes_hora_row = hist_mes_hora[(hist_mes_hora["atraccion"] == atraccion) & (hist_mes_hora["mes"] == mes) & (hist_mes_hora["hora"] == int(hora))]
-    
-    count_mes = hist_mes_row["count_mes"].values[0] if not hist_mes_row.empty else 0
-    mean_mes = hist_mes_row["mean_mes"].values[0] if not hist_mes_row.empty else global_mean
-    median_mes = hist_mes_row["median_mes"].values[0] if not hist_mes_row.empty else global_median
-    std_mes = hist_mes_row["std_mes"].values[0] if not hist_mes_row.empty else df_train["tiempo_espera"].std()
-    p75_mes = hist_mes_row["p75_mes"].values[0] if not hist_mes_row.empty else np.percentile(df_train["tiempo_espera"], 75)
-    p90_mes = hist_mes_row["p90_mes"].values[0] if not hist_mes_row.empty else np.percentile(df_train["tiempo_espera"], 90)
-    p95_mes = hist_mes_row["p95_mes"].values[0] if not hist_mes_row.empty else np.percentile(df_train["tiempo_espera"], 95)
-    
-    count_hora = hist_hora_row["count_hora"].values[0] if not hist_hora_row.empty else 0
-    mean_hora = hist_hora_row["mean_hora"].values[0] if not hist_hora_row.empty else global_mean
-    median_hora = hist_hora_row["median_hora"].values[0] if not hist_hora_row.empty else global_median
-    std_hora = hist_hora_row["std_hora"].values[0] if not hist_hora_row.empty else df_train["tiempo_espera"].std()
-    p75_hora = hist_hora_row["p75_hora"].values[0] if not hist_hora_row.empty else np.percentile(df_train["tiempo_espera"], 75)
-    p90_hora = hist_hora_row["p90_hora"].values[0] if not hist_hora_row.empty else np.percentile(df_train["tiempo_espera"], 90)
-    
-    count_dia = hist_dia_row["count_dia"].values[0] if not hist_dia_row.empty else 0
-    mean_dia = hist_dia_row["mean_dia"].values[0] if not hist_dia_row.empty else global_mean
-    median_dia = hist_dia_row["median_dia"].values[0] if not hist_dia_row.empty else global_median
-    std_dia = hist_dia_row["std_dia"].values[0] if not hist_dia_row.empty else df_train["tiempo_espera"].std()
-    p75_dia = hist_dia_row["p75_dia"].values[0] if not hist_dia_row.empty else np.percentile(df_train["tiempo_espera"], 75)
-    p90_dia = hist_dia_row["p90_dia"].values[0] if not hist_dia_row.empty else np.percentile(df_train["tiempo_espera"], 90)
-    
-    count_mes_dia = hist_mes_dia_row["count_mes_dia"].values[0] if not hist_mes_dia_row.empty else 0
-    mean_mes_dia = hist_mes_dia_row["mean_mes_dia"].values[0] if not hist_mes_dia_row.empty else global_mean
-    median_mes_dia = hist_mes_dia_row["median_mes_dia"].values[0] if not hist_mes_dia_row.empty else global_median
-    p75_mes_dia = hist_mes_dia_row["p75_mes_dia"].values[0] if not hist_mes_dia_row.empty else np.percentile(df_train["tiempo_espera"], 75)
-    p90_mes_dia = hist_mes_dia_row["p90_mes_dia"].values[0] if not hist_mes_dia_row.empty else np.percentile(df_train["tiempo_espera"], 90)
-    
-    count_hora_dia = hist_hora_dia_row["count_hora_dia"].values[0] if not hist_hora_dia_row.empty else 0
-    mean_hora_dia = hist_hora_dia_row["mean_hora_dia"].values[0] if not hist_hora_dia_row.empty else global_mean
-    median_hora_dia = hist_hora_dia_row["median_hora_dia"].values[0] if not hist_hora_dia_row.empty else global_median
-    p75_hora_dia = hist_hora_dia_row["p75_hora_dia"].values[0] if not hist_hora_dia_row.empty else np.percentile(df_train["tiempo_espera"], 75)
-    
-    count_mes_hora = hist_mes_hora_row["count_mes_hora"].values[0] if not hist_mes_hora_row.empty else 0
-    mean_mes_hora = hist_mes_hora_row["mean_mes_hora"].values[0] if not hist_mes_hora_row.empty else global_mean
-    median_mes_hora = hist_mes_hora_row["median_mes_hora"].values[0] if not hist_mes_hora_row.empty else global_median
-    p75_mes_hora = hist_mes_hora_row["p75_mes_hora"].values[0] if not hist_mes_hora_row.empty else np.percentile(df_train["tiempo_espera"], 75)
-    
-    # Flags especiales
-    is_batman_octubre = 1 if ("Batman" in atraccion and mes == 10) else 0
-    is_octubre = 1 if mes == 10 else 0
-    is_noviembre = 1 if mes == 11 else 0
-    is_octubre_fin_semana = 1 if (mes == 10 and es_fin_de_semana == 1) else 0
-    is_noviembre_fin_semana = 1 if (mes == 11 and es_fin_de_semana == 1) else 0
-    
-    # Encoding categórico
-    zona_enc = encoding_maps.get("zona", {}).get(zona, global_mean) if "zona" in encoding_maps else global_mean
-    atraccion_enc = encoding_maps.get("atraccion", {}).get(atraccion, global_mean) if "atraccion" in encoding_maps else global_mean
-    
-    # Construir el vector de features
-    feature_dict = {
-        "hora": hora,
-        "mes": mes,
-        "dia_mes": dia_mes,
-        "dia_semana_num": dia_semana_num,
-        "semana_año": semana_año,
-        "trimestre": trimestre,
-        "año": año,
-        "es_lunes": es_lunes,
-        "es_martes": es_martes,
-        "es_miercoles": es_miercoles,
-        "es_jueves": es_jueves,
-        "es_viernes": es_viernes,
-        "es_sabado": es_sabado,
-        "es_domingo": es_domingo,
-        "es_fin_de_semana": es_fin_de_semana,
-        "es_dia_laborable": es_dia_laborable,
-        **{f"es_mes_{i}": es_mes_dict[i] for i in range(1, 13)},
-        "temporada": temporada,
-        "hora_sin": hora_sin,
-        "hora_cos": hora_cos,
-        "mes_sin": mes_sin,
-        "mes_cos": mes_cos,
-        "dia_semana_sin": dia_semana_sin,
-        "dia_semana_cos": dia_semana_cos,
-        "dia_mes_sin": dia_mes_sin,
-        "dia_mes_cos": dia_mes_cos,
-        "semana_año_sin": semana_año_sin,
-        "semana_año_cos": semana_año_cos,
-        "hora_mes": hora_mes,
-        "hora_dia_semana": hora_dia_semana,
-        "mes_dia_semana": mes_dia_semana,
-        "fin_semana_mes": fin_semana_mes,
-        "temporada_dia_semana": temporada_dia_semana,
-        "temperatura": temperatura,
-        "humedad": humedad,
-        "sensacion_termica": sensacion_termica,
-        "codigo_clima": codigo_clima,
-        "es_buen_clima": es_buen_clima,
-        "es_mal_clima": es_mal_clima,
-        "count_mes": count_mes,
-        "mean_mes": mean_mes,
-        "median_mes": median_mes,
-        "std_mes": std_mes,
-        "p75_mes": p75_mes,
-        "p90_mes": p90_mes,
-        "p95_mes": p95_mes,
-        "count_hora": count_hora,
-        "mean_hora": mean_hora,
-        "median_hora": median_hora,
-        "std_hora": std_hora,
-        "p75_hora": p75_hora,
-        "p90_hora": p90_hora,
-        "count_dia": count_dia,
-        "mean_dia": mean_dia,
-        "median_dia": median_dia,
-        "std_dia": std_dia,
-        "p75_dia": p75_dia,
-        "p90_dia": p90_dia,
-        "count_mes_dia": count_mes_dia,
-        "mean_mes_dia": mean_mes_dia,
-        "median_mes_dia": median_mes_dia,
-        "p75_mes_dia": p75_mes_dia,
-        "p90_mes_dia": p90_mes_dia,
-        "count_hora_dia": count_hora_dia,
-        "mean_hora_dia": mean_hora_dia,
-        "median_hora_dia": median_hora_dia,
-        "p75_hora_dia": p75_hora_dia,
-        "count_mes_hora": count_mes_hora,
-        "mean_mes_hora": mean_mes_hora,
-        "median_mes_hora": median_mes_hora,
-        "p75_mes_hora": p75_mes_hora,
-        "is_batman_octubre": is_batman_octubre,
-        "is_octubre": is_octubre,
-        "is_noviembre": is_noviembre,
-        "is_octubre_fin_semana": is_octubre_fin_semana,
-        "is_noviembre_fin_semana": is_noviembre_fin_semana,
-        "hora_int": hora_int,
-        "es_hora_apertura": es_hora_apertura,
-        "es_hora_pico": es_hora_pico,
-        "es_hora_valle_manana": es_hora_valle_manana,
-        "es_hora_valle_tarde": es_hora_valle_tarde,
-        "es_hora_valle": es_hora_valle,
-        "es_festivo": es_festivo_val,
-        "es_puente": es_puente_val,
-        "hora_apertura_fin_semana": hora_apertura_fin_semana,
-        "hora_pico_puente": hora_pico_puente,
-        "puente_fin_semana": puente_fin_semana,
-        "zona_enc": zona_enc,
-        "atraccion_enc": atraccion_enc,
-    }
-    
-    # Añadir frecuencias si existen
-    if "zona_freq" in columnas_entrenamiento:
-        zona_freq_map = df_train["zona"].value_counts().to_dict() if "zona" in df_train.columns else {}
-        feature_dict["zona_freq"] = zona_freq_map.get(zona, 0)
-    if "atraccion_freq" in columnas_entrenamiento:
-        atraccion_freq_map = df_train["atraccion"].value_counts().to_dict() if "atraccion" in df_train.columns else {}
-        feature_dict["atraccion_freq"] = atraccion_freq_map.get(atraccion, 0)
-    
-    # Crear DataFrame y asegurar el mismo orden de columnas
-    df_features = pd.DataFrame([feature_dict])
-    
-    # Asegurar que todas las columnas estén presentes
-    for col in columnas_entrenamiento:
-        if col not in df_features.columns:
-            df_features[col] = 0
-    
-    # Reordenar columnas
-    df_features = df_features[columnas_entrenamiento]
-    
-    # Escalar
-    X_scaled = scaler.transform(df_features)
-    
-    return X_scaled
+    # Escribir las features en el orden de entrenamiento (las que falten valen 0) y
+    # escalar (salvo que el ensemble lleve el scaler plegado)
+    layout = get_feature_layout(artifacts)
+    row = fill_feature_row(layout, build_serving_row(input_dict, artifacts))
+    return model_input(layout, row)
 
 def predict_wait_time(input_dict, artifacts=None):
     """
@@ -471,12 +195,9 @@ def predict_wait_time(input_dict, artifacts=None):
     if artifacts is None:
         artifacts = load_model_artifacts()
     
-    model = artifacts["model"]
-    df_train = artifacts["df_processed"]
-    
     # Predicción base del modelo (ESTA ES LA CLAVE - tiene hora, día del mes, etc.)
     X_pred = prepare_input_for_prediction(input_dict, artifacts)
-    pred_base = float(model.predict(X_pred)[0])
+    pred_base = float(predict_model(artifacts, X_pred)[0])
     
     # Extraer información del input
     fecha = pd.to_datetime(input_dict["fecha"], errors="coerce")
@@ -496,73 +217,69 @@ def predict_wait_time(input_dict, artifacts=None):
         hora = 12.0
     hora_int = int(hora)
     
-    # Usar históricos pre-calculados para verificar existencia, luego buscar en df_train
-    hist_mes = artifacts["hist_mes"]
-    hist_hora = artifacts["hist_hora"]
-    hist_dia_semana = artifacts["hist_dia_semana"]
-    hist_mes_dia = artifacts["hist_mes_dia"]
-    hist_hora_dia = artifacts["hist_hora_dia"]
-    hist_mes_hora = artifacts["hist_mes_hora"]
-    global_median = df_train["tiempo_espera"].median()
+    # Usar históricos pre-calculados para verificar existencia, luego leer el cubo de cuantiles
+    hist_index = get_hist_indexes(artifacts)
+    global_median = get_serving_stats(artifacts)["global_median"]
     
     # Verificar existencia en históricos pre-calculados
-    tiene_mes_hora_dia = not hist_mes_hora[(hist_mes_hora["atraccion"] == atr) & (hist_mes_hora["mes"] == mes) & (hist_mes_hora["hora"] == hora_int)].empty and \
-                         not hist_mes_dia[(hist_mes_dia["atraccion"] == atr) & (hist_mes_dia["mes"] == mes) & (hist_mes_dia["dia_semana_num"] == dia_semana)].empty
-    tiene_hora_dia = not hist_hora_dia[(hist_hora_dia["atraccion"] == atr) & (hist_hora_dia["hora"] == hora_int) & (hist_hora_dia["dia_semana_num"] == dia_semana)].empty
-    tiene_mes_hora = not hist_mes_hora[(hist_mes_hora["atraccion"] == atr) & (hist_mes_hora["mes"] == mes) & (hist_mes_hora["hora"] == hora_int)].empty
-    tiene_hora = not hist_hora[(hist_hora["atraccion"] == atr) & (hist_hora["hora"] == hora_int)].empty
+    tiene_mes_hora_dia = (atr, mes, hora_int) in hist_index["hist_mes_hora"] and \
+                         (atr, mes, dia_semana) in hist_index["hist_mes_dia"]
+    tiene_hora_dia = (atr, hora_int, dia_semana) in hist_index["hist_hora_dia"]
+    tiene_mes_hora = (atr, mes, hora_int) in hist_index["hist_mes_hora"]
+    tiene_hora = (atr, hora_int) in hist_index["hist_hora"]
     
     # Si no hay datos exactos por hora, buscar en rango cercano
     if not tiene_hora and hora_int > 0:
         for h in [hora_int-1, hora_int+1]:
             if 0 <= h < 24:
-                if not hist_hora[(hist_hora["atraccion"] == atr) & (hist_hora["hora"] == h)].empty:
+                if (atr, h) in hist_index["hist_hora"]:
                     hora_int = h
                     tiene_hora = True
                     break
     
-    # PRIORIZAR históricos que incluyen HORA - buscar directamente en df_train
+    # PRIORIZAR históricos que incluyen HORA - leer del cubo de cuantiles precalculado
+    cube = get_quantile_cube_index(artifacts)
     if tiene_mes_hora_dia:
         # Lo más específico: mes + hora + día de semana
-        hist_ref = df_train[(df_train["atraccion"] == atr) & (df_train["mes"] == mes) & (df_train["hora"].astype(int) == hora_int) & (df_train["dia_semana_num"] == dia_semana)]
+        hist_ref = cube["mes_hora_dia"].get((atr, mes, hora_int, dia_semana))
         especificidad = "mes_hora_dia"
     elif tiene_hora_dia:
         # Hora + día de semana
-        hist_ref = df_train[(df_train["atraccion"] == atr) & (df_train["hora"].astype(int) == hora_int) & (df_train["dia_semana_num"] == dia_semana)]
+        hist_ref = cube["hora_dia"].get((atr, hora_int, dia_semana))
         especificidad = "hora_dia"
     elif tiene_mes_hora:
         # Mes + hora
-        hist_ref = df_train[(df_train["atraccion"] == atr) & (df_train["mes"] == mes) & (df_train["hora"].astype(int) == hora_int)]
+        hist_ref = cube["mes_hora"].get((atr, mes, hora_int))
         especificidad = "mes_hora"
     elif tiene_hora:
         # Solo hora (muy importante para variación horaria)
-        hist_ref = df_train[(df_train["atraccion"] == atr) & (df_train["hora"].astype(int) == hora_int)]
+        hist_ref = cube["hora"].get((atr, hora_int))
         especificidad = "hora"
     else:
         # Buscar sin hora
-        hist_mes_dia_ref = df_train[(df_train["atraccion"] == atr) & (df_train["mes"] == mes) & (df_train["dia_semana_num"] == dia_semana)]
-        hist_dia_ref = df_train[(df_train["atraccion"] == atr) & (df_train["dia_semana_num"] == dia_semana)]
-        hist_mes_ref = df_train[(df_train["atraccion"] == atr) & (df_train["mes"] == mes)]
+        hist_mes_dia_ref = cube["mes_dia"].get((atr, mes, dia_semana))
+        hist_dia_ref = cube["dia"].get((atr, dia_semana))
+        hist_mes_ref = cube["mes"].get((atr, mes))
         
-        if not hist_mes_dia_ref.empty:
+        if hist_mes_dia_ref is not None:
             hist_ref = hist_mes_dia_ref
             especificidad = "mes_dia"
-        elif not hist_dia_ref.empty:
+        elif hist_dia_ref is not None:
             hist_ref = hist_dia_ref
             especificidad = "dia"
-        elif not hist_mes_ref.empty:
+        elif hist_mes_ref is not None:
             hist_ref = hist_mes_ref
             especificidad = "mes"
         else:
-            hist_ref = pd.DataFrame()
+            hist_ref = None
             especificidad = "global"
     
-    # Calcular estadísticas del histórico más específico disponible
-    if not hist_ref.empty:
-        p75_hist = hist_ref["tiempo_espera"].quantile(0.75)
-        median_hist = hist_ref["tiempo_espera"].median()
-        p90_hist = hist_ref["tiempo_espera"].quantile(0.90)
-        count_hist = len(hist_ref)
+    # Estadísticas del histórico más específico disponible
+    if hist_ref is not None:
+        p75_hist = hist_ref["p75"]
+        median_hist = hist_ref["p50"]
+        p90_hist = hist_ref["p90"]
+        count_hist = int(hist_ref["count"])
     else:
         p75_hist = global_median
         median_hist = global_median
@@ -575,17 +292,17 @@ def predict_wait_time(input_dict, artifacts=None):
     es_hora_valle = (hora_int < 10 or hora_int > 18)
     
     # Detectar puente/festivo
-    es_puente_val = es_puente(fecha)
+    es_puente_val = calendar_row(fecha)["es_puente"]
     
     # PRIORIZAR históricos por hora - si tenemos datos específicos por hora, usarlos directamente
     # Si tenemos histórico por hora específica, usarlo como base principal
     if especificidad in ["mes_hora_dia", "hora_dia", "mes_hora", "hora"]:
         # Tenemos datos por hora - usar histórico como base y ajustar con modelo
-        if not hist_ref.empty:
+        if hist_ref is not None:
             # Usar percentil 50 (mediana) o 75 según contexto
             if es_hora_apertura:
                 # Hora de apertura: usar percentil más bajo (25 o mediana)
-                hist_base = hist_ref["tiempo_espera"].quantile(0.25) if len(hist_ref) > 10 else median_hist
+                hist_base = hist_ref["p25"] if count_hist > 10 else median_hist
                 peso_historico = 0.80  # Más peso al histórico en apertura
                 peso_modelo = 0.20
             elif es_hora_pico:
@@ -595,16 +312,16 @@ def predict_wait_time(input_dict, artifacts=None):
                 # Si el histórico es muy bajo para hora pico, buscar alternativas
                 if p75_hist < 15 and count_hist < 20:  # Histórico sospechosamente bajo
                     # Buscar histórico menos específico pero más confiable
-                    hist_mes_dia_alt = df_train[(df_train["atraccion"] == atr) & (df_train["mes"] == mes) & (df_train["dia_semana_num"] == dia_semana)]
-                    hist_mes_alt = df_train[(df_train["atraccion"] == atr) & (df_train["mes"] == mes)]
+                    hist_mes_dia_alt = cube["mes_dia"].get((atr, mes, dia_semana))
+                    hist_mes_alt = cube["mes"].get((atr, mes))
                     
-                    if not hist_mes_dia_alt.empty:
-                        p75_alt = hist_mes_dia_alt["tiempo_espera"].quantile(0.75)
+                    if hist_mes_dia_alt is not None:
+                        p75_alt = hist_mes_dia_alt["p75"]
                         if p75_alt > p75_hist:
                             hist_base = p75_alt
                             especificidad = "mes_dia_fallback"
-                    elif not hist_mes_alt.empty:
-                        p75_alt = hist_mes_alt["tiempo_espera"].quantile(0.75)
+                    elif hist_mes_alt is not None:
+                        p75_alt = hist_mes_alt["p75"]
                         if p75_alt > p75_hist:
                             hist_base = p75_alt
                             especificidad = "mes_fallback"
@@ -732,6 +449,237 @@ def predict_wait_time(input_dict, artifacts=None):
         "count_historico": count_hist
     }
 
+DIAS_SEMANA = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
+
+def prepare_batch_for_prediction(list_of_inputs, artifacts):
+    """
+    Versión por lotes de prepare_input_for_prediction.
+    
+    Construye la matriz de features de todos los inputs columna a columna con
+    NumPy y la escala de una sola vez con el layout compilado (salvo que el
+    ensemble lleve el scaler plegado). Devuelve la matriz de entrada del
+    modelo y un diccionario con las columnas temporales ya parseadas
+    (fechas, horas, mes, día de semana...) para reutilizarlas en los ajustes.
+    """
+    columnas, contexto = build_serving_features(list_of_inputs, artifacts)
+    
+    # Mismo orden de columnas que en entrenamiento; las que falten se rellenan con 0
+    layout = get_feature_layout(artifacts)
+    X_pred = model_input(layout, fill_feature_matrix(layout, columnas, len(list_of_inputs)))
+    return X_pred, contexto
+
+def predict_wait_time_batch(list_of_inputs, artifacts=None):
+    """
+    Versión vectorizada de predict_wait_time para una lista de inputs.
+    
+    Hace una sola pasada del scaler y una sola llamada a model.predict para
+    todo el lote, y aplica los pesos y ajustes de negocio con np.select.
+    El resultado es idéntico, elemento a elemento, a
+    [predict_wait_time(i, artifacts) for i in list_of_inputs].
+    
+    Args:
+        list_of_inputs: Lista de diccionarios con el mismo formato que predict_wait_time
+        artifacts: Diccionario con los artefactos del modelo (opcional, se cargan si no se proporciona)
+    
+    Returns:
+        Lista de diccionarios con la predicción y detalles, en el mismo orden que los inputs
+    """
+    if artifacts is None:
+        artifacts = load_model_artifacts()
+    if not list_of_inputs:
+        return []
+    
+    # Predicción base del modelo para todo el lote
+    X_pred, ctx = prepare_batch_for_prediction(list_of_inputs, artifacts)
+    pred_base = np.asarray(predict_model(artifacts, X_pred), dtype=float)
+    
+    mes = ctx["mes"]
+    dia_semana = ctx["dia_semana"]
+    es_fin_de_semana = ctx["es_fin_de_semana"]
+    es_puente_val = ctx["es_puente"]
+    atracciones = ctx["atracciones"]
+    hora_int = ctx["hora_int"].copy()
+    n = len(list_of_inputs)
+    
+    hist_index = get_hist_indexes(artifacts)
+    global_median = get_serving_stats(artifacts)["global_median"]
+    cube = get_quantile_cube_index(artifacts)
+    
+    # Selección del histórico más específico: una búsqueda en diccionario por fila
+    especificidad = np.empty(n, dtype=object)
+    refs = [None] * n
+    alt_p75 = np.full(n, np.nan)
+    alt_nivel = np.empty(n, dtype=object)
+    for i, atr in enumerate(atracciones):
+        m, d, h = int(mes[i]), int(dia_semana[i]), int(hora_int[i])
+        tiene_mes_hora_dia = (atr, m, h) in hist_index["hist_mes_hora"] and \
+                             (atr, m, d) in hist_index["hist_mes_dia"]
+        tiene_hora_dia = (atr, h, d) in hist_index["hist_hora_dia"]
+        tiene_mes_hora = (atr, m, h) in hist_index["hist_mes_hora"]
+        tiene_hora = (atr, h) in hist_index["hist_hora"]
+        
+        # Si no hay datos exactos por hora, buscar en rango cercano
+        if not tiene_hora and h > 0:
+            for h_alt in [h - 1, h + 1]:
+                if 0 <= h_alt < 24 and (atr, h_alt) in hist_index["hist_hora"]:
+                    h = h_alt
+                    tiene_hora = True
+                    break
+        hora_int[i] = h
+        
+        hist_mes_dia_ref = cube["mes_dia"].get((atr, m, d))
+        hist_dia_ref = cube["dia"].get((atr, d))
+        hist_mes_ref = cube["mes"].get((atr, m))
+        if tiene_mes_hora_dia:
+            refs[i], especificidad[i] = cube["mes_hora_dia"].get((atr, m, h, d)), "mes_hora_dia"
+        elif tiene_hora_dia:
+            refs[i], especificidad[i] = cube["hora_dia"].get((atr, h, d)), "hora_dia"
+        elif tiene_mes_hora:
+            refs[i], especificidad[i] = cube["mes_hora"].get((atr, m, h)), "mes_hora"
+        elif tiene_hora:
+            refs[i], especificidad[i] = cube["hora"].get((atr, h)), "hora"
+        elif hist_mes_dia_ref is not None:
+            refs[i], especificidad[i] = hist_mes_dia_ref, "mes_dia"
+        elif hist_dia_ref is not None:
+            refs[i], especificidad[i] = hist_dia_ref, "dia"
+        elif hist_mes_ref is not None:
+            refs[i], especificidad[i] = hist_mes_ref, "mes"
+        else:
+            especificidad[i] = "global"
+        
+        # Alternativa menos específica para históricos sospechosamente bajos en hora pico
+        if hist_mes_dia_ref is not None:
+            alt_p75[i], alt_nivel[i] = hist_mes_dia_ref["p75"], "mes_dia_fallback"
+        elif hist_mes_ref is not None:
+            alt_p75[i], alt_nivel[i] = hist_mes_ref["p75"], "mes_fallback"
+    
+    # Estadísticas del histórico más específico disponible
+    tiene_ref = np.array([r is not None for r in refs], dtype=bool)
+    p75_hist = np.array([r["p75"] if r is not None else global_median for r in refs], dtype=float)
+    median_hist = np.array([r["p50"] if r is not None else global_median for r in refs], dtype=float)
+    p25_hist = np.array([r["p25"] if r is not None else global_median for r in refs], dtype=float)
+    count_hist = np.array([int(r["count"]) if r is not None else 0 for r in refs], dtype=np.int64)
+    
+    # Determinar tipo de hora del día
+    es_hora_apertura = (hora_int >= 10) & (hora_int < 11)
+    es_hora_pico = (hora_int >= 11) & (hora_int <= 16)
+    es_hora_valle = (hora_int < 10) | (hora_int > 18)
+    
+    # Pesos modelo/histórico (mismas ramas que predict_wait_time)
+    con_hora = np.isin(especificidad, ["mes_hora_dia", "hora_dia", "mes_hora", "hora"])
+    con_ref = con_hora & tiene_ref
+    sospechoso = con_ref & ~es_hora_apertura & es_hora_pico & (p75_hist < 15) & (count_hist < 20)
+    usa_alt = sospechoso & (alt_p75 > p75_hist)
+    especificidad = np.where(usa_alt, alt_nivel, especificidad)
+    
+    hist_base = np.select(
+        [con_ref & es_hora_apertura, usa_alt, con_ref & es_hora_pico, con_ref, con_hora, es_hora_pico],
+        [np.where(count_hist > 10, p25_hist, median_hist), alt_p75, p75_hist, median_hist, median_hist, p75_hist],
+        default=median_hist,
+    )
+    condiciones_peso = [
+        con_ref & es_hora_apertura,
+        sospechoso & (hist_base < 15),
+        sospechoso,
+        con_ref & es_hora_pico,
+        con_ref,
+        con_hora,
+    ]
+    peso_historico = np.select(condiciones_peso, [0.80, 0.30, 0.50, 0.70, 0.75, 0.60], default=0.40)
+    peso_modelo = np.select(condiciones_peso, [0.20, 0.70, 0.50, 0.30, 0.25, 0.40], default=0.60)
+    
+    # Calcular predicción base combinada
+    pred_combinada = pred_base * peso_modelo + hist_base * peso_historico
+    
+    # Batman octubre: boost especial según fin de semana y hora pico
+    es_batman_octubre = np.array(["Batman" in a for a in atracciones], dtype=bool) & (mes == 10)
+    batman = np.select(
+        [
+            es_fin_de_semana & es_hora_pico & ((p75_hist < 15) | (hist_base < 15)),
+            es_fin_de_semana & es_hora_pico,
+            es_fin_de_semana & (hist_base < 10),
+            es_fin_de_semana,
+            es_hora_pico & (hist_base < 15),
+            es_hora_pico,
+        ],
+        [
+            np.maximum.reduce([pred_base * 1.50, pred_combinada * 1.40, np.full(n, 25.0)]),
+            np.maximum.reduce([pred_combinada * 1.30, p75_hist * 1.25, hist_base * 1.35, pred_base * 1.25]),
+            np.maximum.reduce([pred_base * 1.30, pred_combinada * 1.20, np.full(n, 15.0)]),
+            np.maximum(pred_combinada * 1.20, hist_base * 1.25),
+            np.maximum.reduce([pred_base * 1.35, pred_combinada * 1.25, np.full(n, 20.0)]),
+            np.maximum(pred_combinada * 1.15, hist_base * 1.20),
+        ],
+        default=np.maximum(pred_combinada * 1.10, hist_base * 1.15),
+    )
+    
+    # AJUSTES ESPECIALES POR CONTEXTO (en el mismo orden de prioridad que predict_wait_time)
+    condiciones_ajuste = [
+        es_hora_apertura,
+        es_batman_octubre,
+        es_puente_val,
+        (mes == 10) & (dia_semana == 6),
+        (mes == 11) & (dia_semana == 6),
+        es_hora_pico,
+        es_hora_valle,
+        es_fin_de_semana,
+    ]
+    minutos_final = np.select(
+        condiciones_ajuste,
+        [
+            pred_combinada * np.where(es_fin_de_semana, 0.50, 0.60),
+            batman,
+            pred_combinada * np.where(es_fin_de_semana, 1.15, 1.10),
+            np.where(es_hora_pico, pred_combinada * 1.10, pred_combinada),
+            np.where(es_hora_pico, pred_combinada * 1.08, pred_combinada),
+            pred_combinada * 1.05,
+            pred_combinada * 0.90,
+            pred_combinada,
+        ],
+        default=pred_combinada,
+    )
+    prefijo_ajuste = np.select(
+        condiciones_ajuste,
+        [
+            "apertura",
+            np.where(es_fin_de_semana, "batman_octubre_fin_semana", "batman_octubre_laborable"),
+            "puente",
+            "octubre_domingo",
+            "noviembre_domingo",
+            "hora_pico",
+            "hora_valle",
+            "fin_semana",
+        ],
+        default="laborable",
+    )
+    
+    # Asegurar límites razonables
+    minutos_final = np.clip(minutos_final, 5, 180)
+    
+    return [
+        {
+            "minutos_predichos": round(float(minutos_final[i]), 1),
+            "prediccion_base": round(float(pred_base[i]), 1),
+            "p75_historico": round(float(p75_hist[i]), 1),
+            "median_historico": round(float(median_hist[i]), 1),
+            "ajuste_aplicado": f"{prefijo_ajuste[i]}_{especificidad[i]}",
+            "especificidad_historico": especificidad[i],
+            "hora": round(ctx["horas"][i], 2),
+            "hora_int": int(hora_int[i]),
+            "es_hora_apertura": bool(es_hora_apertura[i]),
+            "es_hora_pico": bool(es_hora_pico[i]),
+            "es_hora_valle": bool(es_hora_valle[i]),
+            "es_puente": bool(es_puente_val[i]),
+            "es_batman_octubre": bool(es_batman_octubre[i]),
+            "mes": int(mes[i]),
+            "dia_mes": int(ctx["dia_mes"][i]),
+            "dia_semana": DIAS_SEMANA[dia_semana[i]],
+            "es_fin_de_semana": bool(es_fin_de_semana[i]),
+            "count_historico": int(count_hist[i])
+        }
+        for i in range(n)
+    ]
+
 # Ejemplo de uso
 if __name__ == "__main__":
     print("=" * 70)
@@ -866,3 +814,27 @@ if __name__ == "__main__":
         print(f"   ⏱️  Predicción: {res['minutos_predichos']} min (Base: {res['prediccion_base']:.1f} min)")
         print(f"   📊 Histórico: {res['p75_historico']:.1f} min ({res['especificidad_historico']})")
 
+    
+    # Test adicional: predicción por lotes de un día completo (una sola llamada al modelo)
+    print("\n" + "=" * 70)
+    print("📦 TEST DE PREDICCIÓN POR LOTES (Día completo)")
+    print("=" * 70)
+    
+    inputs_dia = [
+        {
+            "temperatura": 22,
+            "humedad": 60,
+            "sensacion_termica": 22,
+            "codigo_clima": 3,
+            "hora": f"{h:02d}:{m:02d}:00",
+            "zona": "DC Super Heroes World",
+            "atraccion": "Batman Gotham City Escape",
+            "fecha": "2025-11-02"
+        }
+        for h in range(10, 21) for m in (0, 30)
+    ]
+    resultados = predict_wait_time_batch(inputs_dia, artifacts)
+    iguales = all(r == predict_wait_time(i, artifacts) for i, r in zip(inputs_dia, resultados))
+    print(f"\n   📦 {len(resultados)} predicciones en una sola llamada (idénticas a predict_wait_time: {iguales})")
+    for inp, res in zip(inputs_dia[::4], resultados[::4]):
+        print(f"   🕐 {inp['hora'][:5]}: {res['minutos_predichos']} min ({res['ajuste_aplicado']})")
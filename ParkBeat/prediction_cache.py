@@ -0,0 +1,132 @@
+# ====================================================
+# CACHÉ DE PREDICCIONES - LRU con TTL para la Lambda
+# ====================================================
+# Los contenedores calientes de Lambda conservan models_cache, pero cada
+# petición recalculaba la predicción completa. La app envía horas en tramos de
+# 15 minutos, temperatura/humedad enteras y pocos códigos de clima, así que
+# muchas peticiones son idénticas: se cachea la respuesta ya serializada por
+# la tupla canónica (fecha, tramo de hora, atracción, zona, temperatura,
+# humedad, sensación térmica, código de clima).
+#
+# La predicción se calcula siempre sobre el input canónico, de modo que el
+# valor cacheado depende solo de la clave y no de qué petición llenó la caché.
+# Los campos de clima que faltan se quedan fuera del input canónico (el modelo
+# aplica sus defaults de serving, feature_builder.build_serving_features) y
+# valen None en la clave.
+
+import os
+import time
+from collections import OrderedDict
+from datetime import date
+
+import pandas as pd
+
+CACHE_MAX_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "4096"))
+CACHE_TTL_SECONDS = float(os.getenv("PREDICTION_CACHE_TTL", "900"))  # Un ciclo de ingesta (15 min)
+HORA_BUCKET_MINUTES = int(os.getenv("PREDICTION_CACHE_HORA_MINUTES", "15"))
+
+# Campos de clima de la clave canónica, en su orden
+CAMPOS_CLIMA = ("temperatura", "humedad", "sensacion_termica", "codigo_clima")
+
+
+class PredictionCache:
+    """Caché LRU acotada con expiración por TTL y contadores de aciertos/fallos"""
+
+    def __init__(self, max_size=CACHE_MAX_SIZE, ttl=CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key):
+        entrada = self._data.get(key)
+        if entrada is None:
+            self.misses += 1
+            return None
+        valor, expira = entrada
+        if time.monotonic() >= expira:
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return valor
+
+    def set(self, key, valor):
+        if self.max_size <= 0:
+            return
+        self._data[key] = (valor, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def headers(self, hit):
+        """Cabeceras HTTP con el estado de la caché para la respuesta"""
+        return {
+            "X-Cache": "HIT" if hit else "MISS",
+            "X-Cache-Hits": str(self.hits),
+            "X-Cache-Misses": str(self.misses),
+            "X-Cache-Size": str(len(self._data)),
+        }
+
+
+def _hora_a_minutos(hora):
+    """'HH:MM[:SS]' o número de horas -> minutos desde medianoche"""
+    if isinstance(hora, (int, float)):
+        return int(round(float(hora) * 60))
+    partes = str(hora).strip().split(":")
+    return int(float(partes[0])) * 60 + (int(float(partes[1])) if len(partes) > 1 else 0)
+
+
+def _fecha_canonica(valor):
+    """Fecha normalizada a 'YYYY-MM-DD' (None si no es válida); 'YYYY-MM-DD' se valida sin pandas"""
+    if isinstance(valor, str) and len(valor) == 10:
+        try:
+            return date.fromisoformat(valor).isoformat()
+        except ValueError:
+            pass
+    fecha = pd.to_datetime(valor, errors="coerce")
+    return None if pd.isna(fecha) else fecha.strftime("%Y-%m-%d")
+
+
+def _redondear(valor):
+    """Clima canónico: entero redondeado, o None si el campo falta (default de serving)"""
+    return None if valor is None else int(round(float(valor)))
+
+
+def canonical_prediction_input(body, bucket_minutes=HORA_BUCKET_MINUTES):
+    """
+    Devuelve (clave, input_canonico) para una petición de predicción.
+
+    Si el input no se puede canonizar (fecha inválida, hora o clima no
+    numéricos) devuelve (None, body) y la petición no pasa por la caché.
+    """
+    try:
+        fecha_str = _fecha_canonica(body.get("fecha"))
+        if fecha_str is None:
+            # Sin fecha válida la Lambda usa la fecha actual: no es cacheable
+            return None, body
+
+        minutos = _hora_a_minutos(body.get("hora", 12)) // bucket_minutes * bucket_minutes
+        hora_str = f"{minutos // 60:02d}:{minutos % 60:02d}:00"
+
+        clima = {campo: _redondear(body.get(campo)) for campo in CAMPOS_CLIMA}
+    except (TypeError, ValueError, OverflowError):
+        return None, body
+
+    atraccion = body.get("atraccion", "Desconocida")
+    zona = body.get("zona", "Desconocida")
+    if not isinstance(atraccion, str) or not isinstance(zona, str):
+        return None, body
+    clave = (fecha_str, minutos, atraccion, zona, *(clima[campo] for campo in CAMPOS_CLIMA))
+    canonico = {k: v for k, v in body.items() if k not in CAMPOS_CLIMA}
+    canonico.update({"fecha": fecha_str, "hora": hora_str})
+    canonico.update({campo: valor for campo, valor in clima.items() if valor is not None})
+    return clave, canonico
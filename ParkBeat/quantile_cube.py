@@ -0,0 +1,57 @@
+# ====================================================
+# CUBO DE CUANTILES - Estadísticas del histórico por nivel
+# ====================================================
+# Materializa (en train_model.py) los cuantiles p25/p50/p75/p90 y el número
+# de registros de tiempo_espera para cada nivel de la cadena de fallback de
+# predict_wait_time, de modo que en inferencia basta con leer una fila en
+# lugar de filtrar df_processed completo.
+
+from hist_index import build_hist_index
+
+# Niveles de la cadena de fallback (del más específico al más general)
+CUBE_LEVELS = {
+    "mes_hora_dia": ["atraccion", "mes", "hora_int", "dia_semana_num"],
+    "hora_dia": ["atraccion", "hora_int", "dia_semana_num"],
+    "mes_hora": ["atraccion", "mes", "hora_int"],
+    "hora": ["atraccion", "hora_int"],
+    "mes_dia": ["atraccion", "mes", "dia_semana_num"],
+    "dia": ["atraccion", "dia_semana_num"],
+    "mes": ["atraccion", "mes"],
+}
+
+CUBE_QUANTILES = {"p25": 0.25, "p50": 0.50, "p75": 0.75, "p90": 0.90}
+
+
+def build_quantile_cube(df):
+    """Calcula count/p25/p50/p75/p90 de tiempo_espera para cada nivel del cubo"""
+    if df is None or df.empty or "tiempo_espera" not in df.columns:
+        return {}
+
+    # Misma definición de hora que usa predict_wait_time: df["hora"].astype(int)
+    df = df[["atraccion", "mes", "dia_semana_num", "hora", "tiempo_espera"]].copy()
+    df["hora_int"] = df["hora"].astype(int)
+
+    cube = {}
+    for level, keys in CUBE_LEVELS.items():
+        grouped = df.groupby(keys)["tiempo_espera"]
+        table = grouped.quantile(list(CUBE_QUANTILES.values())).unstack()
+        table.columns = list(CUBE_QUANTILES.keys())
+        table.insert(0, "count", grouped.size())
+        cube[level] = table.reset_index()
+    return cube
+
+
+def index_quantile_cube(cube):
+    """Convierte cada nivel del cubo en un dict {(atraccion, ...): {count, p25, ...}}"""
+    return {
+        level: build_hist_index(cube.get(level), keys)
+        for level, keys in CUBE_LEVELS.items()
+    }
+
+
+def get_quantile_cube_index(artifacts):
+    """Devuelve el cubo indexado; si no se cargó el artefacto, lo construye una vez desde df_processed"""
+    if "quantile_cube_index" not in artifacts:
+        cube = artifacts.get("quantile_cube") or build_quantile_cube(artifacts.get("df_processed"))
+        artifacts["quantile_cube_index"] = index_quantile_cube(cube)
+    return artifacts["quantile_cube_index"]
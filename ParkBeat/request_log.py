@@ -0,0 +1,97 @@
+# ====================================================
+# LOGGING DE LA LAMBDA - Niveles, muestreo y formateo diferido
+# ====================================================
+# prepare_input_for_prediction y predict_wait_time imprimían decenas de líneas
+# por petición (json.dumps del input, min/max/mean y búsqueda de NaN/inf en
+# X_scaled, volcados de históricos...) que se serializaban y enviaban a
+# CloudWatch en cada llamada. Con este logger:
+#   - LOG_LEVEL (DEBUG/INFO/WARNING/ERROR, por defecto INFO) fija el nivel,
+#   - LOG_SAMPLE_RATE (0..1, por defecto 0) registra en DEBUG esa fracción de
+#     peticiones aunque el nivel sea mayor (begin_request decide por petición),
+#   - los mensajes usan formato % y lazy(f, *args) difiere el cálculo de los
+#     argumentos caros: si el nivel no está activo no se formatea ni se calcula
+#     nada, solo se compara un entero.
+# Para diagnósticos de varias líneas, log.enabled(DEBUG) permite saltarse el
+# bloque entero.
+
+import logging
+import os
+import random
+import sys
+
+DEBUG, INFO, WARNING, ERROR = logging.DEBUG, logging.INFO, logging.WARNING, logging.ERROR
+
+LOG_LEVEL = getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), INFO)
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0"))
+
+
+class lazy:
+    """Argumento de log que solo se calcula si el mensaje llega a formatearse"""
+
+    __slots__ = ("funcion", "args", "kwargs")
+
+    def __init__(self, funcion, *args, **kwargs):
+        self.funcion = funcion
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return str(self.funcion(*self.args, **self.kwargs))
+
+
+class _StdoutHandler(logging.StreamHandler):
+    """Escribe en el sys.stdout actual (como print), así redirect_stdout también lo captura"""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, valor):
+        pass
+
+
+class SampledLogger:
+    """Logger con nivel efectivo por petición (nivel base o DEBUG si la petición se muestrea)"""
+
+    def __init__(self, nombre="parkbeat", nivel=LOG_LEVEL, sample_rate=LOG_SAMPLE_RATE):
+        self.nivel_base = nivel
+        self.sample_rate = sample_rate
+        self.nivel = nivel
+        self.muestreada = False
+
+        self._logger = logging.getLogger(nombre)
+        self._logger.setLevel(DEBUG)  # El filtrado por nivel lo hace self.nivel
+        self._logger.propagate = False  # El runtime de Lambda ya tiene handler en el root
+        if not self._logger.handlers:
+            handler = _StdoutHandler()
+            handler.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
+            self._logger.addHandler(handler)
+
+    def begin_request(self):
+        """Decide el nivel de esta petición; devuelve True si se registra en DEBUG por muestreo"""
+        self.muestreada = self.sample_rate > 0 and random.random() < self.sample_rate
+        self.nivel = DEBUG if self.muestreada else self.nivel_base
+        return self.muestreada
+
+    def enabled(self, nivel):
+        return nivel >= self.nivel
+
+    def debug(self, msg, *args):
+        if self.nivel <= DEBUG:
+            self._logger.debug(msg, *args)
+
+    def info(self, msg, *args):
+        if self.nivel <= INFO:
+            self._logger.info(msg, *args)
+
+    def warning(self, msg, *args):
+        if self.nivel <= WARNING:
+            self._logger.warning(msg, *args)
+
+    def error(self, msg, *args, exc_info=False):
+        if self.nivel <= ERROR:
+            self._logger.error(msg, *args, exc_info=exc_info)
+
+
+log = SampledLogger()
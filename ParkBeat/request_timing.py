@@ -0,0 +1,97 @@
+# ====================================================
+# TIEMPOS POR PETICIÓN - Desglose por etapas de lambda_handler
+# ====================================================
+# Mide con el reloj monótono (time.perf_counter) cuánto tarda cada etapa de
+# una petición: carga de artefactos, parseo del body, caché, tabla de
+# previsiones, preparación de features, escalado, modelo, mezcla con el
+# histórico y serialización. Al terminar se emite una línea JSON en formato
+# CloudWatch Embedded Metric Format (EMF) y, opcionalmente, la cabecera
+# Server-Timing de la respuesta.
+#
+# Las etapas se marcan por vueltas: lap("scale") asigna a "scale" el tiempo
+# transcurrido desde la marca anterior, así que no hace falta reindentar el
+# código instrumentado. Es opcional (REQUEST_TIMING=1): la línea EMF es un
+# log más por petición en CloudWatch, con su coste de ingesta. Desactivado no
+# hay timer activo y lap() solo comprueba una variable global.
+
+import json
+import os
+import time
+
+REQUEST_TIMING = os.getenv("REQUEST_TIMING", "0") == "1"
+SERVER_TIMING_HEADER = os.getenv("SERVER_TIMING_HEADER", "0") == "1"
+EMF_NAMESPACE = os.getenv("EMF_NAMESPACE", "ParkBeat")
+
+# Timer de la petición en curso (Lambda atiende una petición a la vez por contenedor)
+_actual = None
+
+
+class RequestTimer:
+    """Duraciones (ms) por etapa de una petición y si fue un arranque en frío"""
+
+    def __init__(self, cold):
+        self.cold = cold
+        self.etapas = {}
+        self._inicio = self._ultimo = time.perf_counter()
+
+    def lap(self, etapa):
+        ahora = time.perf_counter()
+        self.etapas[etapa] = self.etapas.get(etapa, 0.0) + (ahora - self._ultimo) * 1000
+        self._ultimo = ahora
+
+    def total_ms(self):
+        return (time.perf_counter() - self._inicio) * 1000
+
+    def emf_record(self, dimensiones=None, propiedades=None):
+        """Registro EMF: una métrica <etapa>_ms por etapa más total_ms"""
+        total = self.total_ms()
+        dimensiones = {"Arranque": "cold" if self.cold else "warm", **(dimensiones or {})}
+        metricas = {f"{etapa}_ms": round(ms, 3) for etapa, ms in self.etapas.items()}
+        metricas["total_ms"] = round(total, 3)
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": EMF_NAMESPACE,
+                    "Dimensions": [list(dimensiones)],
+                    "Metrics": [{"Name": nombre, "Unit": "Milliseconds"} for nombre in metricas],
+                }],
+            },
+            **dimensiones,
+            **metricas,
+            **(propiedades or {}),
+        }
+
+    def server_timing(self):
+        """Valor de la cabecera Server-Timing: 'etapa;dur=ms, ..., total;dur=ms'"""
+        partes = [f"{etapa};dur={ms:.3f}" for etapa, ms in self.etapas.items()]
+        partes.append(f"total;dur={self.total_ms():.3f}")
+        return ", ".join(partes)
+
+
+def start_request(cold, enabled=None):
+    """Activa un timer para la petición (None si la medición está desactivada)"""
+    global _actual
+    _actual = RequestTimer(cold) if (REQUEST_TIMING if enabled is None else enabled) else None
+    return _actual
+
+
+def lap(etapa):
+    """Cierra la etapa en curso del timer activo; no hace nada si no hay timer"""
+    if _actual is not None:
+        _actual.lap(etapa)
+
+
+def finish_request(respuesta, dimensiones=None, propiedades=None):
+    """Emite la línea EMF y, si está activada, añade Server-Timing a la respuesta"""
+    global _actual
+    timer, _actual = _actual, None
+    if timer is None:
+        return respuesta
+
+    print(json.dumps(timer.emf_record(dimensiones, propiedades)))
+    if SERVER_TIMING_HEADER:
+        headers = respuesta.setdefault("headers", {})
+        headers["Server-Timing"] = timer.server_timing()
+        headers["Timing-Allow-Origin"] = "*"
+    return respuesta
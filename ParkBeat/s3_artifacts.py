@@ -0,0 +1,193 @@
+# ====================================================
+# DESCARGA DE ARTEFACTOS - S3 en paralelo con caché en /tmp
+# ====================================================
+# load_model_from_s3 descargaba los artefactos uno detrás de otro y guardaba
+# cada cuerpo completo en memoria (BytesIO) antes de deserializarlo. Aquí:
+#   - todas las claves se piden a la vez con un pool de hilos (el cliente de
+#     boto3 es thread-safe),
+#   - cada cuerpo se vuelca por bloques a ARTIFACT_CACHE_DIR (/tmp en Lambda),
+#   - junto a cada fichero se guarda su ETag: si el contenedor se reutiliza y
+#     el objeto de S3 no ha cambiado (p. ej. despliegue solo de código), basta
+#     un head_object y no se vuelve a descargar,
+#   - se miden por artefacto los tiempos de descarga y de deserialización.
+#
+# LocalDirS3 imita el cliente de S3 sobre un directorio local para probar la
+# carga sin AWS.
+
+import hashlib
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ARTIFACT_CACHE_DIR = os.getenv("ARTIFACT_CACHE_DIR", "/tmp/parkbeat-artifacts")
+ARTIFACT_WORKERS = int(os.getenv("ARTIFACT_DOWNLOAD_WORKERS", "8"))
+CHUNK_BYTES = 1 << 20
+
+
+def _ruta_local(cache_dir, key):
+    return os.path.join(cache_dir, *key.split("/"))
+
+
+def _leer_etag(ruta):
+    try:
+        with open(ruta + ".etag", encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def fetch_artifact(s3, bucket, key, cache_dir=ARTIFACT_CACHE_DIR):
+    """
+    Deja s3://bucket/key en cache_dir y devuelve su información de descarga.
+
+    Si ya hay una copia local con el mismo ETag no se descarga de nuevo.
+    Los errores de S3 (clave inexistente, permisos...) se propagan.
+    """
+    ruta = _ruta_local(cache_dir, key)
+    inicio = time.perf_counter()
+
+    etag = s3.head_object(Bucket=bucket, Key=key)["ETag"]
+    desde_cache = os.path.exists(ruta) and _leer_etag(ruta) == etag
+    if not desde_cache:
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        obj = s3.get_object(Bucket=bucket, Key=key)
+        etag = obj.get("ETag", etag)
+        # Volcado por bloques a un fichero temporal y renombrado atómico
+        parcial = f"{ruta}.{os.getpid()}.part"
+        try:
+            with open(parcial, "wb") as f:
+                shutil.copyfileobj(obj["Body"], f, CHUNK_BYTES)
+        finally:
+            obj["Body"].close()
+        os.replace(parcial, ruta)
+        with open(ruta + ".etag", "w", encoding="utf-8") as f:
+            f.write(etag)
+
+    return {
+        "key": key,
+        "path": ruta,
+        "etag": etag,
+        "bytes": os.path.getsize(ruta),
+        "desde_cache": desde_cache,
+        "descarga_ms": (time.perf_counter() - inicio) * 1000,
+        "deserializacion_ms": None,
+    }
+
+
+def fetch_artifacts(s3, bucket, keys, cache_dir=ARTIFACT_CACHE_DIR, workers=ARTIFACT_WORKERS):
+    """
+    Descarga varias claves en paralelo.
+
+    Devuelve (descargas, errores): {key: info de fetch_artifact} para las que
+    se obtuvieron y {key: mensaje} para las que fallaron (las opcionales
+    pueden no existir; decide quien llama).
+    """
+    keys = list(dict.fromkeys(keys))
+    descargas, errores = {}, {}
+    if not keys:
+        return descargas, errores
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(keys)))) as pool:
+        futuros = {key: pool.submit(fetch_artifact, s3, bucket, key, cache_dir) for key in keys}
+        for key, futuro in futuros.items():
+            try:
+                descargas[key] = futuro.result()
+            except Exception as e:
+                errores[key] = str(e)
+    return descargas, errores
+
+
+def timed_load(info, loader):
+    """Deserializa info['path'] con loader y anota el tiempo en info['deserializacion_ms']"""
+    inicio = time.perf_counter()
+    valor = loader(info["path"])
+    info["deserializacion_ms"] = (time.perf_counter() - inicio) * 1000
+    return valor
+
+
+def format_timings(infos):
+    """Líneas de texto con tamaño, descarga y deserialización de cada artefacto"""
+    lineas = []
+    for info in infos:
+        origen = "caché /tmp" if info["desde_cache"] else "S3"
+        deserializacion = info["deserializacion_ms"]
+        lineas.append(
+            f"   {info['key']}: {info['bytes'] / 1024:.0f} KB desde {origen} en {info['descarga_ms']:.0f} ms"
+            + (f", deserializado en {deserializacion:.1f} ms" if deserializacion is not None else "")
+        )
+    return lineas
+
+
+class LocalDirS3:
+    """Cliente de S3 mínimo (head_object/get_object) sobre un directorio: bucket/key -> raiz/key"""
+
+    def __init__(self, raiz):
+        self.raiz = raiz
+        self.peticiones = []
+
+    def _ruta(self, key):
+        ruta = os.path.join(self.raiz, *key.split("/"))
+        if not os.path.isfile(ruta):
+            raise FileNotFoundError(f"NoSuchKey: {key}")
+        return ruta
+
+    def _etag(self, ruta):
+        md5 = hashlib.md5()
+        with open(ruta, "rb") as f:
+            for bloque in iter(lambda: f.read(CHUNK_BYTES), b""):
+                md5.update(bloque)
+        return f'"{md5.hexdigest()}"'
+
+    def head_object(self, Bucket, Key):
+        self.peticiones.append(("head", Key))
+        ruta = self._ruta(Key)
+        return {"ETag": self._etag(ruta), "ContentLength": os.path.getsize(ruta)}
+
+    def get_object(self, Bucket, Key):
+        self.peticiones.append(("get", Key))
+        ruta = self._ruta(Key)
+        return {"ETag": self._etag(ruta), "ContentLength": os.path.getsize(ruta), "Body": open(ruta, "rb")}
+
+
+# Prueba local: bucket simulado con los artefactos de models/ y dos cargas de la Lambda
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import sys
+    import tempfile
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-3")
+    import lambda_function
+
+    base_path = "models" if os.path.exists("models/xgb_model_professional.pkl") else "../models"
+    sin_bundle = os.getenv("SIN_BUNDLE") == "1"
+
+    with tempfile.TemporaryDirectory() as bucket, tempfile.TemporaryDirectory() as cache:
+        # Misma estructura de claves que el bucket real: models/* e historicos/hist_*.pkl
+        for nombre in os.listdir(base_path):
+            if sin_bundle and nombre.startswith("serving_bundle"):
+                continue
+            carpeta = "historicos" if nombre.startswith("hist_") else "models"
+            os.makedirs(os.path.join(bucket, carpeta), exist_ok=True)
+            shutil.copy(os.path.join(base_path, nombre), os.path.join(bucket, carpeta, nombre))
+
+        s3 = LocalDirS3(bucket)
+        lambda_function.s3 = s3
+        lambda_function.ARTIFACT_CACHE_DIR = cache
+
+        print("=" * 70)
+        print(f"☁️  CARGA DE ARTEFACTOS CON S3 LOCAL ({'pickles' if sin_bundle else 'bundle'})")
+        print("=" * 70)
+        for intento in ["Contenedor nuevo (/tmp vacío)", "Contenedor reutilizado (mismos ETag)"]:
+            lambda_function.models_cache.clear()
+            s3.peticiones.clear()
+            inicio = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                artifacts = lambda_function.load_model_from_s3()
+            total = (time.perf_counter() - inicio) * 1000
+            gets = sum(1 for tipo, _ in s3.peticiones if tipo == "get")
+            print(f"\n{intento}: {total:.0f} ms, {gets} get_object")
+            for linea in format_timings(artifacts["artifact_timings"]):
+                print(linea)
+        sys.exit(0 if "scaler" in artifacts else 1)
@@ -0,0 +1,61 @@
+# ====================================================
+# PLEGADO DEL SCALER EN EL MODELO - Serving sin StandardScaler
+# ====================================================
+# El XGBoost se entrena sobre la salida del StandardScaler. Como cada split
+# compara una sola feature con un umbral (x_escalada < t) y el escalado es
+# monótono creciente por feature, el mismo split se puede expresar en el
+# espacio original: x < t * scale + mean. tree_ensemble.export_tree_ensemble
+# reescribe así los umbrales del ensemble NumPy para que el serving reciba las
+# features sin escalar.
+#
+# La frontera exacta del split original es el float64 más pequeño v tal que
+# float32((v - mean) / scale) >= t (mismas operaciones que scaler.transform
+# seguidas del cast a float32 de XGBoost). Se calcula por bisección y es exacta
+# para cualquier entrada float64. Un booster de XGBoost no sirve para esto:
+# solo admite umbrales float32 y redondear la frontera cambia las predicciones
+# de las features que no son representables en float32.
+
+import numpy as np
+
+
+def scaler_params(scaler, n_features):
+    """Devuelve (mean, scale) en float64 tal y como los aplica scaler.transform"""
+    mean = np.zeros(n_features)
+    scale = np.ones(n_features)
+    if getattr(scaler, "with_mean", True) and getattr(scaler, "mean_", None) is not None:
+        mean = np.asarray(scaler.mean_, dtype=np.float64)
+    if getattr(scaler, "with_std", True) and getattr(scaler, "scale_", None) is not None:
+        scale = np.asarray(scaler.scale_, dtype=np.float64)
+    return mean, scale
+
+
+def fold_thresholds(thresholds, mean, scale, max_iter=80):
+    """
+    Convierte umbrales del espacio escalado al espacio original (frontera exacta en float64).
+
+    thresholds, mean y scale son arrays alineados (un valor por split).
+    """
+    t = np.asarray(thresholds, dtype=np.float32)
+    mean = np.asarray(mean, dtype=np.float64)
+    scale = np.asarray(scale, dtype=np.float64)
+
+    def a_la_derecha(v):
+        # Mismas operaciones que StandardScaler.transform seguidas del cast de XGBoost
+        return ((v - mean) / scale).astype(np.float32) >= t
+
+    # Intervalo inicial: los float32 vecinos de t acotan la frontera
+    lo = np.nextafter(t, np.float32(-np.inf)).astype(np.float64) * scale + mean
+    hi = np.nextafter(t, np.float32(np.inf)).astype(np.float64) * scale + mean
+    if a_la_derecha(lo).any() or not a_la_derecha(hi).all():
+        raise ValueError("No se pudo acotar el umbral de algunos splits en el espacio original")
+
+    # Bisección hasta que lo y hi sean float64 consecutivos (lo a la izquierda, hi a la derecha)
+    for _ in range(max_iter):
+        pendientes = np.nextafter(lo, np.inf) < hi
+        if not pendientes.any():
+            return hi
+        mid = lo + (hi - lo) / 2
+        derecha = a_la_derecha(mid)
+        hi = np.where(pendientes & derecha, mid, hi)
+        lo = np.where(pendientes & ~derecha, mid, lo)
+    raise ValueError("No se pudo ajustar el umbral de algunos splits al espacio original")
@@ -0,0 +1,275 @@
+# ====================================================
+# BUNDLE DE SERVING - Un solo fichero en lugar de once pickles
+# ====================================================
+# La Lambda descargaba diez pickles de S3 (incluido df_processed, el DataFrame
+# completo de entrenamiento) y predict.py cargaba once con joblib. Aquí se
+# empaqueta solo lo que necesita la inferencia, ya precalculado:
+#   - el ensemble de árboles en arrays (tree_ensemble.py, sin xgboost),
+#     con el scaler plegado si train_model.py pudo exportarlo así,
+#   - mean/scale del StandardScaler y el orden de columnas,
+#   - encoding_maps y serving_metadata (stats y listas de atracciones/zonas),
+#   - el índice de históricos y el cubo de cuantiles ya indexados.
+#
+# Formato (versionado, mapeable en memoria):
+#   MAGIC (8 bytes) | versión uint32 | longitud cabecera uint32 | cabecera JSON
+#   | relleno hasta ALINEACION | arrays crudos, cada uno alineado a ALINEACION
+# La cabecera describe cada array (dtype, shape, offset) y guarda los objetos
+# pequeños (encodings, columnas, stats). Al cargar, los arrays son vistas
+# np.frombuffer sobre el fichero mapeado o sobre los bytes descargados: una
+# sola lectura y sin deserializar pickles.
+
+import json
+import mmap
+import struct
+from datetime import datetime
+
+import numpy as np
+
+from hist_index import HIST_KEYS, get_hist_indexes
+from quantile_cube import CUBE_LEVELS, get_quantile_cube_index
+from serving_metadata import get_serving_metadata
+
+BUNDLE_MAGIC = b"PBSERVE\x00"
+BUNDLE_VERSION = 3
+BUNDLE_FILENAME = "serving_bundle.bin"
+ALINEACION = 64
+
+_PREAMBULO = struct.Struct("<8sII")
+
+# Campos escalares del ensemble (el resto son arrays)
+_ENSEMBLE_ESCALARES = ["n_features", "escalado_plegado", "max_depth"]
+
+
+class BundleScaler:
+    """Parámetros del StandardScaler sin sklearn: mismo transform y atributos que usa feature_layout"""
+
+    def __init__(self, mean, scale, feature_names, with_mean=True, with_std=True):
+        self.with_mean = with_mean
+        self.with_std = with_std
+        self.mean_ = mean
+        self.scale_ = scale
+        self.feature_names_in_ = np.asarray(feature_names, dtype=object)
+        self.n_features_in_ = len(feature_names)
+
+    def transform(self, X):
+        X = np.array(X, dtype=np.float64, ndmin=2)
+        if self.with_mean and self.mean_ is not None:
+            X -= self.mean_
+        if self.with_std and self.scale_ is not None:
+            X /= self.scale_
+        return X
+
+
+def _a_json(valor):
+    """Convierte escalares NumPy a tipos nativos para la cabecera JSON"""
+    if isinstance(valor, dict):
+        return {k: _a_json(v) for k, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [_a_json(v) for v in valor]
+    if isinstance(valor, np.generic):
+        return valor.item()
+    return valor
+
+
+def _index_a_columnas(index, n_claves, atracciones):
+    """Convierte un índice {(atraccion, k1, ...): {col: valor}} en arrays columnares"""
+    claves = list(index.keys())
+    registros = list(index.values())
+    columnas = list(registros[0].keys()) if registros else []
+    posicion = {a: i for i, a in enumerate(atracciones)}
+
+    arrays = {"k0": np.array([posicion[k[0]] for k in claves], dtype=np.int32)}
+    for j in range(1, n_claves):
+        arrays[f"k{j}"] = np.array([k[j] for k in claves], dtype=np.int64)
+    for col in columnas:
+        arrays[f"v_{col}"] = np.array([r[col] for r in registros])
+    return arrays, columnas
+
+
+def _columnas_a_index(arrays, prefijo, n_claves, columnas, atracciones):
+    """Inverso de _index_a_columnas: reconstruye el dict con tipos nativos de Python"""
+    claves = [[atracciones[i] for i in arrays[f"{prefijo}/k0"].tolist()]]
+    claves += [arrays[f"{prefijo}/k{j}"].tolist() for j in range(1, n_claves)]
+    valores = [arrays[f"{prefijo}/v_{col}"].tolist() for col in columnas]
+    return {
+        clave: dict(zip(columnas, fila))
+        for clave, fila in zip(zip(*claves), zip(*valores))
+    }
+
+
+def build_serving_bundle(artifacts):
+    """
+    Reúne en (cabecera, arrays) todo lo que necesita la inferencia.
+
+    artifacts es el dict de load_model_artifacts (o el de train_model.py):
+    necesita tree_ensemble, scaler, encoding_maps y columnas_entrenamiento;
+    índices y stats se calculan con los get_* si no están.
+    """
+    ensemble = artifacts.get("tree_ensemble")
+    if ensemble is None:
+        raise ValueError("El bundle necesita el ensemble de árboles (xgb_tree_ensemble.pkl)")
+
+    scaler = artifacts["scaler"]
+    columnas = list(artifacts.get("columnas_entrenamiento") or scaler.feature_names_in_)
+    hist_index = get_hist_indexes(artifacts)
+    cube_index = get_quantile_cube_index(artifacts)
+
+    # Vocabulario de atracciones compartido por todas las tablas
+    atracciones = sorted({k[0] for tabla in [*hist_index.values(), *cube_index.values()] for k in tabla})
+
+    arrays = {f"ensemble/{k}": v for k, v in ensemble.items()
+              if isinstance(v, np.ndarray)}
+    arrays["ensemble/base_score"] = np.array([ensemble["base_score"]], dtype=np.float32)
+    arrays["scaler/mean"] = np.asarray(scaler.mean_, dtype=np.float64)
+    arrays["scaler/scale"] = np.asarray(scaler.scale_, dtype=np.float64)
+
+    tablas = {}
+    for grupo, index, niveles in [("hist", hist_index, HIST_KEYS), ("cube", cube_index, CUBE_LEVELS)]:
+        for nombre, claves in niveles.items():
+            cols_tabla, valores = _index_a_columnas(index.get(nombre, {}), len(claves), atracciones)
+            arrays.update({f"{grupo}/{nombre}/{k}": v for k, v in cols_tabla.items()})
+            tablas[f"{grupo}/{nombre}"] = valores
+
+    meta = {
+        "creado": datetime.now().isoformat(timespec="seconds"),
+        "columnas_entrenamiento": columnas,
+        "scaler": {
+            "with_mean": bool(getattr(scaler, "with_mean", True)),
+            "with_std": bool(getattr(scaler, "with_std", True)),
+            "feature_names": [str(c) for c in scaler.feature_names_in_],
+        },
+        "encoding_maps": artifacts["encoding_maps"],
+        "serving_metadata": get_serving_metadata(artifacts),
+        "ensemble": {k: ensemble[k] for k in _ENSEMBLE_ESCALARES},
+        "atracciones": atracciones,
+        "tablas": tablas,
+    }
+    return _a_json(meta), arrays
+
+
+def save_serving_bundle(artifacts, destino):
+    """Escribe el bundle en destino (ruta); devuelve el tamaño en bytes"""
+    meta, arrays = build_serving_bundle(artifacts)
+
+    descriptores = {}
+    offset = 0
+    for nombre, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[nombre] = array
+        descriptores[nombre] = [array.dtype.str, list(array.shape), offset]
+        offset += -(-array.nbytes // ALINEACION) * ALINEACION
+    cabecera = json.dumps({"arrays": descriptores, "meta": meta}, ensure_ascii=False).encode("utf-8")
+
+    inicio_datos = -(-(_PREAMBULO.size + len(cabecera)) // ALINEACION) * ALINEACION
+    with open(destino, "wb") as f:
+        f.write(_PREAMBULO.pack(BUNDLE_MAGIC, BUNDLE_VERSION, len(cabecera)))
+        f.write(cabecera)
+        for nombre, array in arrays.items():
+            f.seek(inicio_datos + descriptores[nombre][2])
+            f.write(array.tobytes())
+        f.truncate(inicio_datos + offset)
+        return inicio_datos + offset
+
+
+def load_serving_bundle(origen):
+    """
+    Abre el bundle (ruta, que se mapea en memoria, o bytes descargados de S3)
+    y devuelve un dict de artefactos listo para predict_wait_time.
+    """
+    if isinstance(origen, (bytes, bytearray, memoryview)):
+        buffer = origen
+    else:
+        with open(origen, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, longitud = _PREAMBULO.unpack_from(buffer, 0)
+    if magic != BUNDLE_MAGIC:
+        raise ValueError("El fichero no es un bundle de serving")
+    if version != BUNDLE_VERSION:
+        raise ValueError(f"Versión de bundle no soportada: {version}")
+    cabecera = json.loads(bytes(buffer[_PREAMBULO.size:_PREAMBULO.size + longitud]))
+    inicio_datos = -(-(_PREAMBULO.size + longitud) // ALINEACION) * ALINEACION
+
+    arrays = {}
+    for nombre, (dtype, shape, offset) in cabecera["arrays"].items():
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape, dtype=np.int64))
+        arrays[nombre] = np.frombuffer(buffer, dtype=dtype, count=count,
+                                       offset=inicio_datos + offset).reshape(shape)
+
+    meta = cabecera["meta"]
+    ensemble = {k[len("ensemble/"):]: v for k, v in arrays.items() if k.startswith("ensemble/")}
+    ensemble.update(meta["ensemble"])
+    ensemble["base_score"] = ensemble["base_score"][0]
+
+    atracciones = meta["atracciones"]
+    tablas = meta["tablas"]
+    hist_index = {
+        nombre: _columnas_a_index(arrays, f"hist/{nombre}", len(claves), tablas[f"hist/{nombre}"], atracciones)
+        for nombre, claves in HIST_KEYS.items()
+    }
+    cube_index = {
+        nombre: _columnas_a_index(arrays, f"cube/{nombre}", len(claves), tablas[f"cube/{nombre}"], atracciones)
+        for nombre, claves in CUBE_LEVELS.items()
+    }
+
+    scaler_meta = meta["scaler"]
+    scaler = BundleScaler(arrays["scaler/mean"], arrays["scaler/scale"], scaler_meta["feature_names"],
+                          scaler_meta["with_mean"], scaler_meta["with_std"])
+
+    return {
+        "model": None,
+        "tree_ensemble": ensemble,
+        "scaler": scaler,
+        "encoding_maps": meta["encoding_maps"],
+        "columnas_entrenamiento": meta["columnas_entrenamiento"],
+        "hist_index": hist_index,
+        "quantile_cube_index": cube_index,
+        "serving_metadata": meta["serving_metadata"],
+        "serving_stats": meta["serving_metadata"]["serving_stats"],
+        "bundle_version": version,
+        "bundle_creado": meta["creado"],
+    }
+
+
+# Construir el bundle desde models/ y comparar tamaño y tiempo de carga con los pickles
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import os
+    import time
+
+    from predict import load_model_artifacts
+
+    base_path = "models" if os.path.exists("models/xgb_model_professional.pkl") else "../models"
+    destino = os.path.join(base_path, BUNDLE_FILENAME)
+
+    print("=" * 70)
+    print("📦 BUNDLE DE SERVING")
+    print("=" * 70)
+
+    # Carga de referencia con los pickles sueltos (sin usar un bundle previo)
+    if os.path.exists(destino):
+        os.remove(destino)
+    inicio = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        artifacts = load_model_artifacts()
+    t_pickles = time.perf_counter() - inicio
+    ficheros = [f for f in os.listdir(base_path) if f.endswith(".pkl")]
+    bytes_pickles = sum(os.path.getsize(os.path.join(base_path, f)) for f in ficheros)
+
+    tamano = save_serving_bundle(artifacts, destino)
+
+    inicio = time.perf_counter()
+    bundle = load_serving_bundle(destino)
+    t_bundle = time.perf_counter() - inicio
+
+    # repr: compara también los tipos y trata los NaN de los std como iguales
+    # (serving_metadata: los escalares NumPy de las stats pasan a float en el JSON)
+    artifacts["serving_metadata"] = _a_json(artifacts["serving_metadata"])
+    iguales = all(repr(bundle[k]) == repr(artifacts[k])
+                  for k in ["hist_index", "quantile_cube_index", "encoding_maps", "columnas_entrenamiento",
+                            "serving_metadata"])
+    print(f"Pickles ({len(ficheros)}): {bytes_pickles / 1024:.0f} KB, carga {t_pickles * 1000:.0f} ms")
+    print(f"Bundle v{BUNDLE_VERSION}: {tamano / 1024:.0f} KB, carga {t_bundle * 1000:.1f} ms → {destino}")
+    print(f"✓ Índices y encodings idénticos a los de los pickles: {iguales}")
@@ -0,0 +1,71 @@
+# ====================================================
+# METADATOS DE SERVING - Lo que la inferencia usaba de df_processed
+# ====================================================
+# df_processed es el DataFrame completo de entrenamiento, pero en serving solo
+# se usaba para: fallbacks globales y mapas de frecuencia (serving_stats), las
+# listas de atracciones/zonas y la zona de cada atracción en app.py, y el
+# número de registros históricos. train_model.py guarda aquí solo eso, así que
+# la memoria de serving no crece con el tamaño del conjunto de entrenamiento.
+# (Los cuantiles por nivel de fallback viven en el cubo de quantile_cube.py.)
+
+import os
+
+import joblib
+import pandas as pd
+
+from serving_stats import build_serving_stats
+
+SERVING_METADATA_VERSION = 1
+SERVING_METADATA_FILENAME = "serving_metadata.pkl"
+MODEL_DIRS = ["../models", "models"]
+
+
+def build_serving_metadata(df):
+    """Calcula los metadatos de serving sobre df_processed (o las columnas que usan)"""
+    metadata = {
+        "version": SERVING_METADATA_VERSION,
+        "serving_stats": build_serving_stats(df),
+        "atracciones": [],
+        "zonas": [],
+        "zona_por_atraccion": {},
+        "n_registros": 0 if df is None else len(df),
+    }
+    if df is None or df.empty:
+        return metadata
+
+    if "atraccion" in df.columns:
+        metadata["atracciones"] = sorted(df["atraccion"].dropna().astype(str).unique().tolist())
+    if "zona" in df.columns:
+        metadata["zonas"] = sorted(df["zona"].dropna().astype(str).unique().tolist())
+    if "atraccion" in df.columns and "zona" in df.columns:
+        # Zona de la primera fila de cada atracción (como hacía app.py con .iloc[0])
+        primeras = df[["atraccion", "zona"]].dropna(subset=["atraccion"]).drop_duplicates("atraccion")
+        metadata["zona_por_atraccion"] = {
+            str(a): ("" if pd.isna(z) else str(z))
+            for a, z in zip(primeras["atraccion"].tolist(), primeras["zona"].tolist())
+        }
+    return metadata
+
+
+def get_serving_metadata(artifacts):
+    """Devuelve los metadatos de serving; con artefactos antiguos los calcula una vez desde df_processed"""
+    if "serving_metadata" not in artifacts:
+        artifacts["serving_metadata"] = build_serving_metadata(artifacts.get("df_processed"))
+    return artifacts["serving_metadata"]
+
+
+def load_serving_metadata(directorios=MODEL_DIRS):
+    """
+    Carga solo los metadatos de serving (sin modelo, scaler ni históricos).
+
+    Con artefactos anteriores a serving_metadata.pkl los calcula desde
+    df_processed.pkl. Devuelve None si no hay ningún directorio de modelos.
+    """
+    for directorio in directorios:
+        metadata_path = os.path.join(directorio, SERVING_METADATA_FILENAME)
+        if os.path.exists(metadata_path):
+            return joblib.load(metadata_path)
+        df_path = os.path.join(directorio, "df_processed.pkl")
+        if os.path.exists(df_path):
+            return build_serving_metadata(joblib.load(df_path))
+    return None
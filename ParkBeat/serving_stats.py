@@ -0,0 +1,56 @@
+# ====================================================
+# ESTADÍSTICAS DE SERVING - Fallbacks globales precalculados
+# ====================================================
+# Calcula una sola vez (al cargar los artefactos) los valores globales que
+# prepare_input_for_prediction y predict_wait_time usan como fallback cuando
+# no hay histórico, además de los mapas de frecuencia de zona/atracción.
+
+import numpy as np
+
+
+def build_serving_stats(df_train):
+    """Calcula los fallbacks globales y mapas de frecuencia sobre df_processed"""
+    stats = {
+        "global_mean": np.nan,
+        "global_median": np.nan,
+        "global_std": np.nan,
+        "global_p75": np.nan,
+        "global_p90": np.nan,
+        "global_p95": np.nan,
+        "temperatura_median": None,
+        "humedad_median": None,
+        "zona_freq": {},
+        "atraccion_freq": {},
+    }
+    if df_train is None or df_train.empty:
+        return stats
+
+    if "tiempo_espera" in df_train.columns:
+        tiempos = df_train["tiempo_espera"]
+        stats["global_mean"] = tiempos.mean()
+        stats["global_median"] = tiempos.median()
+        stats["global_std"] = tiempos.std()
+        stats["global_p75"] = np.percentile(tiempos, 75)
+        stats["global_p90"] = np.percentile(tiempos, 90)
+        stats["global_p95"] = np.percentile(tiempos, 95)
+
+    if "temperatura" in df_train.columns:
+        stats["temperatura_median"] = df_train["temperatura"].median()
+    if "humedad" in df_train.columns:
+        stats["humedad_median"] = df_train["humedad"].median()
+
+    if "zona" in df_train.columns:
+        stats["zona_freq"] = df_train["zona"].value_counts().to_dict()
+    if "atraccion" in df_train.columns:
+        stats["atraccion_freq"] = df_train["atraccion"].value_counts().to_dict()
+
+    return stats
+
+
+def get_serving_stats(artifacts):
+    """Devuelve las estadísticas de serving (de serving_metadata o, si no hay, de df_processed una sola vez)"""
+    if "serving_stats" not in artifacts:
+        metadata = artifacts.get("serving_metadata")
+        artifacts["serving_stats"] = (metadata["serving_stats"] if metadata
+                                      else build_serving_stats(artifacts.get("df_processed")))
+    return artifacts["serving_stats"]
@@ -0,0 +1,5 @@
+# Los módulos de ParkBeat se importan por nombre (como hacen train_model.py y la Lambda)
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
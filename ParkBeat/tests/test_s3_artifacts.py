@@ -0,0 +1,69 @@
+import os
+
+import joblib
+import pytest
+
+from s3_artifacts import LocalDirS3, fetch_artifacts, timed_load
+
+CLAVES = ["models/xgb_scaler_professional.pkl", "historicos/hist_mes.pkl"]
+
+
+@pytest.fixture
+def bucket(tmp_path):
+    """Bucket local con dos artefactos y una caché /tmp vacía"""
+    raiz = tmp_path / "bucket"
+    for i, clave in enumerate(CLAVES):
+        ruta = raiz / clave
+        ruta.parent.mkdir(parents=True, exist_ok=True)
+        joblib.dump({"artefacto": i}, ruta)
+    return LocalDirS3(str(raiz)), str(tmp_path / "cache")
+
+
+def _gets(s3):
+    return [key for op, key in s3.peticiones if op == "get"]
+
+
+def test_unchanged_etag_is_served_from_cache(bucket):
+    s3, cache = bucket
+    primera, errores = fetch_artifacts(s3, "bucket", CLAVES, cache)
+    assert errores == {}
+    assert sorted(_gets(s3)) == sorted(CLAVES)
+    assert not any(info["desde_cache"] for info in primera.values())
+
+    # Contenedor reutilizado: solo head_object, ninguna descarga
+    s3.peticiones.clear()
+    segunda, errores = fetch_artifacts(s3, "bucket", CLAVES, cache)
+    assert errores == {}
+    assert _gets(s3) == []
+    assert all(info["desde_cache"] for info in segunda.values())
+    assert {k: info["etag"] for k, info in segunda.items()} == {k: info["etag"] for k, info in primera.items()}
+    assert timed_load(segunda[CLAVES[1]], joblib.load) == {"artefacto": 1}
+
+
+def test_changed_etag_forces_download(bucket):
+    s3, cache = bucket
+    primera, _ = fetch_artifacts(s3, "bucket", CLAVES, cache)
+
+    # Nuevo entrenamiento: el objeto cambia en S3 (otro contenido, otro ETag)
+    joblib.dump({"artefacto": "nuevo"}, os.path.join(s3.raiz, *CLAVES[0].split("/")))
+    s3.peticiones.clear()
+    segunda, errores = fetch_artifacts(s3, "bucket", CLAVES, cache)
+
+    assert errores == {}
+    assert _gets(s3) == [CLAVES[0]]
+    assert not segunda[CLAVES[0]]["desde_cache"] and segunda[CLAVES[1]]["desde_cache"]
+    assert segunda[CLAVES[0]]["etag"] != primera[CLAVES[0]]["etag"]
+    assert timed_load(segunda[CLAVES[0]], joblib.load) == {"artefacto": "nuevo"}
+
+
+def test_missing_optional_key_is_reported_not_raised(bucket):
+    s3, cache = bucket
+    opcional = "models/forecast_table.npz"
+    descargas, errores = fetch_artifacts(s3, "bucket", [*CLAVES, opcional], cache)
+
+    assert set(descargas) == set(CLAVES)
+    assert set(errores) == {opcional}
+    assert "NoSuchKey" in errores[opcional]
+    # Sin get_object ni ficheros a medias en la caché para la clave que no existe
+    assert opcional not in _gets(s3)
+    assert not any(nombre.startswith("forecast_table") for nombre in os.listdir(os.path.join(cache, "models")))
@@ -0,0 +1,174 @@
+import json
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+import xgboost as xgb
+from sklearn.preprocessing import StandardScaler
+from xgboost import XGBRegressor
+
+import train_incremental
+from feature_builder import build_serving_features
+from hist_aggregation import aggregate_hist_tables
+from hist_sketches import sketch_key_columns
+from quantile_cube import build_quantile_cube
+from serving_metadata import SERVING_METADATA_FILENAME, build_serving_metadata
+
+COLUMNAS = [
+    "hora", "mes", "dia_semana_num", "es_fin_de_semana", "temperatura", "hora_sin", "hora_cos",
+    "mean_hora", "p75_hora_dia", "atraccion_enc", "zona_enc",
+]
+ATRACCIONES = {"Batman": ("DC", 25.0), "Superman": ("DC", 15.0), "Coyote": ("Cartoon", 8.0), "Tazmania": ("Cartoon", 5.0)}
+CORTE = pd.Timestamp("2025-10-21", tz="UTC")
+
+
+def _snapshots(inicio, dias, rng):
+    """Filas como las de tiempos_final.csv: una por atracción cada 15 minutos de 11:00 a 20:45"""
+    filas = []
+    for dia in pd.date_range(inicio, periods=dias, freq="D"):
+        for minuto in range(11 * 60, 21 * 60, 15):
+            momento = dia + pd.Timedelta(minutes=minuto)
+            temperatura = 15 + 5 * rng.random()
+            for atraccion, (zona, base) in ATRACCIONES.items():
+                hora = minuto / 60
+                espera = base * (1 + 0.6 * np.exp(-((hora - 15) ** 2) / 6)) * (1.3 if dia.dayofweek >= 5 else 1.0)
+                filas.append({
+                    "zona": zona,
+                    "atraccion": atraccion,
+                    "tiempo_espera": float(max(0, round(espera + rng.normal(0, 2)))),
+                    "ultima_actualizacion": momento.tz_localize("UTC").isoformat(),
+                    "fecha": momento.strftime("%Y-%m-%d"),
+                    "hora": momento.strftime("%H:%M:%S"),
+                    "temperatura": temperatura,
+                    "humedad": 60.0,
+                    "sensacion_termica": temperatura,
+                    "codigo_clima": 1.0,
+                })
+    return pd.DataFrame(filas)
+
+
+def _training_frame(filas):
+    """Columnas de df_processed que usan las tablas hist_*, el cubo y los metadatos de serving"""
+    df = sketch_key_columns(filas)
+    df["zona"] = filas["zona"].to_numpy()
+    df["hora"] = df["hora_int"]
+    df["temperatura"] = filas["temperatura"].to_numpy()
+    df["humedad"] = filas["humedad"].to_numpy()
+    return df
+
+
+@pytest.fixture
+def models_dir(tmp_path):
+    """models/ y tiempos_final.csv sintéticos: modelo entrenado hasta CORTE, diez días más sin ver"""
+    rng = np.random.default_rng(0)
+    filas = pd.concat([_snapshots("2025-10-01", 20, rng), _snapshots("2025-10-21", 10, rng)], ignore_index=True)
+    ruta = tmp_path / "tiempos_final.csv"
+    filas.to_csv(ruta, index=False)
+
+    antiguas = filas[pd.to_datetime(filas["ultima_actualizacion"], utc=True) < CORTE]
+    df = _training_frame(antiguas)
+    y = df["tiempo_espera"].to_numpy()
+    artifacts = {
+        "encoding_maps": {col: df.groupby(col)["tiempo_espera"].mean().to_dict() for col in ["zona", "atraccion"]},
+        "serving_metadata": build_serving_metadata(df),
+        "columnas_entrenamiento": COLUMNAS,
+        **aggregate_hist_tables(df),
+    }
+    campos = ["zona", "atraccion", "fecha", "hora", "temperatura", "humedad", "sensacion_termica", "codigo_clima"]
+    columnas, _ = build_serving_features(antiguas[campos].to_dict("records"), artifacts)
+    X_raw = pd.DataFrame({c: columnas[c] for c in COLUMNAS})
+
+    scaler = StandardScaler().fit(X_raw)
+    X = scaler.transform(X_raw)
+    holdout = rng.random(len(y)) < 0.2
+    # Modelo corto a propósito: con más datos debe poder mejorar
+    model = XGBRegressor(n_estimators=40, learning_rate=0.1, max_depth=4, tree_method="hist", random_state=0)
+    model.fit(X[~holdout], y[~holdout])
+
+    directorio = tmp_path / "models"
+    directorio.mkdir()
+    artefactos = {
+        "xgb_model_professional": model,
+        "xgb_scaler_professional": scaler,
+        "xgb_encoding_professional": artifacts["encoding_maps"],
+        "xgb_columns_professional": COLUMNAS,
+        "quantile_cube": build_quantile_cube(df),
+        SERVING_METADATA_FILENAME[:-len(".pkl")]: artifacts["serving_metadata"],
+        **{nombre: artifacts[nombre] for nombre in train_incremental.HIST_TABLAS},
+    }
+    for nombre, valor in artefactos.items():
+        joblib.dump(valor, directorio / f"{nombre}.pkl")
+    rmse = float(np.sqrt(np.mean((model.predict(X[holdout]) - y[holdout]) ** 2)))
+    watermark = pd.to_datetime(antiguas["ultima_actualizacion"], utc=True).max()
+    train_incremental.save_training_state(str(directorio), watermark, 0, 1000, X[holdout], y[holdout], rmse)
+    return str(directorio), str(ruta)
+
+
+@pytest.fixture
+def sin_reentrenamiento(monkeypatch):
+    def full_retrain(motivo):
+        raise AssertionError(f"Reentrenamiento completo inesperado: {motivo}")
+    monkeypatch.setattr(train_incremental, "full_retrain", full_retrain)
+
+
+def test_update_on_unseen_rows_is_accepted(models_dir, sin_reentrenamiento):
+    directorio, ruta = models_dir
+    anterior = joblib.load(os.path.join(directorio, "xgb_model_professional.pkl"))
+
+    assert train_incremental.run_incremental(ruta, directorio) == "incremental"
+
+    model = joblib.load(os.path.join(directorio, "xgb_model_professional.pkl"))
+    with open(os.path.join(directorio, train_incremental.TRAINING_STATE_FILENAME), encoding="utf-8") as f:
+        estado = json.load(f)
+    actualizacion = estado["actualizaciones"][-1]
+    assert actualizacion["rondas"] > 0
+    assert model.get_booster().num_boosted_rounds() == 40 + actualizacion["rondas"]
+    assert actualizacion["filas"] == len(ATRACCIONES) * 10 * 40
+    assert pd.Timestamp(estado["watermark"]) == pd.Timestamp("2025-10-30 20:45", tz="UTC")
+
+    # Los árboles existentes no cambian: el modelo nuevo parte de las predicciones del anterior
+    X = joblib.load(os.path.join(directorio, train_incremental.HOLDOUT_FILENAME))["X"]
+    np.testing.assert_array_equal(model.predict(X, iteration_range=(0, 40)), anterior.predict(X))
+    # El ensemble de serving se reexporta con el scaler plegado (recibe features sin escalar)
+    assert joblib.load(os.path.join(directorio, "xgb_tree_ensemble.pkl"))["escalado_plegado"]
+    # Sin filas nuevas no se vuelve a actualizar
+    assert train_incremental.run_incremental(ruta, directorio) == "sin_datos"
+
+
+def test_continued_boosting_starts_from_current_margins():
+    rng = np.random.default_rng(1)
+    X = rng.normal(size=(3000, 5))
+    y = 3 * X[:, 0] + np.sin(3 * X[:, 1]) + rng.normal(0, 0.1, len(X))
+    model = XGBRegressor(n_estimators=50, learning_rate=0.1, max_depth=4, tree_method="hist", random_state=0)
+    model.fit(X[:1000], y[:1000])
+
+    # Filas nuevas en un rango más estrecho: sus bins no coinciden con los del entrenamiento
+    X_nuevas, y_nuevas = X[1000:] * 0.5, y[1000:]
+    candidato, rondas = train_incremental.fit_update(model, X_nuevas, y_nuevas, rondas=10, modo="continuar")
+
+    # Referencia: los 10 árboles nuevos ajustados sobre las predicciones exactas del modelo actual
+    margen = model.predict(X_nuevas, output_margin=True)
+    params = train_incremental._booster_params(model)
+    nuevos = xgb.train(params, xgb.DMatrix(X_nuevas, label=y_nuevas, base_margin=margen), num_boost_round=10)
+    esperado = nuevos.predict(xgb.DMatrix(X_nuevas, base_margin=margen), output_margin=True)
+    assert rondas == 10
+    np.testing.assert_array_equal(candidato.predict(X_nuevas), esperado)
+    np.testing.assert_array_equal(candidato.predict(X_nuevas, iteration_range=(0, 50)), model.predict(X_nuevas))
+
+
+def test_early_stopping_keeps_model_when_no_round_helps():
+    rng = np.random.default_rng(2)
+    X = rng.normal(size=(2000, 3))
+    y = X[:, 0] + rng.normal(0, 0.05, len(X))
+    model = XGBRegressor(n_estimators=200, learning_rate=0.3, max_depth=3, tree_method="hist", random_state=0)
+    model.fit(X, y)
+
+    # Ruido puro: ningún árbol añadido mejora la validación
+    ruido = rng.normal(0, 1, len(X))
+    candidato, rondas = train_incremental.fit_update(
+        model, X[:1500], y[:1500] + ruido[:1500], X[1500:], y[1500:], modo="continuar"
+    )
+    assert rondas == 0
+    assert candidato is model
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+from sklearn.preprocessing import StandardScaler
+from xgboost import XGBRegressor
+
+from tree_ensemble import export_serving_ensemble, export_tree_ensemble, predict_model, predict_tree_ensemble
+
+
+@pytest.fixture(scope="module")
+def modelo():
+    """XGBRegressor pequeño sobre features escaladas, con NaN y escalas muy distintas"""
+    rng = np.random.default_rng(0)
+    n = 3000
+    X_raw = np.column_stack([
+        rng.integers(0, 24, n).astype(np.float64),      # hora: representable en float32
+        rng.normal(20, 7, n),                           # temperatura: decimales arbitrarios
+        rng.gamma(2.0, 300.0, n),                       # conteos grandes
+        rng.random(n) < 0.3,                            # flag
+        rng.normal(0, 1e-3, n),                         # escala muy pequeña
+    ])
+    y = 10 + 2 * X_raw[:, 0] + np.sin(X_raw[:, 1]) * 5 + X_raw[:, 2] / 100 + 8 * X_raw[:, 3] + rng.normal(0, 1, n)
+    X_raw[rng.random(X_raw.shape) < 0.1] = np.nan
+
+    scaler = StandardScaler().fit(X_raw)
+    model = XGBRegressor(n_estimators=60, max_depth=5, learning_rate=0.2, tree_method="hist", random_state=0)
+    model.fit(scaler.transform(X_raw), y)
+    return model, scaler, X_raw
+
+
+def _filas_en_umbrales(ensemble, scaler, X_raw):
+    """Filas con cada feature justo en el umbral de un split y en el float64 anterior (espacio original)"""
+    internos = ensemble["left"] != np.arange(len(ensemble["left"]))
+    features = ensemble["feature"][internos]
+    umbrales = ensemble["threshold"][internos].astype(np.float64)
+    if not ensemble["escalado_plegado"]:
+        umbrales = umbrales * scaler.scale_[features] + scaler.mean_[features]
+    filas = np.repeat(X_raw[:1], 2 * len(umbrales), axis=0)
+    filas[np.arange(len(umbrales)), features] = umbrales
+    filas[len(umbrales) + np.arange(len(umbrales)), features] = np.nextafter(umbrales, -np.inf)
+    return filas
+
+
+def test_unfolded_ensemble_matches_xgboost(modelo):
+    model, scaler, X_raw = modelo
+    X = scaler.transform(X_raw)
+    ensemble = export_tree_ensemble(model)
+
+    assert not ensemble["escalado_plegado"]
+    np.testing.assert_array_equal(predict_tree_ensemble(ensemble, X), model.predict(X))
+    # Una sola fila (el camino de la Lambda) y una fila toda NaN (default_left en cada nodo)
+    np.testing.assert_array_equal(predict_tree_ensemble(ensemble, X[0]), model.predict(X[:1]))
+    vacia = np.full((1, X.shape[1]), np.nan)
+    np.testing.assert_array_equal(predict_tree_ensemble(ensemble, vacia), model.predict(vacia))
+
+
+def test_folded_ensemble_matches_xgboost_on_unscaled_features(modelo):
+    model, scaler, X_raw = modelo
+    plegado = export_tree_ensemble(model, scaler)
+
+    assert plegado["escalado_plegado"]
+    assert plegado["threshold"].dtype == np.float64
+    X = np.vstack([X_raw, _filas_en_umbrales(plegado, scaler, X_raw)])
+    np.testing.assert_array_equal(predict_tree_ensemble(plegado, X), model.predict(scaler.transform(X)))
+
+
+def test_serving_ensemble_is_folded_and_used_by_predict_model(modelo):
+    model, scaler, X_raw = modelo
+    X = scaler.transform(X_raw)
+    ensemble, distintas, max_diff = export_serving_ensemble(model, scaler, X, X_raw)
+
+    assert ensemble["escalado_plegado"]
+    assert (distintas, max_diff) == (0, 0.0)
+    # Con el ensemble cargado predict_model no usa el modelo XGBoost
+    artifacts = {"model": None, "tree_ensemble": ensemble}
+    np.testing.assert_array_equal(predict_model(artifacts, X_raw), model.predict(X))
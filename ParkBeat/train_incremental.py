@@ -0,0 +1,281 @@
+# ====================================================
+# REENTRENAMIENTO INCREMENTAL - Continuar el modelo con los datos nuevos
+# ====================================================
+# La ingesta añade filas cada 15 minutos y train_model.py lo recalcula todo
+# (features, encoding, escalado y 1000 rondas) sobre tiempos_final.csv. Este
+# script parte del modelo guardado y usa solo las filas con
+# ultima_actualizacion posterior a la marca de agua de models/training_state.json
+# (la escribe train_model.py y se avanza en cada actualización aceptada):
+#   - features de las filas nuevas con el mismo código que el serving
+#     (feature_builder.py) y el scaler, encoding e históricos congelados,
+#   - INCREMENTAL_MODE=continuar: hasta INCREMENTAL_ROUNDS árboles más sobre
+#     el booster actual, con early stopping,
+#     INCREMENTAL_MODE=refrescar: mismos árboles, hojas recalculadas con los
+#     datos nuevos (updater "refresh"),
+#   - guardarraíl: el candidato se entrena sin el último
+#     INCREMENTAL_VALIDATION_FRACTION de las filas nuevas (las más recientes)
+#     y se acepta solo si en ellas no empeora al modelo actual y si en el
+#     holdout de referencia de train_model.py no supera su RMSE original en
+#     más de INCREMENTAL_MAX_DEGRADATION. Si no, se lanza train_model.py
+#     completo (INCREMENTAL_FALLBACK=0 solo lo avisa).
+# Aceptado, se reentrena con todas las filas nuevas y las rondas elegidas y se
+# reescriben el modelo, el ensemble NumPy (con el scaler plegado si la paridad
+# es exacta) y el bundle de serving. Los históricos y df_processed no se tocan.
+#
+# Uso (desde ParkBeat/, como train_model.py): python train_incremental.py
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.metrics import mean_squared_error
+
+from feature_builder import build_serving_features
+from feature_layout import fill_feature_matrix, get_feature_layout, scale_features
+from serving_bundle import BUNDLE_FILENAME, save_serving_bundle
+from serving_metadata import SERVING_METADATA_FILENAME
+from tree_ensemble import export_serving_ensemble
+from training_watermark import load_new_rows
+
+INCREMENTAL_DATA_PATH = os.getenv("INCREMENTAL_DATA_PATH", "../data/clean/tiempos_final.csv")
+INCREMENTAL_MODELS_DIR = os.getenv("INCREMENTAL_MODELS_DIR", "models")
+INCREMENTAL_MODE = os.getenv("INCREMENTAL_MODE", "continuar")
+INCREMENTAL_ROUNDS = int(os.getenv("INCREMENTAL_ROUNDS", "200"))
+INCREMENTAL_EARLY_STOPPING = int(os.getenv("INCREMENTAL_EARLY_STOPPING", "20"))
+INCREMENTAL_MIN_ROWS = int(os.getenv("INCREMENTAL_MIN_ROWS", "50"))
+INCREMENTAL_VALIDATION_FRACTION = float(os.getenv("INCREMENTAL_VALIDATION_FRACTION", "0.2"))
+INCREMENTAL_MAX_DEGRADATION = float(os.getenv("INCREMENTAL_MAX_DEGRADATION", "0.05"))
+INCREMENTAL_FALLBACK = os.getenv("INCREMENTAL_FALLBACK", "1") == "1"
+
+TRAINING_STATE_FILENAME = "training_state.json"
+HOLDOUT_FILENAME = "holdout_reference.pkl"
+HIST_TABLAS = ["hist_mes", "hist_hora", "hist_dia_semana", "hist_mes_dia", "hist_hora_dia", "hist_mes_hora"]
+
+
+def save_training_state(directorio, watermark, q_low, q_high, X_holdout, y_holdout, rmse_holdout):
+    """Estado del entrenamiento completo: marca de agua, filtro de outliers y holdout de referencia"""
+    joblib.dump({"X": np.asarray(X_holdout, dtype=np.float64), "y": np.asarray(y_holdout, dtype=np.float64)},
+                os.path.join(directorio, HOLDOUT_FILENAME))
+    estado = {
+        "watermark": watermark.isoformat(),
+        "q_low": float(q_low),
+        "q_high": float(q_high),
+        "rmse_holdout": float(rmse_holdout),
+        "entrenamiento": "completo",
+        "fecha_entrenamiento": pd.Timestamp.now(tz="UTC").isoformat(),
+        "actualizaciones": [],
+    }
+    _write_state(directorio, estado)
+    return estado
+
+
+def load_training_state(directorio=INCREMENTAL_MODELS_DIR):
+    """Estado de training_state.json (None si no hay entrenamiento completo previo)"""
+    ruta = os.path.join(directorio, TRAINING_STATE_FILENAME)
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_state(directorio, estado):
+    # Escritura atómica: un fallo a mitad no deja una marca de agua corrupta
+    ruta = os.path.join(directorio, TRAINING_STATE_FILENAME)
+    with open(ruta + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(estado, f, indent=4, ensure_ascii=False)
+    os.replace(ruta + ".tmp", ruta)
+
+
+def load_training_artifacts(directorio=INCREMENTAL_MODELS_DIR):
+    """Modelo y artefactos de features del último entrenamiento (los pickles, no el bundle)"""
+    artifacts = {
+        "model": joblib.load(os.path.join(directorio, "xgb_model_professional.pkl")),
+        "scaler": joblib.load(os.path.join(directorio, "xgb_scaler_professional.pkl")),
+        "encoding_maps": joblib.load(os.path.join(directorio, "xgb_encoding_professional.pkl")),
+        "columnas_entrenamiento": joblib.load(os.path.join(directorio, "xgb_columns_professional.pkl")),
+        "serving_metadata": joblib.load(os.path.join(directorio, SERVING_METADATA_FILENAME)),
+    }
+    for nombre in HIST_TABLAS:
+        artifacts[nombre] = joblib.load(os.path.join(directorio, f"{nombre}.pkl"))
+    ruta_cubo = os.path.join(directorio, "quantile_cube.pkl")
+    artifacts["quantile_cube"] = joblib.load(ruta_cubo) if os.path.exists(ruta_cubo) else None
+    return artifacts
+
+
+def build_training_matrix(filas, artifacts):
+    """Features sin escalar de las filas (mismo código que predict_wait_time_batch)"""
+    campos = ["zona", "atraccion", "fecha", "hora", "temperatura", "humedad", "sensacion_termica", "codigo_clima"]
+    registros = filas[[c for c in campos if c in filas.columns]].to_dict("records")
+    # Los nulos se omiten para que se apliquen los mismos defaults que en el serving
+    inputs = [{k: v for k, v in r.items() if not pd.isna(v)} for r in registros]
+    columnas, _ = build_serving_features(inputs, artifacts)
+    return fill_feature_matrix(get_feature_layout(artifacts), columnas, len(inputs))
+
+
+def _rmse(y, pred):
+    return float(np.sqrt(mean_squared_error(y, pred)))
+
+
+def _booster_params(model):
+    """Parámetros del XGBRegressor con los nombres de xgb.train"""
+    nombres = {"random_state": "seed", "n_jobs": "nthread"}
+    return {nombres.get(k, k): v for k, v in model.get_xgb_params().items() if v is not None}
+
+
+def _as_model(model, booster):
+    """XGBRegressor con los parámetros de model y los árboles de booster"""
+    candidato = model.__class__(**model.get_params())
+    candidato.load_model(bytearray(booster.save_raw()))
+    return candidato
+
+
+def fit_update(model, X, y, X_val=None, y_val=None, rondas=None, modo=INCREMENTAL_MODE):
+    """
+    Copia de model actualizada con X, y; devuelve (modelo, rondas añadidas).
+    En modo continuar añade árboles: con X_val, las rondas que minimizan su
+    RMSE (0 si ninguna mejora al modelo actual); si no, exactamente rondas.
+    En modo refrescar recalcula las hojas de los árboles existentes.
+
+    Siempre con xgb.train sobre un DMatrix: el wrapper de sklearn usa con
+    tree_method="hist" un QuantileDMatrix cuyos bins salen solo de las filas
+    nuevas, y los árboles existentes se evaluarían sobre features rediscretizadas.
+    """
+    booster = model.get_booster()
+    base = booster.num_boosted_rounds()
+    dtrain = xgb.DMatrix(X, label=y)
+    if modo == "refrescar":
+        params = {**_booster_params(model), "process_type": "update", "updater": "refresh", "refresh_leaf": True}
+        refrescado = xgb.train(params, dtrain, num_boost_round=base, xgb_model=booster)
+        # De vuelta a process_type normal para que el modelo guardado se pueda seguir entrenando
+        refrescado.set_param({"process_type": "default"})
+        return _as_model(model, refrescado), 0
+    if modo != "continuar":
+        raise ValueError(f"INCREMENTAL_MODE desconocido: {modo}")
+
+    if X_val is not None:
+        dval = xgb.DMatrix(X_val, label=y_val)
+        continuado = xgb.train(
+            _booster_params(model), dtrain, num_boost_round=INCREMENTAL_ROUNDS, xgb_model=booster,
+            evals=[(dval, "val")], early_stopping_rounds=INCREMENTAL_EARLY_STOPPING, verbose_eval=False,
+        )
+        rondas = continuado.best_iteration + 1 - base
+        # El early stopping solo compara rondas nuevas: el modelo actual es la referencia
+        rmse_base = _rmse(y_val, booster.predict(dval))
+        rmse_continuado = _rmse(y_val, continuado.predict(dval, iteration_range=(0, base + rondas)))
+        if rondas <= 0 or rmse_continuado >= rmse_base:
+            return model, 0
+        continuado = continuado[:base + rondas]
+    else:
+        if rondas <= 0:
+            return model, 0
+        continuado = xgb.train(_booster_params(model), dtrain, num_boost_round=rondas, xgb_model=booster)
+    return _as_model(model, continuado), rondas
+
+
+def _remove(ruta):
+    if os.path.exists(ruta):
+        os.remove(ruta)
+
+
+def export_model(model, artifacts, X_raw, X_check, directorio=INCREMENTAL_MODELS_DIR):
+    """
+    Guarda el modelo y reexporta lo que depende de él (ensemble y bundle).
+    X_check son las features escaladas y X_raw las mismas sin escalar para la
+    verificación; si no la pasa, ensemble y bundle se borran en lugar de dejar
+    la versión del modelo anterior.
+    """
+    joblib.dump(model, os.path.join(directorio, "xgb_model_professional.pkl"))
+
+    tree_ensemble, distintas, max_diff = export_serving_ensemble(model, artifacts["scaler"], X_check, X_raw)
+    if distintas != 0:
+        print(f"   ⚠️  Ensemble: {distintas} predicciones distintas (máx. {max_diff:.6f}), no se exporta ni el bundle")
+        _remove(os.path.join(directorio, "xgb_tree_ensemble.pkl"))
+        _remove(os.path.join(directorio, BUNDLE_FILENAME))
+        return False
+    joblib.dump(tree_ensemble, os.path.join(directorio, "xgb_tree_ensemble.pkl"))
+    bundle = {k: v for k, v in artifacts.items() if k in HIST_TABLAS or k in (
+        "scaler", "encoding_maps", "columnas_entrenamiento", "serving_metadata", "quantile_cube")}
+    save_serving_bundle({**bundle, "tree_ensemble": tree_ensemble}, os.path.join(directorio, BUNDLE_FILENAME))
+    return True
+
+
+def full_retrain(motivo):
+    """Reentrenamiento completo con train_model.py (o solo el aviso si INCREMENTAL_FALLBACK=0)"""
+    print(f"↩️  {motivo}")
+    if not INCREMENTAL_FALLBACK:
+        print("   INCREMENTAL_FALLBACK=0: no se reentrena")
+        return "rechazado"
+    print("   Reentrenamiento completo con train_model.py...")
+    subprocess.run([sys.executable, "train_model.py"], check=True)
+    return "completo"
+
+
+def run_incremental(ruta=INCREMENTAL_DATA_PATH, directorio=INCREMENTAL_MODELS_DIR):
+    """Una actualización incremental; devuelve "sin_datos", "incremental", "completo" o "rechazado" """
+    estado = load_training_state(directorio)
+    if estado is None:
+        return full_retrain(f"No existe {TRAINING_STATE_FILENAME}: no hay marca de agua")
+
+    inicio = time.perf_counter()
+    nuevas = load_new_rows(ruta, estado)
+    print(f"Marca de agua: {estado['watermark']} → {len(nuevas)} filas nuevas")
+    if len(nuevas) < INCREMENTAL_MIN_ROWS:
+        print(f"   Menos de {INCREMENTAL_MIN_ROWS} filas nuevas, no se actualiza")
+        return "sin_datos"
+
+    artifacts = load_training_artifacts(directorio)
+    model = artifacts["model"]
+    X_raw = build_training_matrix(nuevas, artifacts)
+    X = scale_features(get_feature_layout(artifacts), X_raw)
+    y = nuevas["tiempo_espera"].to_numpy(dtype=np.float64)
+    holdout = joblib.load(os.path.join(directorio, HOLDOUT_FILENAME))
+
+    # Guardarraíl: candidato entrenado sin las filas más recientes y validado en ellas
+    corte = int(len(y) * (1 - INCREMENTAL_VALIDATION_FRACTION))
+    candidato, rondas = fit_update(model, X[:corte], y[:corte], X[corte:], y[corte:])
+
+    rmse_nuevas_actual = _rmse(y[corte:], model.predict(X[corte:]))
+    rmse_nuevas = _rmse(y[corte:], candidato.predict(X[corte:]))
+    rmse_holdout = _rmse(holdout["y"], candidato.predict(holdout["X"]))
+    limite_holdout = estado["rmse_holdout"] * (1 + INCREMENTAL_MAX_DEGRADATION)
+    print(f"   Filas recientes ({len(y) - corte}): RMSE actual {rmse_nuevas_actual:.3f}, candidato {rmse_nuevas:.3f}")
+    print(f"   Holdout de referencia: RMSE {rmse_holdout:.3f} (límite {limite_holdout:.3f})")
+
+    if rmse_nuevas > rmse_nuevas_actual:
+        return full_retrain("El candidato empeora en las filas más recientes")
+    if rmse_holdout > limite_holdout:
+        return full_retrain("El candidato degrada el holdout de referencia")
+    if INCREMENTAL_MODE == "continuar" and rondas == 0:
+        print("   El early stopping no añade árboles: el modelo actual se mantiene")
+    else:
+        # Aceptado: mismas rondas con todas las filas nuevas
+        model, _ = fit_update(model, X, y, rondas=rondas)
+        # Sin ensemble ni bundle la Lambda y predict.py usan los pickles del modelo nuevo
+        export_model(model, artifacts, X_raw, X, directorio)
+
+    estado["watermark"] = nuevas["_momento"].max().isoformat()
+    estado["actualizaciones"].append({
+        "fecha": pd.Timestamp.now(tz="UTC").isoformat(),
+        "modo": INCREMENTAL_MODE,
+        "filas": int(len(y)),
+        "rondas": int(rondas),
+        "rmse_recientes": rmse_nuevas,
+        "rmse_holdout": rmse_holdout,
+    })
+    _write_state(directorio, estado)
+    print(f"✅ Actualización incremental ({INCREMENTAL_MODE}, +{rondas} rondas) en "
+          f"{time.perf_counter() - inicio:.1f} s; nueva marca de agua {estado['watermark']}")
+    return "incremental"
+
+
+if __name__ == "__main__":
+    print("=" * 70)
+    print("🔁 REENTRENAMIENTO INCREMENTAL")
+    print("=" * 70)
+    run_incremental()
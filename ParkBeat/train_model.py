@@ -7,7 +7,7 @@
 import os
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split, TimeSeriesSplit
+from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
 from xgboost import XGBRegressor
@@ -15,8 +15,26 @@ import matplotlib.pyplot as plt
 import joblib
 import warnings
 from datetime import datetime, timedelta
+from quantile_cube import build_quantile_cube
+from tree_ensemble import export_serving_ensemble
+from serving_metadata import SERVING_METADATA_FILENAME, build_serving_metadata
+from serving_bundle import BUNDLE_FILENAME, BUNDLE_VERSION, save_serving_bundle
+from calendar_table import calendar_row
+from hist_aggregation import aggregate_hist_tables, attach_hist_features
+from feature_layout import fill_feature_row, get_feature_layout, scale_features
+from feature_builder import FLAGS_ESPECIALES, build_base_features, build_serving_row, parse_hora, parse_horas
+from hyperparam_search import PARAMS_BASE, run_search
+from train_incremental import save_training_state
+from training_watermark import parse_watermark
+from hist_sketches import SKETCHES_FILENAME, build_hist_sketches, save_hist_sketches
 warnings.filterwarnings('ignore')
 
+# TUNE_HYPERPARAMS=1: buscar hiperparámetros antes del entrenamiento final
+TUNE_HYPERPARAMS = os.getenv("TUNE_HYPERPARAMS", "0") == "1"
+# SAVE_DF_PROCESSED=1: guardar también el DataFrame completo (models/df_processed.pkl).
+# Serving solo usa serving_metadata.pkl; df_processed sirve para la paridad de tree_ensemble.py
+SAVE_DF_PROCESSED = os.getenv("SAVE_DF_PROCESSED", "0") == "1"
+
 os.makedirs("models", exist_ok=True)
 
 # -------------------------
@@ -50,83 +68,9 @@ print("=" * 70)
 
 df["fecha"] = pd.to_datetime(df["fecha"], errors="coerce")
 
-# Función mejorada para parsear hora
-def parse_hora(hora_str):
-    try:
-        if pd.isna(hora_str):
-            return np.nan
-        if isinstance(hora_str, (int, float)):
-            return int(hora_str)
-        s = str(hora_str).strip()
-        if ":" in s:
-            parts = s.split(":")
-            hora = int(float(parts[0]))
-            minuto = int(float(parts[1])) if len(parts) > 1 else 0
-            return hora + minuto / 60.0
-        return int(float(s))
-    except:
-        return np.nan
-
-df["hora"] = df["hora"].apply(parse_hora)
+df["hora"] = parse_horas(df["hora"].to_numpy(dtype=object))
 df["hora"] = df["hora"].fillna(df["hora"].median())
 
-# Features temporales COMPLETAS
-df["mes"] = df["fecha"].dt.month
-df["dia_mes"] = df["fecha"].dt.day
-df["dia_semana_num"] = df["fecha"].dt.weekday  # 0=Lunes, 6=Domingo
-df["semana_año"] = df["fecha"].dt.isocalendar().week
-df["trimestre"] = df["fecha"].dt.quarter
-df["año"] = df["fecha"].dt.year
-
-# DIFERENCIACIÓN COMPLETA DE DÍAS DE SEMANA
-df["es_lunes"] = (df["dia_semana_num"] == 0).astype(int)
-df["es_martes"] = (df["dia_semana_num"] == 1).astype(int)
-df["es_miercoles"] = (df["dia_semana_num"] == 2).astype(int)
-df["es_jueves"] = (df["dia_semana_num"] == 3).astype(int)
-df["es_viernes"] = (df["dia_semana_num"] == 4).astype(int)
-df["es_sabado"] = (df["dia_semana_num"] == 5).astype(int)
-df["es_domingo"] = (df["dia_semana_num"] == 6).astype(int)
-df["es_fin_de_semana"] = df["dia_semana_num"].isin([5, 6]).astype(int)
-df["es_dia_laborable"] = df["dia_semana_num"].isin([0, 1, 2, 3, 4]).astype(int)
-
-# DIFERENCIACIÓN COMPLETA DE MESES
-for mes_num in range(1, 13):
-    df[f"es_mes_{mes_num}"] = (df["mes"] == mes_num).astype(int)
-
-# Temporada mejorada
-def get_temporada(mes):
-    if mes in [7, 8]:  # Verano
-        return 3  # Muy Alta
-    elif mes in [10]:  # Halloween
-        return 3  # Muy Alta
-    elif mes in [4, 5, 6, 12]:  # Primavera, Navidad
-        return 2  # Alta
-    elif mes in [3, 9, 11]:  # Media
-        return 1  # Media
-    else:
-        return 0  # Baja
-
-df["temporada"] = df["mes"].apply(get_temporada)
-
-# Features cíclicas mejoradas (más granularidad)
-df["hora_sin"] = np.sin(2 * np.pi * df["hora"] / 24)
-df["hora_cos"] = np.cos(2 * np.pi * df["hora"] / 24)
-df["mes_sin"] = np.sin(2 * np.pi * df["mes"] / 12)
-df["mes_cos"] = np.cos(2 * np.pi * df["mes"] / 12)
-df["dia_semana_sin"] = np.sin(2 * np.pi * df["dia_semana_num"] / 7)
-df["dia_semana_cos"] = np.cos(2 * np.pi * df["dia_semana_num"] / 7)
-df["dia_mes_sin"] = np.sin(2 * np.pi * df["dia_mes"] / 31)
-df["dia_mes_cos"] = np.cos(2 * np.pi * df["dia_mes"] / 31)
-df["semana_año_sin"] = np.sin(2 * np.pi * df["semana_año"] / 52)
-df["semana_año_cos"] = np.cos(2 * np.pi * df["semana_año"] / 52)
-
-# Interacciones importantes
-df["hora_mes"] = df["hora"] * df["mes"]
-df["hora_dia_semana"] = df["hora"] * df["dia_semana_num"]
-df["mes_dia_semana"] = df["mes"] * df["dia_semana_num"]
-df["fin_semana_mes"] = df["es_fin_de_semana"] * df["mes"]
-df["temporada_dia_semana"] = df["temporada"] * df["dia_semana_num"]
-
 # Rellenar numéricos faltantes
 for col in ["temperatura", "humedad", "sensacion_termica", "codigo_clima"]:
     if col in df.columns:
@@ -134,70 +78,16 @@ for col in ["temperatura", "humedad", "sensacion_termica", "codigo_clima"]:
     else:
         df[col] = 0
 
-# Features de clima mejoradas
-if "codigo_clima" in df.columns:
-    df["es_buen_clima"] = (df["codigo_clima"].isin([1, 2, 3])).astype(int)
-    df["es_mal_clima"] = (df["codigo_clima"] > 3).astype(int)
-
-# Features de HORA DEL DÍA - CRÍTICO para diferenciar apertura vs pico vs valle
-df["hora_int"] = df["hora"].astype(int)
-df["es_hora_apertura"] = ((df["hora_int"] >= 12) & (df["hora_int"] < 13)).astype(int)  # 10:00-11:00
-df["es_hora_pico"] = ((df["hora_int"] >= 12) & (df["hora_int"] <= 16)).astype(int)  # 11:00-16:00
-df["es_hora_valle_manana"] = (df["hora_int"] < 14)& (df["hora_int"] < 15).astype(int)  # Antes de 10:00
-df["es_hora_valle_tarde"] = (df["hora_int"] > 18).astype(int)  # Después de 18:00
-df["es_hora_valle"] = (df["es_hora_valle_manana"] | df["es_hora_valle_tarde"]).astype(int)
-
-# Features de PUENTES/FESTIVOS (España)
-def es_festivo_espana(fecha):
-    """Detecta festivos en España"""
-    mes = fecha.month
-    dia = fecha.day
-    
-    # Festivos fijos
-    if mes == 1 and dia == 1:  # Año Nuevo
-        return 1
-    if mes == 1 and dia == 6:  # Reyes
-        return 1
-    if mes == 5 and dia == 1:  # Día del Trabajo
-        return 1
-    if mes == 10 and dia == 12:  # Día de la Hispanidad
-        return 1
-    if mes == 11 and dia == 1:  # Todos los Santos
-        return 1
-    if mes == 12 and dia == 6:  # Constitución
-        return 1
-    if mes == 12 and dia == 8:  # Inmaculada
-        return 1
-    if mes == 12 and dia == 25:  # Navidad
-        return 1
-    return 0
-
-def es_puente(fecha):
-    """Detecta si un día es parte de un puente (festivo + fin de semana cercano)"""
-    if es_festivo_espana(fecha):
-        return 1
-    
-    # Verificar si el día anterior o siguiente es festivo
-    dia_anterior = fecha - pd.Timedelta(days=1)
-    dia_siguiente = fecha + pd.Timedelta(days=1)
-    
-    # Si es viernes y el lunes siguiente es festivo, o si es lunes y el viernes anterior es festivo
-    if fecha.weekday() == 4 and es_festivo_espana(dia_siguiente):  # Viernes antes de festivo
-        return 1
-    if fecha.weekday() == 0 and es_festivo_espana(dia_anterior):  # Lunes después de festivo
-        return 1
-    if fecha.weekday() == 6 and es_festivo_espana(dia_anterior):  # Domingo después de festivo (sábado)
-        return 1
-    
-    return 0
-
-df["es_festivo"] = df["fecha"].apply(es_festivo_espana)
-df["es_puente"] = df["fecha"].apply(es_puente)
-
-# Interacciones con hora y puentes
-df["hora_apertura_fin_semana"] = df["es_hora_apertura"] * df["es_fin_de_semana"]
-df["hora_pico_puente"] = df["es_hora_pico"] * df["es_puente"]
-df["puente_fin_semana"] = df["es_puente"] * df["es_fin_de_semana"]
+# Features temporales, calendario (festivos, puentes, temporada), hora del día,
+# cíclicas, interacciones y clima: el mismo código columnar que usa el serving
+# (feature_builder.py). Los flags especiales se añaden tras los históricos.
+features_base = build_base_features(
+    df["fecha"].to_numpy(), df["hora"], df["temperatura"], df["humedad"],
+    df["sensacion_termica"], df["codigo_clima"], df["atraccion"].tolist()
+)
+for col, valores in features_base.items():
+    if col not in FLAGS_ESPECIALES:
+        df[col] = valores
 
 # -------------------------
 # 3) FEATURES HISTÓRICAS GRANULARES
@@ -206,73 +96,18 @@ print("\n" + "=" * 70)
 print("📊 CREANDO FEATURES HISTÓRICAS GRANULARES")
 print("=" * 70)
 
-# Histórico por mes
-hist_mes = df.groupby(["atraccion", "mes"])["tiempo_espera"].agg(
-    count_mes="count",
-    mean_mes="mean",
-    median_mes="median",
-    std_mes="std",
-    p75_mes=lambda x: np.percentile(x, 75),
-    p90_mes=lambda x: np.percentile(x, 90),
-    p95_mes=lambda x: np.percentile(x, 95)
-).reset_index()
-
-# Histórico por hora (usar hora_int para mejor agrupación)
-hist_hora = df.groupby(["atraccion", "hora_int"])["tiempo_espera"].agg(
-    count_hora="count",
-    mean_hora="mean",
-    median_hora="median",
-    std_hora="std",
-    p75_hora=lambda x: np.percentile(x, 75),
-    p90_hora=lambda x: np.percentile(x, 90)
-).reset_index()
-hist_hora = hist_hora.rename(columns={"hora_int": "hora"})  # Renombrar para compatibilidad
-
-# Histórico por día de semana (CRÍTICO para diferenciar sábado/domingo)
-hist_dia_semana = df.groupby(["atraccion", "dia_semana_num"])["tiempo_espera"].agg(
-    count_dia="count",
-    mean_dia="mean",
-    median_dia="median",
-    std_dia="std",
-    p75_dia=lambda x: np.percentile(x, 75),
-    p90_dia=lambda x: np.percentile(x, 90)
-).reset_index()
-
-# Histórico por mes Y día de semana (MUY IMPORTANTE)
-hist_mes_dia = df.groupby(["atraccion", "mes", "dia_semana_num"])["tiempo_espera"].agg(
-    count_mes_dia="count",
-    mean_mes_dia="mean",
-    median_mes_dia="median",
-    p75_mes_dia=lambda x: np.percentile(x, 75),
-    p90_mes_dia=lambda x: np.percentile(x, 90)
-).reset_index()
-
-# Histórico por hora Y día de semana
-hist_hora_dia = df.groupby(["atraccion", "hora_int", "dia_semana_num"])["tiempo_espera"].agg(
-    count_hora_dia="count",
-    mean_hora_dia="mean",
-    median_hora_dia="median",
-    p75_hora_dia=lambda x: np.percentile(x, 75)
-).reset_index()
-hist_hora_dia = hist_hora_dia.rename(columns={"hora_int": "hora"})  # Renombrar para compatibilidad
-
-# Histórico por mes Y hora
-hist_mes_hora = df.groupby(["atraccion", "mes", "hora_int"])["tiempo_espera"].agg(
-    count_mes_hora="count",
-    mean_mes_hora="mean",
-    median_mes_hora="median",
-    p75_mes_hora=lambda x: np.percentile(x, 75)
-).reset_index()
-hist_mes_hora = hist_mes_hora.rename(columns={"hora_int": "hora"})  # Renombrar para compatibilidad
-
-# Merge con df principal
-print("Haciendo merge de features históricas...")
-df = df.merge(hist_mes, on=["atraccion", "mes"], how="left")
-df = df.merge(hist_hora, left_on=["atraccion", "hora_int"], right_on=["atraccion", "hora"], how="left", suffixes=("", "_hist"))
-df = df.merge(hist_dia_semana, on=["atraccion", "dia_semana_num"], how="left")
-df = df.merge(hist_mes_dia, on=["atraccion", "mes", "dia_semana_num"], how="left")
-df = df.merge(hist_hora_dia, left_on=["atraccion", "hora_int", "dia_semana_num"], right_on=["atraccion", "hora", "dia_semana_num"], how="left", suffixes=("", "_hist_hd"))
-df = df.merge(hist_mes_hora, left_on=["atraccion", "mes", "hora_int"], right_on=["atraccion", "mes", "hora"], how="left", suffixes=("", "_hist_mh"))
+# Las seis tablas en una pasada: una sola ordenación por tiempo_espera y
+# estadísticos por segmentos NumPy (ver hist_aggregation.py). Claves:
+#   hist_mes (mes), hist_hora (hora_int -> hora), hist_dia_semana (día de semana,
+#   CRÍTICO para diferenciar sábado/domingo), hist_mes_dia (mes y día de semana,
+#   MUY IMPORTANTE), hist_hora_dia (hora y día), hist_mes_hora (mes y hora)
+hist_tablas, hist_grupos = aggregate_hist_tables(df, devolver_grupos=True)
+hist_mes = hist_tablas["hist_mes"]
+hist_hora = hist_tablas["hist_hora"]
+hist_dia_semana = hist_tablas["hist_dia_semana"]
+hist_mes_dia = hist_tablas["hist_mes_dia"]
+hist_hora_dia = hist_tablas["hist_hora_dia"]
+hist_mes_hora = hist_tablas["hist_mes_hora"]
 
 # Rellenar valores faltantes con fallbacks inteligentes
 global_median = df["tiempo_espera"].median()
@@ -288,28 +123,16 @@ fill_rules = {
     "count": 0
 }
 
-for col in df.columns:
-    if col.startswith("count_"):
-        df[col] = df[col].fillna(0)
-    elif "mean" in col:
-        df[col] = df[col].fillna(fill_rules["mean"])
-    elif "median" in col:
-        df[col] = df[col].fillna(fill_rules["median"])
-    elif "std" in col:
-        df[col] = df[col].fillna(fill_rules["std"])
-    elif "p75" in col:
-        df[col] = df[col].fillna(fill_rules["p75"])
-    elif "p90" in col:
-        df[col] = df[col].fillna(fill_rules["p90"])
-    elif "p95" in col:
-        df[col] = df[col].fillna(fill_rules["p95"])
+# Añadir los históricos a cada fila: el grupo de cada fila (de la misma pasada
+# que las tablas) indexa las columnas de la tabla, con los huecos ya rellenos.
+# Se escriben en df sin copiarlo (reset_index no copia los datos)
+print("Añadiendo features históricas...")
+df = df.reset_index(drop=True)
+attach_hist_features(df, hist_tablas, hist_grupos, fill_rules)
 
-# Flags especiales
-df["is_batman_octubre"] = ((df["atraccion"].str.contains("Batman", na=False)) & (df["mes"] == 10)).astype(int)
-df["is_octubre"] = (df["mes"] == 10).astype(int)
-df["is_noviembre"] = (df["mes"] == 11).astype(int)
-df["is_octubre_fin_semana"] = ((df["mes"] == 10) & (df["es_fin_de_semana"] == 1)).astype(int)
-df["is_noviembre_fin_semana"] = ((df["mes"] == 11) & (df["es_fin_de_semana"] == 1)).astype(int)
+# Flags especiales (mismo orden de filas que features_base)
+for col in FLAGS_ESPECIALES:
+    df[col] = features_base[col]
 
 print(f"Features creadas: {len(df.columns)} columnas")
 
@@ -415,18 +238,34 @@ X_tr, X_val, y_tr, y_val = train_test_split(
     X_train_scaled, y_train, test_size=0.2, random_state=42
 )
 
+# Hiperparámetros fijos (PARAMS_BASE) o, con TUNE_HYPERPARAMS=1, los elegidos
+# por la búsqueda con validación temporal de hyperparam_search.py
+params_modelo = dict(PARAMS_BASE, n_estimators=1000)
+if TUNE_HYPERPARAMS:
+    print("Búsqueda de hiperparámetros con folds temporales...")
+    # Filas de train sin codificar, en orden temporal: cada fold ajusta su propio
+    # target encoding y scaler con sus filas de entrenamiento (sin ver la validación)
+    orden_temporal = np.lexsort((
+        df.loc[X_train.index, "hora"].to_numpy(), df.loc[X_train.index, "fecha"].to_numpy()
+    ))
+    X_busqueda = X_train.iloc[orden_temporal]
+    y_busqueda = y_train.iloc[orden_temporal]
+
+    def preparar_fold(train_idx, val_idx):
+        X_f_train, X_f_val, _ = target_encoding_improved(
+            X_busqueda.iloc[train_idx], X_busqueda.iloc[val_idx], y_busqueda.iloc[train_idx], categorical_cols
+        )
+        X_f_train = X_f_train.drop(columns=non_numeric)
+        X_f_val = X_f_val.drop(columns=non_numeric)
+        scaler_fold = StandardScaler().fit(X_f_train)
+        return scaler_fold.transform(X_f_train), scaler_fold.transform(X_f_val)
+
+    mejor = run_search(X_busqueda, y_busqueda.to_numpy(), preparar_fold=preparar_fold)
+    params_modelo = dict(mejor["params"], n_estimators=mejor["n_estimators"])
+
 # Modelo optimizado con mejores hiperparámetros
 model = XGBRegressor(
-    n_estimators=1000,
-    learning_rate=0.05,
-    max_depth=8,
-    subsample=0.85,
-    colsample_bytree=0.85,
-    colsample_bylevel=0.85,
-    min_child_weight=5,
-    reg_alpha=0.5,
-    reg_lambda=2.0,
-    gamma=0.1,
+    **params_modelo,
     objective='reg:squarederror',
     random_state=42,
     verbosity=0,
@@ -485,301 +324,29 @@ print(f"   ±20%: {within_20:.1f}%")
 # -------------------------
 # 9) FUNCIÓN DE PREDICCIÓN PROFESIONAL CORREGIDA
 # -------------------------
-def prepare_input_for_prediction(input_dict, df_train, scaler, encoding_maps, columnas_entrenamiento):
+# Artefactos en memoria con la misma forma que los que carga predict.py, para
+# preparar los inputs con el mismo código que el serving (feature_builder.py)
+artifacts_locales = {
+    "scaler": scaler,
+    "encoding_maps": encoding_maps,
+    "columnas_entrenamiento": columnas_entrenamiento,
+    "hist_mes": hist_mes,
+    "hist_hora": hist_hora,
+    "hist_dia_semana": hist_dia_semana,
+    "hist_mes_dia": hist_mes_dia,
+    "hist_hora_dia": hist_hora_dia,
+    "hist_mes_hora": hist_mes_hora,
+    "df_processed": df,
+}
+
+
+def prepare_input_for_prediction(input_dict, artifacts):
     """
     Prepara un input para predicción aplicando todo el feature engineering
     """
-    df_input = pd.DataFrame([input_dict]).copy()
-    
-    # Parsear fecha
-    fecha = pd.to_datetime(df_input["fecha"].iloc[0], errors="coerce")
-    if pd.isna(fecha):
-        fecha = pd.Timestamp.now()
-    
-    # Parsear hora
-    hora_str = input_dict.get("hora", "12:00:00")
-    hora = parse_hora(hora_str)
-    if pd.isna(hora):
-        hora = 12.0
-    
-    # Features temporales
-    mes = fecha.month
-    dia_mes = fecha.day
-    dia_semana_num = fecha.weekday()
-    semana_año = fecha.isocalendar().week
-    trimestre = fecha.quarter
-    año = fecha.year
-    
-    # Días de semana
-    es_lunes = 1 if dia_semana_num == 0 else 0
-    es_martes = 1 if dia_semana_num == 1 else 0
-    es_miercoles = 1 if dia_semana_num == 2 else 0
-    es_jueves = 1 if dia_semana_num == 3 else 0
-    es_viernes = 1 if dia_semana_num == 4 else 0
-    es_sabado = 1 if dia_semana_num == 5 else 0
-    es_domingo = 1 if dia_semana_num == 6 else 0
-    es_fin_de_semana = 1 if dia_semana_num in [5, 6] else 0
-    es_dia_laborable = 1 if dia_semana_num in [0, 1, 2, 3, 4] else 0
-    
-    # Meses
-    es_mes_dict = {i: 1 if mes == i else 0 for i in range(1, 13)}
-    
-    # Temporada
-    temporada = get_temporada(mes)
-    
-    # Features cíclicas
-    hora_sin = np.sin(2 * np.pi * hora / 24)
-    hora_cos = np.cos(2 * np.pi * hora / 24)
-    mes_sin = np.sin(2 * np.pi * mes / 12)
-    mes_cos = np.cos(2 * np.pi * mes / 12)
-    dia_semana_sin = np.sin(2 * np.pi * dia_semana_num / 7)
-    dia_semana_cos = np.cos(2 * np.pi * dia_semana_num / 7)
-    dia_mes_sin = np.sin(2 * np.pi * dia_mes / 31)
-    dia_mes_cos = np.cos(2 * np.pi * dia_mes / 31)
-    semana_año_sin = np.sin(2 * np.pi * semana_año / 52)
-    semana_año_cos = np.cos(2 * np.pi * semana_año / 52)
-    
-    # Interacciones
-    hora_mes = hora * mes
-    hora_dia_semana = hora * dia_semana_num
-    mes_dia_semana = mes * dia_semana_num
-    fin_semana_mes = es_fin_de_semana * mes
-    temporada_dia_semana = temporada * dia_semana_num
-    
-    # Clima
-    temperatura = input_dict.get("temperatura", df_train["temperatura"].median() if "temperatura" in df_train.columns else 20)
-    humedad = input_dict.get("humedad", df_train["humedad"].median() if "humedad" in df_train.columns else 60)
-    sensacion_termica = input_dict.get("sensacion_termica", temperatura)
-    codigo_clima = input_dict.get("codigo_clima", 3)
-    es_buen_clima = 1 if codigo_clima in [1, 2, 3] else 0
-    es_mal_clima = 1 if codigo_clima > 3 else 0
-    
-    # Atracción y zona
-    atraccion = input_dict.get("atraccion", "")
-    zona = input_dict.get("zona", "")
-    
-    # Features históricas (usar los datos históricos guardados)
-    # Buscar en los históricos
-    hist_mes_row = hist_mes[(hist_mes["atraccion"] == atraccion) & (hist_mes["mes"] == mes)]
-    hist_hora_row = hist_hora[(hist_hora["atraccion"] == atraccion) & (hist_hora["hora"] == int(hora))]
-    hist_dia_row = hist_dia_semana[(hist_dia_semana["atraccion"] == atraccion) & (hist_dia_semana["dia_semana_num"] == dia_semana_num)]
-    hist_mes_dia_row = hist_mes_dia[(hist_mes_dia["atraccion"] == atraccion) & (hist_mes_dia["mes"] == mes) & (hist_mes_dia["dia_semana_num"] == dia_semana_num)]
-    hist_hora_dia_row = hist_hora_dia[(hist_hora_dia["atraccion"] == atraccion) & (hist_hora_dia["hora"] == int(hora)) & (hist_hora_dia["dia_semana_num"] == dia_semana_num)]
-    hist_mes_hora_row = hist_mes_hora[(hist_mes_hora["atraccion"] == atraccion) & (hist_mes_hora["mes"] == mes) & (hist_mes_hora["hora"] == int(hora))]
-    
-    # Valores por defecto
-    global_median = df_train["tiempo_espera"].median()
-    global_mean = df_train["tiempo_espera"].mean()
-    
-    # Extraer valores históricos
-    count_mes = hist_mes_row["count_mes"].values[0] if not hist_mes_row.empty else 0
-    mean_mes = hist_mes_row["mean_mes"].values[0] if not hist_mes_row.empty else global_mean
-    median_mes = hist_mes_row["median_mes"].values[0] if not hist_mes_row.empty else global_median
-    std_mes = hist_mes_row["std_mes"].values[0] if not hist_mes_row.empty else df_train["tiempo_espera"].std()
-    p75_mes = hist_mes_row["p75_mes"].values[0] if not hist_mes_row.empty else np.percentile(df_train["tiempo_espera"], 75)
-    p90_mes = hist_mes_row["p90_mes"].values[0] if not hist_mes_row.empty else np.percentile(df_train["tiempo_espera"], 90)
-    p95_mes = hist_mes_row["p95_mes"].values[0] if not hist_mes_row.empty else np.percentile(df_train["tiempo_espera"], 95)
-    
-    count_hora = hist_hora_row["count_hora"].values[0] if not hist_hora_row.empty else 0
-    mean_hora = hist_hora_row["mean_hora"].values[0] if not hist_hora_row.empty else global_mean
-    median_hora = hist_hora_row["median_hora"].values[0] if not hist_hora_row.empty else global_median
-    std_hora = hist_hora_row["std_hora"].values[0] if not hist_hora_row.empty else df_train["tiempo_espera"].std()
-    p75_hora = hist_hora_row["p75_hora"].values[0] if not hist_hora_row.empty else np.percentile(df_train["tiempo_espera"], 75)
-    p90_hora = hist_hora_row["p90_hora"].values[0] if not hist_hora_row.empty else np.percentile(df_train["tiempo_espera"], 90)
-    
-    count_dia = hist_dia_row["count_dia"].values[0] if not hist_dia_row.empty else 0
-    mean_dia = hist_dia_row["mean_dia"].values[0] if not hist_dia_row.empty else global_mean
-    median_dia = hist_dia_row["median_dia"].values[0] if not hist_dia_row.empty else global_median
-    std_dia = hist_dia_row["std_dia"].values[0] if not hist_dia_row.empty else df_train["tiempo_espera"].std()
-    p75_dia = hist_dia_row["p75_dia"].values[0] if not hist_dia_row.empty else np.percentile(df_train["tiempo_espera"], 75)
-    p90_dia = hist_dia_row["p90_dia"].values[0] if not hist_dia_row.empty else np.percentile(df_train["tiempo_espera"], 90)
-    
-    count_mes_dia = hist_mes_dia_row["count_mes_dia"].values[0] if not hist_mes_dia_row.empty else 0
-    mean_mes_dia = hist_mes_dia_row["mean_mes_dia"].values[0] if not hist_mes_dia_row.empty else global_mean
-    median_mes_dia = hist_mes_dia_row["median_mes_dia"].values[0] if not hist_mes_dia_row.empty else global_median
-    p75_mes_dia = hist_mes_dia_row["p75_mes_dia"].values[0] if not hist_mes_dia_row.empty else np.percentile(df_train["tiempo_espera"], 75)
-    p90_mes_dia = hist_mes_dia_row["p90_mes_dia"].values[0] if not hist_mes_dia_row.empty else np.percentile(df_train["tiempo_espera"], 90)
-    
-    count_hora_dia = hist_hora_dia_row["count_hora_dia"].values[0] if not hist_hora_dia_row.empty else 0
-    mean_hora_dia = hist_hora_dia_row["mean_hora_dia"].values[0] if not hist_hora_dia_row.empty else global_mean
-    median_hora_dia = hist_hora_dia_row["median_hora_dia"].values[0] if not hist_hora_dia_row.empty else global_median
-    p75_hora_dia = hist_hora_dia_row["p75_hora_dia"].values[0] if not hist_hora_dia_row.empty else np.percentile(df_train["tiempo_espera"], 75)
-    
-    count_mes_hora = hist_mes_hora_row["count_mes_hora"].values[0] if not hist_mes_hora_row.empty else 0
-    mean_mes_hora = hist_mes_hora_row["mean_mes_hora"].values[0] if not hist_mes_hora_row.empty else global_mean
-    median_mes_hora = hist_mes_hora_row["median_mes_hora"].values[0] if not hist_mes_hora_row.empty else global_median
-    p75_mes_hora = hist_mes_hora_row["p75_mes_hora"].values[0] if not hist_mes_hora_row.empty else np.percentile(df_train["tiempo_espera"], 75)
-    
-    # Flags especiales
-    is_batman_octubre = 1 if ("Batman" in atraccion and mes == 10) else 0
-    is_octubre = 1 if mes == 10 else 0
-    is_noviembre = 1 if mes == 11 else 0
-    is_octubre_fin_semana = 1 if (mes == 10 and es_fin_de_semana == 1) else 0
-    is_noviembre_fin_semana = 1 if (mes == 11 and es_fin_de_semana == 1) else 0
-    
-    # Features de HORA DEL DÍA
-    hora_int = int(hora)
-    es_hora_apertura = 1 if (hora_int >= 10 and hora_int < 11) else 0
-    es_hora_pico = 1 if (hora_int >= 11 and hora_int <= 16) else 0
-    es_hora_valle_manana = 1 if hora_int < 10 else 0
-    es_hora_valle_tarde = 1 if hora_int > 18 else 0
-    es_hora_valle = 1 if (es_hora_valle_manana or es_hora_valle_tarde) else 0
-    
-    # Features de PUENTES/FESTIVOS
-    def es_festivo_espana(fecha):
-        mes = fecha.month
-        dia = fecha.day
-        if mes == 1 and dia == 1: return 1
-        if mes == 1 and dia == 6: return 1
-        if mes == 5 and dia == 1: return 1
-        if mes == 10 and dia == 12: return 1
-        if mes == 11 and dia == 1: return 1
-        if mes == 12 and dia == 6: return 1
-        if mes == 12 and dia == 8: return 1
-        if mes == 12 and dia == 25: return 1
-        return 0
-    
-    def es_puente(fecha):
-        if es_festivo_espana(fecha):
-            return 1
-        dia_anterior = fecha - pd.Timedelta(days=1)
-        dia_siguiente = fecha + pd.Timedelta(days=1)
-        if fecha.weekday() == 4 and es_festivo_espana(dia_siguiente):
-            return 1
-        if fecha.weekday() == 0 and es_festivo_espana(dia_anterior):
-            return 1
-        if fecha.weekday() == 6 and es_festivo_espana(dia_anterior):
-            return 1
-        return 0
-    
-    es_festivo = es_festivo_espana(fecha)
-    es_puente_val = es_puente(fecha)
-    
-    # Interacciones con hora y puentes
-    hora_apertura_fin_semana = es_hora_apertura * es_fin_de_semana
-    hora_pico_puente = es_hora_pico * es_puente_val
-    puente_fin_semana = es_puente_val * es_fin_de_semana
-    
-    # Encoding categórico
-    zona_enc = encoding_maps.get("zona", {}).get(zona, global_mean) if "zona" in encoding_maps else global_mean
-    atraccion_enc = encoding_maps.get("atraccion", {}).get(atraccion, global_mean) if "atraccion" in encoding_maps else global_mean
-    
-    # Construir el vector de features en el mismo orden que las columnas de entrenamiento
-    feature_dict = {
-        "hora": hora,
-        "mes": mes,
-        "dia_mes": dia_mes,
-        "dia_semana_num": dia_semana_num,
-        "semana_año": semana_año,
-        "trimestre": trimestre,
-        "año": año,
-        "es_lunes": es_lunes,
-        "es_martes": es_martes,
-        "es_miercoles": es_miercoles,
-        "es_jueves": es_jueves,
-        "es_viernes": es_viernes,
-        "es_sabado": es_sabado,
-        "es_domingo": es_domingo,
-        "es_fin_de_semana": es_fin_de_semana,
-        "es_dia_laborable": es_dia_laborable,
-        **{f"es_mes_{i}": es_mes_dict[i] for i in range(1, 13)},
-        "temporada": temporada,
-        "hora_sin": hora_sin,
-        "hora_cos": hora_cos,
-        "mes_sin": mes_sin,
-        "mes_cos": mes_cos,
-        "dia_semana_sin": dia_semana_sin,
-        "dia_semana_cos": dia_semana_cos,
-        "dia_mes_sin": dia_mes_sin,
-        "dia_mes_cos": dia_mes_cos,
-        "semana_año_sin": semana_año_sin,
-        "semana_año_cos": semana_año_cos,
-        "hora_mes": hora_mes,
-        "hora_dia_semana": hora_dia_semana,
-        "mes_dia_semana": mes_dia_semana,
-        "fin_semana_mes": fin_semana_mes,
-        "temporada_dia_semana": temporada_dia_semana,
-        "temperatura": temperatura,
-        "humedad": humedad,
-        "sensacion_termica": sensacion_termica,
-        "codigo_clima": codigo_clima,
-        "es_buen_clima": es_buen_clima,
-        "es_mal_clima": es_mal_clima,
-        "count_mes": count_mes,
-        "mean_mes": mean_mes,
-        "median_mes": median_mes,
-        "std_mes": std_mes,
-        "p75_mes": p75_mes,
-        "p90_mes": p90_mes,
-        "p95_mes": p95_mes,
-        "count_hora": count_hora,
-        "mean_hora": mean_hora,
-        "median_hora": median_hora,
-        "std_hora": std_hora,
-        "p75_hora": p75_hora,
-        "p90_hora": p90_hora,
-        "count_dia": count_dia,
-        "mean_dia": mean_dia,
-        "median_dia": median_dia,
-        "std_dia": std_dia,
-        "p75_dia": p75_dia,
-        "p90_dia": p90_dia,
-        "count_mes_dia": count_mes_dia,
-        "mean_mes_dia": mean_mes_dia,
-        "median_mes_dia": median_mes_dia,
-        "p75_mes_dia": p75_mes_dia,
-        "p90_mes_dia": p90_mes_dia,
-        "count_hora_dia": count_hora_dia,
-        "mean_hora_dia": mean_hora_dia,
-        "median_hora_dia": median_hora_dia,
-        "p75_hora_dia": p75_hora_dia,
-        "count_mes_hora": count_mes_hora,
-        "mean_mes_hora": mean_mes_hora,
-        "median_mes_hora": median_mes_hora,
-        "p75_mes_hora": p75_mes_hora,
-        "is_batman_octubre": is_batman_octubre,
-        "is_octubre": is_octubre,
-        "is_noviembre": is_noviembre,
-        "is_octubre_fin_semana": is_octubre_fin_semana,
-        "is_noviembre_fin_semana": is_noviembre_fin_semana,
-        "hora_int": hora_int,
-        "es_hora_apertura": es_hora_apertura,
-        "es_hora_pico": es_hora_pico,
-        "es_hora_valle_manana": es_hora_valle_manana,
-        "es_hora_valle_tarde": es_hora_valle_tarde,
-        "es_hora_valle": es_hora_valle,
-        "es_festivo": es_festivo,
-        "es_puente": es_puente_val,
-        "hora_apertura_fin_semana": hora_apertura_fin_semana,
-        "hora_pico_puente": hora_pico_puente,
-        "puente_fin_semana": puente_fin_semana,
-        "zona_enc": zona_enc,
-        "atraccion_enc": atraccion_enc,
-    }
-    
-    # Añadir frecuencias si existen
-    if "zona_freq" in columnas_entrenamiento:
-        zona_freq_map = df_train["zona"].value_counts().to_dict() if "zona" in df_train.columns else {}
-        feature_dict["zona_freq"] = zona_freq_map.get(zona, 0)
-    if "atraccion_freq" in columnas_entrenamiento:
-        atraccion_freq_map = df_train["atraccion"].value_counts().to_dict() if "atraccion" in df_train.columns else {}
-        feature_dict["atraccion_freq"] = atraccion_freq_map.get(atraccion, 0)
-    
-    # Crear DataFrame y asegurar el mismo orden de columnas
-    df_features = pd.DataFrame([feature_dict])
-    
-    # Asegurar que todas las columnas estén presentes
-    for col in columnas_entrenamiento:
-        if col not in df_features.columns:
-            df_features[col] = 0
-    
-    # Reordenar columnas
-    df_features = df_features[columnas_entrenamiento]
-    
-    # Escalar
-    X_scaled = scaler.transform(df_features)
-    
-    return X_scaled
+    layout = get_feature_layout(artifacts)
+    row = fill_feature_row(layout, build_serving_row(input_dict, artifacts))
+    return scale_features(layout, row)
 
 
 def predict_wait_realista(input_dict):
@@ -790,9 +357,7 @@ def predict_wait_realista(input_dict):
     - Combina predicción del modelo con históricos granulares
     """
     # Predicción base del modelo (ESTA ES LA CLAVE - tiene hora, día del mes, etc.)
-    X_pred = prepare_input_for_prediction(
-        input_dict, df, scaler, encoding_maps, columnas_entrenamiento
-    )
+    X_pred = prepare_input_for_prediction(input_dict, artifacts_locales)
     pred_base = float(model.predict(X_pred)[0])
     
     # Extraer información del input
@@ -886,33 +451,7 @@ def predict_wait_realista(input_dict):
     es_hora_valle = (hora_int < 10 or hora_int > 18)
     
     # Detectar puente/festivo
-    def es_festivo_espana(fecha):
-        mes = fecha.month
-        dia = fecha.day
-        if mes == 1 and dia == 1: return 1
-        if mes == 1 and dia == 6: return 1
-        if mes == 5 and dia == 1: return 1
-        if mes == 10 and dia == 12: return 1
-        if mes == 11 and dia == 1: return 1
-        if mes == 12 and dia == 6: return 1
-        if mes == 12 and dia == 8: return 1
-        if mes == 12 and dia == 25: return 1
-        return 0
-    
-    def es_puente(fecha):
-        if es_festivo_espana(fecha):
-            return 1
-        dia_anterior = fecha - pd.Timedelta(days=1)
-        dia_siguiente = fecha + pd.Timedelta(days=1)
-        if fecha.weekday() == 4 and es_festivo_espana(dia_siguiente):
-            return 1
-        if fecha.weekday() == 0 and es_festivo_espana(dia_anterior):
-            return 1
-        if fecha.weekday() == 6 and es_festivo_espana(dia_anterior):
-            return 1
-        return 0
-    
-    es_puente_val = es_puente(fecha)
+    es_puente_val = calendar_row(fecha)["es_puente"]
     
     # PRIORIZAR históricos por hora - si tenemos datos específicos por hora, usarlos directamente
     # Si tenemos histórico por hora específica, usarlo como base principal
@@ -1204,7 +743,67 @@ joblib.dump(hist_dia_semana, "models/hist_dia_semana.pkl")
 joblib.dump(hist_mes_dia, "models/hist_mes_dia.pkl")
 joblib.dump(hist_hora_dia, "models/hist_hora_dia.pkl")
 joblib.dump(hist_mes_hora, "models/hist_mes_hora.pkl")
-joblib.dump(df, "models/df_processed.pkl")  
+if SAVE_DF_PROCESSED:
+    joblib.dump(df, "models/df_processed.pkl")
+
+# Estado para train_incremental.py: marca de agua (última ultima_actualizacion
+# leída, incluidos los outliers descartados), filtro de outliers y test set
+# escalado como holdout de referencia del guardarraíl
+estado = save_training_state(
+    "models", parse_watermark(df_original["ultima_actualizacion"]).max(),
+    q_low, q_high, X_test_scaled, y_test, rmse
+)
+print(f"Marca de agua para el reentrenamiento incremental: {estado['watermark']}")
+
+# Sketches fusionables de los históricos (hist_sketches.py): la ingesta los
+# actualiza desde la marca de agua y reescribe las tablas hist_* entre reentrenamientos
+save_hist_sketches(build_hist_sketches(df, estado["watermark"], q_low, q_high), "models")
+print(f"Sketches de históricos: models/{SKETCHES_FILENAME}")
+
+# Metadatos de serving: lo único que la inferencia y la app usan de df_processed
+serving_metadata = build_serving_metadata(df)
+joblib.dump(serving_metadata, f"models/{SERVING_METADATA_FILENAME}")
+print(f"Metadatos de serving: {len(serving_metadata['atracciones'])} atracciones, "
+      f"{len(serving_metadata['zonas'])} zonas, {serving_metadata['n_registros']} registros")
+
+# Cubo de cuantiles por nivel de fallback (lo usa predict_wait_time en lugar de filtrar df_processed)
+print("Materializando cubo de cuantiles (p25/p50/p75/p90 + count)...")
+quantile_cube = build_quantile_cube(df)
+for level, table in quantile_cube.items():
+    print(f"   {level}: {len(table)} filas")
+joblib.dump(quantile_cube, "models/quantile_cube.pkl")
+
+# Árboles en arrays planos para el evaluador NumPy (la Lambda predice sin importar xgboost),
+# con el StandardScaler plegado en los umbrales si la paridad es exacta (serving sin escalar)
+print("Exportando el ensemble de árboles a arrays NumPy...")
+tree_ensemble, distintas, max_diff = export_serving_ensemble(
+    model, scaler, np.vstack([X_train_scaled, X_test_scaled]),
+    pd.concat([X_train_enc, X_test_enc]).to_numpy(dtype=np.float64)
+)
+if distintas == 0:
+    joblib.dump(tree_ensemble, "models/xgb_tree_ensemble.pkl")
+    plegado = "con el scaler plegado" if tree_ensemble["escalado_plegado"] else "sin plegar el scaler"
+    print(f"   ✓ {len(tree_ensemble['value'])} nodos ({plegado}), predicciones idénticas a model.predict")
+
+    # Bundle de serving: un solo fichero con todo lo que necesita la inferencia (sustituye a los pickles)
+    print("Empaquetando el bundle de serving...")
+    tamano_bundle = save_serving_bundle({
+        "tree_ensemble": tree_ensemble,
+        "scaler": scaler,
+        "encoding_maps": encoding_maps,
+        "columnas_entrenamiento": columnas_entrenamiento,
+        "serving_metadata": serving_metadata,
+        "hist_mes": hist_mes,
+        "hist_hora": hist_hora,
+        "hist_dia_semana": hist_dia_semana,
+        "hist_mes_dia": hist_mes_dia,
+        "hist_hora_dia": hist_hora_dia,
+        "hist_mes_hora": hist_mes_hora,
+        "quantile_cube": quantile_cube,
+    }, os.path.join("models", BUNDLE_FILENAME))
+    print(f"   ✓ models/{BUNDLE_FILENAME} ({tamano_bundle / 1024:.0f} KB, versión {BUNDLE_VERSION})")
+else:
+    print(f"   ⚠️  {distintas} predicciones distintas (máx. diferencia {max_diff:.6f}), no se exporta el ensemble ni el bundle de serving")
 
 print("✅ Todos los artefactos guardados correctamente")
 
@@ -0,0 +1,24 @@
+# ====================================================
+# MARCA DE AGUA - Filas nuevas de tiempos_final.csv
+# ====================================================
+# train_model.py guarda la última ultima_actualizacion leída como marca de
+# agua, y train_incremental.py y la ingesta (hist_sketches.py) leen solo las
+# filas posteriores. Este módulo solo depende de pandas, para que la ingesta
+# no importe xgboost ni sklearn en cada ejecución.
+
+import pandas as pd
+
+
+def parse_watermark(valores):
+    """ultima_actualizacion (strings o Timestamps) -> datetimes UTC (NaT si no se puede parsear)"""
+    return pd.to_datetime(valores, utc=True, errors="coerce", format="mixed")
+
+
+def load_new_rows(ruta, estado):
+    """Filas de ruta posteriores a la marca de agua, ordenadas en el tiempo y sin outliers"""
+    df = pd.read_csv(ruta)
+    momento = parse_watermark(df["ultima_actualizacion"])
+    nuevas = df[momento > pd.Timestamp(estado["watermark"])].copy()
+    nuevas["_momento"] = momento[nuevas.index]
+    nuevas = nuevas[(nuevas["tiempo_espera"] >= estado["q_low"]) & (nuevas["tiempo_espera"] <= estado["q_high"])]
+    return nuevas.sort_values("_momento", kind="stable")
@@ -0,0 +1,249 @@
+# ====================================================
+# ENSEMBLE DE ÁRBOLES EN NUMPY - Inferencia sin xgboost
+# ====================================================
+# export_tree_ensemble (en train_model.py, donde sí está xgboost) vuelca el
+# booster a arrays planos: feature, umbral, hijo izquierdo/derecho, dirección
+# por defecto para valores faltantes y valor de hoja. predict_tree_ensemble
+# recorre todos los árboles para todo el lote a la vez solo con NumPy, de modo
+# que la Lambda puede predecir sin importar xgboost.
+#
+# Paridad con XGBoost: se compara en float32 (como la DMatrix), los NaN siguen
+# default_left y las hojas se acumulan en float32 sobre base_score en el mismo
+# orden de árboles, así que el resultado es idéntico a model.predict.
+#
+# Con el scaler plegado (umbrales float64 en el espacio original) el ensemble
+# recibe las features sin escalar y reproduce model.predict(scaler.transform(X)):
+# el serving se ahorra el escalado (feature_layout.model_input).
+
+import json
+import time
+
+import numpy as np
+
+# Objetivos con enlace identidad (la predicción es directamente el margen)
+OBJETIVOS_SOPORTADOS = {
+    "reg:squarederror", "reg:absoluteerror", "reg:pseudohubererror", "reg:quantileerror",
+}
+
+
+def _parse_base_score(valor):
+    """base_score viene como '3.97E0' o '[3.97E0]' según la versión de XGBoost"""
+    return float(str(valor).strip("[]"))
+
+
+def export_tree_ensemble(model, scaler=None):
+    """
+    Vuelca un XGBRegressor (o Booster) a un dict de arrays planos.
+
+    Si se pasa el scaler, los umbrales se pliegan al espacio original con la
+    frontera exacta en float64 (ver scaler_folding.py) y el ensemble recibe las
+    features sin escalar.
+    """
+    booster = model.get_booster() if hasattr(model, "get_booster") else model
+    raw = json.loads(booster.save_raw("json"))
+    learner = raw["learner"]
+
+    objetivo = learner["objective"]["name"]
+    if objetivo not in OBJETIVOS_SOPORTADOS:
+        raise ValueError(f"Objetivo no soportado por el evaluador NumPy: {objetivo}")
+
+    trees = learner["gradient_booster"]["model"]["trees"]
+    n_features = int(learner["learner_model_param"]["num_feature"])
+
+    feature, threshold, left, right, default_left, value, roots = [], [], [], [], [], [], []
+    offset = 0
+    for tree in trees:
+        izquierda = np.asarray(tree["left_children"], dtype=np.int64)
+        derecha = np.asarray(tree["right_children"], dtype=np.int64)
+        if np.any(np.asarray(tree["split_type"]) != 0):
+            raise ValueError("Los splits categóricos no están soportados por el evaluador NumPy")
+        es_hoja = izquierda == -1
+        nodos = np.arange(len(izquierda)) + offset
+        condiciones = np.asarray(tree["split_conditions"], dtype=np.float32)
+
+        # Las hojas apuntan a sí mismas: el recorrido puede hacer siempre max_depth pasos
+        left.append(np.where(es_hoja, nodos, izquierda + offset))
+        right.append(np.where(es_hoja, nodos, derecha + offset))
+        feature.append(np.where(es_hoja, 0, np.asarray(tree["split_indices"], dtype=np.int64)))
+        threshold.append(np.where(es_hoja, 0, condiciones))
+        default_left.append(np.asarray(tree["default_left"], dtype=bool))
+        value.append(np.where(es_hoja, condiciones, 0).astype(np.float32))
+        roots.append(offset)
+        offset += len(izquierda)
+
+    ensemble = {
+        "feature": np.concatenate(feature).astype(np.int32),
+        "threshold": np.concatenate(threshold).astype(np.float32),
+        "left": np.concatenate(left).astype(np.int32),
+        "right": np.concatenate(right).astype(np.int32),
+        "default_left": np.concatenate(default_left),
+        "value": np.concatenate(value),
+        "roots": np.asarray(roots, dtype=np.int32),
+        "base_score": np.float32(_parse_base_score(learner["learner_model_param"]["base_score"])),
+        "n_features": n_features,
+        "escalado_plegado": scaler is not None,
+    }
+
+    if scaler is not None:
+        # Import local: el plegado solo se usa al exportar (scaler_folding no va en la Lambda)
+        from scaler_folding import fold_thresholds, scaler_params
+        mean, scale = scaler_params(scaler, n_features)
+        internos = ensemble["left"] != np.arange(len(ensemble["left"]))
+        umbrales = ensemble["threshold"].astype(np.float64)
+        f = ensemble["feature"][internos]
+        umbrales[internos] = fold_thresholds(ensemble["threshold"][internos], mean[f], scale[f])
+        ensemble["threshold"] = umbrales
+
+    ensemble["max_depth"] = _max_depth(ensemble)
+    return ensemble
+
+
+def _max_depth(ensemble):
+    """Número de pasos necesarios para que todos los recorridos lleguen a una hoja"""
+    left, right = ensemble["left"], ensemble["right"]
+    nodos = ensemble["roots"].astype(np.int64)
+    profundidad = 0
+    while True:
+        siguientes = np.concatenate([left[nodos], right[nodos]])
+        internos = siguientes[siguientes != np.concatenate([nodos, nodos])]
+        if len(internos) == 0:
+            return profundidad
+        nodos = np.unique(internos)
+        profundidad += 1
+
+
+def predict_tree_ensemble(ensemble, X):
+    """Evalúa el ensemble para una fila o matriz X (n, n_features); devuelve float32 como model.predict"""
+    # Mismo tipo de comparación que el booster: float32 (o float64 si los umbrales se plegaron)
+    X = np.array(X, dtype=ensemble["threshold"].dtype, ndmin=2)
+    n, n_features = X.shape
+    feature = ensemble["feature"]
+    threshold = ensemble["threshold"]
+    # Hijos intercalados [izq, der] por nodo: el siguiente nodo es hijos[2 * nodo + va_derecha]
+    hijos = np.stack([ensemble["left"], ensemble["right"]], axis=1).ravel()
+    hay_nan = np.isnan(X).any()
+
+    # Recorrer todos los árboles para todo el lote a la vez: nodos tiene forma (n, n_arboles)
+    X_plano = X.ravel()
+    inicio_fila = (np.arange(n, dtype=np.int64) * n_features)[:, None]
+    nodos = np.broadcast_to(ensemble["roots"], (n, len(ensemble["roots"])))
+    for _ in range(ensemble["max_depth"]):
+        x = X_plano.take(inicio_fila + feature.take(nodos))
+        # Los NaN comparan False (van a la derecha) salvo que el nodo diga default_left
+        va_derecha = ~(x < threshold.take(nodos))
+        if hay_nan:
+            va_derecha &= ~(np.isnan(x) & ensemble["default_left"].take(nodos))
+        nodos = hijos.take(2 * nodos + va_derecha)
+
+    # Acumular en float32 en el orden de los árboles, empezando por base_score (como XGBoost)
+    hojas = ensemble["value"].take(nodos)
+    base = np.full((n, 1), ensemble["base_score"], dtype=np.float32)
+    return np.cumsum(np.concatenate([base, hojas], axis=1), axis=1, dtype=np.float32)[:, -1]
+
+
+def predict_model(artifacts, X):
+    """
+    Predicción base: evaluador NumPy si se cargó el ensemble exportado, si no
+    model.predict. X es la salida de feature_layout.model_input (sin escalar
+    si el ensemble tiene el scaler plegado).
+    """
+    ensemble = artifacts.get("tree_ensemble")
+    if ensemble is not None:
+        return predict_tree_ensemble(ensemble, X)
+    return artifacts["model"].predict(X)
+
+
+def verify_tree_ensemble(model, ensemble, X, X_raw=None):
+    """
+    Compara predict_tree_ensemble con model.predict sobre X (escalada); si el
+    ensemble tiene el scaler plegado se evalúa sobre X_raw, las mismas filas sin
+    escalar. Devuelve (n_distintas, max_diff).
+    """
+    original = model.predict(X)
+    numpy_pred = predict_tree_ensemble(ensemble, X_raw if ensemble["escalado_plegado"] else X)
+    distintas = int(np.sum(original != numpy_pred))
+    max_diff = float(np.max(np.abs(original.astype(np.float64) - numpy_pred))) if len(X) else 0.0
+    return distintas, max_diff
+
+
+def export_serving_ensemble(model, scaler, X, X_raw):
+    """
+    Ensemble para serving: con el scaler plegado si reproduce model.predict en
+    todas las filas (X escalada, X_raw sin escalar), si no sin plegar.
+    Devuelve (ensemble, n_distintas, max_diff) de la variante elegida.
+    """
+    plegado = export_tree_ensemble(model, scaler)
+    distintas, max_diff = verify_tree_ensemble(model, plegado, X, X_raw)
+    if distintas == 0:
+        return plegado, distintas, max_diff
+    ensemble = export_tree_ensemble(model)
+    return (ensemble, *verify_tree_ensemble(model, ensemble, X))
+
+
+def benchmark_tree_ensemble(model, ensemble, X, repeticiones=200):
+    """Latencia media por llamada (ms) de XGBoost y del evaluador NumPy para una fila y para el lote X"""
+    resultados = {}
+    fila = X[:1]
+    for nombre, predecir in [("xgboost", model.predict), ("numpy", lambda A: predict_tree_ensemble(ensemble, A))]:
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            predecir(fila)
+        resultados[f"{nombre}_fila_ms"] = (time.perf_counter() - inicio) / repeticiones * 1000
+        inicio = time.perf_counter()
+        for _ in range(max(1, repeticiones // 20)):
+            predecir(X)
+        resultados[f"{nombre}_lote_ms"] = (time.perf_counter() - inicio) / max(1, repeticiones // 20) * 1000
+    return resultados
+
+
+def _tiempo_import(modulo):
+    """Tiempo (s) de importar un módulo en un intérprete nuevo (aproxima el cold start)"""
+    import subprocess
+    import sys
+    codigo = f"import time; t = time.perf_counter(); import {modulo}; print(time.perf_counter() - t)"
+    salida = subprocess.run([sys.executable, "-c", codigo], capture_output=True, text=True, check=True)
+    return float(salida.stdout.strip().splitlines()[-1])
+
+
+# Paridad y benchmark contra el modelo entrenado
+if __name__ == "__main__":
+    import os
+    import joblib
+
+    base_path = "models" if os.path.exists("models/xgb_model_professional.pkl") else "../models"
+    model = joblib.load(os.path.join(base_path, "xgb_model_professional.pkl"))
+    scaler = joblib.load(os.path.join(base_path, "xgb_scaler_professional.pkl"))
+    columnas = joblib.load(os.path.join(base_path, "xgb_columns_professional.pkl"))
+    df_path = os.path.join(base_path, "df_processed.pkl")
+    if not os.path.exists(df_path):
+        print("❌ No existe df_processed.pkl (ejecuta train_model.py con SAVE_DF_PROCESSED=1)")
+        raise SystemExit(1)
+    df = joblib.load(df_path)
+
+    print("=" * 70)
+    print("🌲 EVALUADOR NUMPY DEL ENSEMBLE XGBOOST")
+    print("=" * 70)
+
+    inicio = time.perf_counter()
+    ensemble = export_tree_ensemble(model)
+    print(f"Exportado en {time.perf_counter() - inicio:.2f}s: {len(ensemble['roots'])} árboles, "
+          f"{len(ensemble['value'])} nodos, profundidad máx. {ensemble['max_depth']}")
+
+    # Features de df_processed (las que no estén, p. ej. encodings, a 0) escaladas como en serving
+    X_raw = df.reindex(columns=columnas, fill_value=0)
+    X = scaler.transform(X_raw)
+
+    distintas, max_diff = verify_tree_ensemble(model, ensemble, X)
+    print(f"\n✓ Paridad con model.predict en {len(X)} filas: {distintas} distintas (máx. diferencia {max_diff})")
+
+    plegado = export_tree_ensemble(model, scaler)
+    distintas_plegado, _ = verify_tree_ensemble(model, plegado, X, X_raw.to_numpy(dtype=np.float64))
+    print(f"✓ Paridad del ensemble con scaler plegado (features sin escalar): {distintas_plegado} distintas")
+
+    print("\n⏱️  Latencia (ms por llamada):")
+    for clave, valor in benchmark_tree_ensemble(model, ensemble, X).items():
+        print(f"   {clave}: {valor:.3f}")
+
+    print("\n🧊 Import en frío (s):")
+    print(f"   xgboost: {_tiempo_import('xgboost'):.3f}")
+    print(f"   numpy: {_tiempo_import('numpy'):.3f}")
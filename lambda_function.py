@@ -8,10 +8,23 @@ import boto3
 import joblib
 import pandas as pd
 import numpy as np
-from io import BytesIO
 import os
 import sys
-import traceback
+from hist_index import build_hist_indexes, get_hist_indexes
+from serving_stats import get_serving_stats
+from serving_metadata import SERVING_METADATA_FILENAME, build_serving_metadata, get_serving_metadata
+from quantile_cube import get_quantile_cube_index
+from feature_layout import RELLENO_REGLAS, get_feature_layout, fill_feature_row, fill_feature_matrix, model_input
+from feature_builder import build_serving_features, build_serving_row, parse_hora
+from tree_ensemble import predict_model
+from prediction_cache import PredictionCache, canonical_prediction_input
+from forecast_table import load_forecast_table, lookup_forecast
+from calendar_table import calendar_row
+from batch_request import BatchRequestError, expand_batch_request, is_batch_request, validate_item
+from request_log import DEBUG, lazy, log
+from request_timing import finish_request, lap, start_request
+from serving_bundle import BUNDLE_FILENAME, load_serving_bundle
+from s3_artifacts import ARTIFACT_CACHE_DIR, fetch_artifact, fetch_artifacts, format_timings, timed_load
 
 # Evitar errores de permisos de joblib en el entorno read-only de Lambda
 os.environ['JOBLIB_TEMP_FOLDER'] = '/tmp'
@@ -23,17 +36,22 @@ BUCKET_NAME = os.getenv('BUCKET_NAME', 'parklytics-models-tu-nombre-2024')
 # Cache para evitar recargas innecesarias entre llamadas
 models_cache = {}
 
-def load_model_from_s3():
-    """Carga todos los artefactos necesarios desde S3"""
-    if 'model' in models_cache:
-        return models_cache
-    
-    print("Iniciando descarga de modelos desde S3...")
+# Cache LRU+TTL de respuestas por input canónico (vive mientras el contenedor esté caliente)
+prediction_cache = PredictionCache()
+
+# Claves de S3 de los artefactos
+BUNDLE_KEY = f'models/{BUNDLE_FILENAME}'
+FORECAST_KEY = 'models/forecast_table.npz'
+TREE_ENSEMBLE_KEY = 'models/xgb_tree_ensemble.pkl'
+QUANTILE_CUBE_KEY = 'models/quantile_cube.pkl'
+SERVING_METADATA_KEY = f'models/{SERVING_METADATA_FILENAME}'
+DF_PROCESSED_KEY = 'models/df_processed.pkl'
+
+def _load_pickles_from_s3(descargas):
+    """Carga los artefactos sueltos (pickles) cuando no hay bundle de serving en S3"""
     files = {
-            'model': 'models/xgb_model_professional.pkl',
             'scaler': 'models/xgb_scaler_professional.pkl',
             'encoding_maps': 'models/xgb_encoding_professional.pkl',
-        'df_processed': 'models/df_processed.pkl',
             'hist_mes': 'historicos/hist_mes.pkl',
             'hist_hora': 'historicos/hist_hora.pkl',
             'hist_dia_semana': 'historicos/hist_dia_semana.pkl',
@@ -41,368 +59,217 @@ def load_model_from_s3():
             'hist_hora_dia': 'historicos/hist_hora_dia.pkl',
             'hist_mes_hora': 'historicos/hist_mes_hora.pkl'
         }
-        
+    
+    # Todos en paralelo, más el ensemble de árboles, el cubo de cuantiles (opcionales) y los metadatos
+    nuevas, errores = fetch_artifacts(
+        s3, BUCKET_NAME, [*files.values(), TREE_ENSEMBLE_KEY, QUANTILE_CUBE_KEY, SERVING_METADATA_KEY],
+        ARTIFACT_CACHE_DIR
+    )
+    descargas.update(nuevas)
+    
+    # Ensemble de árboles en arrays NumPy (opcional): si existe no se descarga el
+    # modelo XGBoost, así que xgboost ni siquiera se importa en el cold start
+    if TREE_ENSEMBLE_KEY in nuevas:
+        models_cache['tree_ensemble'] = timed_load(nuevas[TREE_ENSEMBLE_KEY], joblib.load)
+    else:
+        log.warning("xgb_tree_ensemble.pkl no disponible (%s), se usará el modelo XGBoost", errores[TREE_ENSEMBLE_KEY])
+        files['model'] = 'models/xgb_model_professional.pkl'
+        descargas[files['model']] = fetch_artifact(s3, BUCKET_NAME, files['model'], ARTIFACT_CACHE_DIR)
+    
+    for key, s3_key in files.items():
+        if s3_key not in descargas:
+            raise RuntimeError(f"No se pudo descargar {s3_key}: {errores[s3_key]}")
+        models_cache[key] = timed_load(descargas[s3_key], joblib.load)
+    
+    # Metadatos de serving (stats, listas de atracciones/zonas). Con artefactos
+    # anteriores se calculan una vez desde df_processed y este se descarta
+    if SERVING_METADATA_KEY in nuevas:
+        models_cache['serving_metadata'] = timed_load(nuevas[SERVING_METADATA_KEY], joblib.load)
+    else:
+        log.warning("%s no disponible (%s), se calculará desde df_processed.pkl",
+                    SERVING_METADATA_FILENAME, errores[SERVING_METADATA_KEY])
+        descargas[DF_PROCESSED_KEY] = fetch_artifact(s3, BUCKET_NAME, DF_PROCESSED_KEY, ARTIFACT_CACHE_DIR)
+        df_processed = timed_load(descargas[DF_PROCESSED_KEY], joblib.load)
+        models_cache['serving_metadata'] = build_serving_metadata(df_processed)
+        del df_processed
+    
+    # Indexar los históricos una sola vez por contenedor (búsqueda O(1) por petición)
+    models_cache['hist_index'] = build_hist_indexes(models_cache)
+    # Fallbacks globales y frecuencias precalculados en serving_metadata (sin df_processed)
+    get_serving_stats(models_cache)
+    
+    # Cubo de cuantiles (opcional: sin él predict_wait_time usa los fallbacks globales)
+    if QUANTILE_CUBE_KEY in nuevas:
+        models_cache['quantile_cube'] = timed_load(nuevas[QUANTILE_CUBE_KEY], joblib.load)
+    else:
+        log.warning("quantile_cube.pkl no disponible (%s), se usarán los fallbacks globales", errores[QUANTILE_CUBE_KEY])
+    get_quantile_cube_index(models_cache)
+
+def load_model_from_s3():
+    """Carga todos los artefactos necesarios desde S3 (en paralelo, con caché en /tmp por ETag)"""
+    if 'scaler' in models_cache:
+        return models_cache
+    
+    log.info("Iniciando descarga de modelos desde S3...")
     try:
-        for key, s3_key in files.items():
-            print(f"Descargando {s3_key}...")
-            obj = s3.get_object(Bucket=BUCKET_NAME, Key=s3_key)
-            models_cache[key] = joblib.load(BytesIO(obj['Body'].read()))
+        # Bundle de serving: un solo fichero con modelo, scaler, encodings e índices
+        # ya precalculados (sin pickles). Si no existe, pickles sueltos
+        descargas, errores = fetch_artifacts(s3, BUCKET_NAME, [BUNDLE_KEY, FORECAST_KEY], ARTIFACT_CACHE_DIR)
+        if BUNDLE_KEY in descargas:
+            models_cache.update(timed_load(descargas[BUNDLE_KEY], load_serving_bundle))
+            log.info("Bundle de serving v%s cargado (%s)", models_cache['bundle_version'], models_cache['bundle_creado'])
+        else:
+            log.warning("%s no disponible (%s), se cargarán los pickles", BUNDLE_FILENAME, errores[BUNDLE_KEY])
+            _load_pickles_from_s3(descargas)
+        
+        # Tabla de previsiones de los próximos días (opcional: sin ella todo va por inferencia en vivo)
+        if FORECAST_KEY in descargas:
+            try:
+                models_cache['forecast_table'] = timed_load(descargas[FORECAST_KEY], load_forecast_table)
+                log.info("Tabla de previsiones cargada desde %s", models_cache['forecast_table']['fecha_inicio'])
+            except ValueError as e:
+                # Tabla de una versión anterior (otra clave canónica): se ignora hasta regenerarla
+                log.warning("forecast_table.npz descartada (%s), se usará inferencia en vivo", e)
+        else:
+            log.info("forecast_table.npz no disponible (%s), se usará inferencia en vivo", errores[FORECAST_KEY])
+        # Posiciones y defaults de las features en el orden del scaler
+        get_feature_layout(models_cache, RELLENO_REGLAS)
         
-        print("Todos los modelos cargados exitosamente.")
+        # Tiempos de descarga y deserialización por artefacto
+        models_cache['artifact_timings'] = list(descargas.values())
+        for linea in format_timings(models_cache['artifact_timings']):
+            log.info("%s", linea)
+        log.info("Todos los modelos cargados exitosamente.")
         return models_cache
     except Exception as e:
-        print(f"ERROR CRÍTICO EN CARGA S3: {str(e)}")
+        log.error("ERROR CRÍTICO EN CARGA S3: %s", e)
         raise
 
-# --- FUNCIONES DE APOYO (Ingeniería de Variables) ---
-
-def parse_hora(hora_str):
-    try:
-        if isinstance(hora_str, (int, float)): return float(hora_str)
-        s = str(hora_str).strip()
-        if ":" in s:
-            parts = s.split(":")
-            return int(parts[0]) + (int(parts[1])/60.0 if len(parts)>1 else 0)
-        return float(s)
-    except: return 12.0
-
-def get_temporada(mes):
-    if mes in [7, 8, 10]: return 3 # Alta
-    if mes in [4, 5, 6, 12]: return 2 # Media-Alta
-    if mes in [3, 9, 11]: return 1 # Media
-    return 0 # Baja
-
-def es_festivo_espana(fecha):
-    festivos = [(1,1), (1,6), (5,1), (10,12), (11,1), (12,6), (12,8), (12,25)]
-    return 1 if (fecha.month, fecha.day) in festivos else 0
-
-def es_puente(fecha):
-    """Debe coincidir exactamente con train_model.py líneas 642-653"""
-    if es_festivo_espana(fecha): return 1
-    dia_anterior = fecha - pd.Timedelta(days=1)
-    dia_siguiente = fecha + pd.Timedelta(days=1)
-    # Viernes si el Sábado es festivo
-    if fecha.weekday() == 4 and es_festivo_espana(dia_siguiente): return 1
-    # Lunes si el Domingo fue festivo
-    if fecha.weekday() == 0 and es_festivo_espana(dia_anterior): return 1
-    # Domingo si el Sábado fue festivo (añadido según train_model.py línea 651)
-    if fecha.weekday() == 6 and es_festivo_espana(dia_anterior): return 1
-    return 0
-
 # --- PROCESAMIENTO Y PREDICCIÓN ---
 
-def prepare_input_for_prediction(input_dict, artifacts):
+def build_feature_row(input_dict, artifacts):
     """
     Esta función es el corazón del fix. 
-    Usa 'scaler.feature_names_in_' para saber exactamente qué columnas quiere el modelo.
+    Usa el orden de 'scaler.feature_names_in_' (compilado en el layout de features)
+    para saber exactamente qué columnas quiere el modelo.
     """
-    print("=== PREPARE INPUT FOR PREDICTION ===")
-    print(f"Input dict: {json.dumps(input_dict, default=str)}")
-    
-    scaler = artifacts['scaler']
-    col_order = list(scaler.feature_names_in_) 
-    print(f"Total de features esperadas: {len(col_order)}")
-    print(f"Primeras 10 features: {col_order[:10]}")
-    
-    encoding_maps = artifacts['encoding_maps']
-    df_train = artifacts['df_processed']
-    
-    # 1. Extraer datos básicos
-    fecha = pd.to_datetime(input_dict.get("fecha"), errors="coerce")
-    if pd.isna(fecha): fecha = pd.Timestamp.now()
-    
-    hora = parse_hora(input_dict.get("hora", 12))
-    mes, dia_semana = fecha.month, fecha.weekday()
-    es_fin_semana = 1 if dia_semana >= 5 else 0
-    atraccion = input_dict.get("atraccion", "Desconocida")
-    zona = input_dict.get("zona", "Desconocida")
-    
-    print(f"Fecha parseada: {fecha}, Mes: {mes}, Día semana: {dia_semana}")
-    print(f"Hora parseada: {hora}, Atracción: {atraccion}, Zona: {zona}")
-    
-    global_mean = df_train["tiempo_espera"].mean()
-    global_median = df_train["tiempo_espera"].median()
-    global_std = df_train["tiempo_espera"].std()
-    global_p75 = np.percentile(df_train["tiempo_espera"], 75)
-    global_p90 = np.percentile(df_train["tiempo_espera"], 90)
-    global_p95 = np.percentile(df_train["tiempo_espera"], 95)
-    print(f"Global mean: {global_mean}, Global median: {global_median}, Global std: {global_std}")
-    
-    # 2. Generar TODAS las variables posibles (Candidatos)
-    hora_int = int(hora)
-    # CORREGIDO: Debe coincidir exactamente con train_model.py líneas 622-626
-    es_hora_apertura = 1 if (hora_int >= 10 and hora_int < 11) else 0
-    es_hora_pico = 1 if (hora_int >= 11 and hora_int <= 16) else 0
-    es_festivo = es_festivo_espana(fecha)
-    es_puente_val = es_puente(fecha)
-    
-    c = {
-        "hora": hora, "hora_int": hora_int, "mes": mes, "año": fecha.year,
-        "dia_mes": fecha.day, "dia_semana_num": dia_semana,
-        "trimestre": fecha.quarter, "semana_año": fecha.isocalendar().week,
-        "es_fin_de_semana": es_fin_semana, "fin_de_semana": es_fin_semana,
-        "es_festivo": es_festivo, "es_puente": es_puente_val,
-        "temporada": get_temporada(mes),
-        "temperatura": float(input_dict.get("temperatura", 20)),
-        "humedad": float(input_dict.get("humedad", 60)),
-        "sensacion_termica": float(input_dict.get("temperatura", 20)),
-        "codigo_clima": int(input_dict.get("codigo_clima", 3)),
-        "zona_enc": encoding_maps.get("zona", {}).get(zona, global_mean),
-        "atraccion_enc": encoding_maps.get("atraccion", {}).get(atraccion, global_mean),
-        "hora_sin": np.sin(2 * np.pi * hora / 24), "hora_cos": np.cos(2 * np.pi * hora / 24),
-        "mes_sin": np.sin(2 * np.pi * mes / 12), "mes_cos": np.cos(2 * np.pi * mes / 12),
-        "dia_semana_sin": np.sin(2 * np.pi * dia_semana / 7), "dia_semana_cos": np.cos(2 * np.pi * dia_semana / 7),
-        "dia_mes_sin": np.sin(2 * np.pi * fecha.day / 31), "dia_mes_cos": np.cos(2 * np.pi * fecha.day / 31),
-        "semana_año_sin": np.sin(2 * np.pi * fecha.isocalendar().week / 52), 
-        "semana_año_cos": np.cos(2 * np.pi * fecha.isocalendar().week / 52),
-        "hora_int": hora_int,  # IMPORTANTE: Debe estar presente según train_model.py línea 745
-        "es_hora_apertura": es_hora_apertura,
-        "es_hora_pico": es_hora_pico,
-        "es_hora_valle_manana": 1 if hora_int < 10 else 0,  # CORREGIDO: train_model.py línea 624
-        "es_hora_valle_tarde": 1 if hora_int > 18 else 0,  # train_model.py línea 625
-        "es_hora_valle": 1 if (hora_int < 10 or hora_int > 18) else 0,  # CORREGIDO: train_model.py línea 626
-        "hora_apertura_fin_semana": es_hora_apertura * es_fin_semana,  # Según train_model.py línea 198
-        "hora_pico_puente": es_hora_pico * es_puente_val,  # Según train_model.py línea 199
-        "puente_fin_semana": es_puente_val * es_fin_semana,  # Según train_model.py línea 200
-        "hora_mes": hora * mes,
-        "hora_dia_semana": hora * dia_semana,
-        "mes_dia_semana": mes * dia_semana,
-        "fin_semana_mes": es_fin_semana * mes,
-        "temporada_dia_semana": get_temporada(mes) * dia_semana,
-        "es_buen_clima": 1 if int(input_dict.get("codigo_clima", 3)) in [1, 2, 3] else 0,
-        "es_mal_clima": 1 if int(input_dict.get("codigo_clima", 3)) > 3 else 0,
-        # Features de días de semana
-        "es_lunes": 1 if dia_semana == 0 else 0,
-        "es_martes": 1 if dia_semana == 1 else 0,
-        "es_miercoles": 1 if dia_semana == 2 else 0,
-        "es_jueves": 1 if dia_semana == 3 else 0,
-        "es_viernes": 1 if dia_semana == 4 else 0,
-        "es_sabado": 1 if dia_semana == 5 else 0,
-        "es_domingo": 1 if dia_semana == 6 else 0,
-        "es_dia_laborable": 1 if dia_semana < 5 else 0,
-        # Features de meses
-        **{f"es_mes_{i}": 1 if mes == i else 0 for i in range(1, 13)},
-        # Flags especiales
-        "is_batman_octubre": 1 if ("Batman" in atraccion and mes == 10) else 0,
-        "is_octubre": 1 if mes == 10 else 0,
-        "is_noviembre": 1 if mes == 11 else 0,
-        "is_octubre_fin_semana": 1 if (mes == 10 and es_fin_semana == 1) else 0,
-        "is_noviembre_fin_semana": 1 if (mes == 11 and es_fin_semana == 1) else 0,
-    }
-
-    # 3. Mapeo Histórico (TODOS los históricos)
-    hist_mes_df = artifacts.get('hist_mes')
-    hist_hora_df = artifacts.get('hist_hora')
-    hist_dia_semana_df = artifacts.get('hist_dia_semana')
-    hist_mes_dia_df = artifacts.get('hist_mes_dia')
-    hist_hora_dia_df = artifacts.get('hist_hora_dia')
-    hist_mes_hora_df = artifacts.get('hist_mes_hora')
-    
-    features_historicas_encontradas = 0
-    features_historicas_totales = 0
-    
-    # Histórico por mes - Inicializar con valores por defecto primero
-    c['count_mes'] = 0
-    c['mean_mes'] = global_mean
-    c['median_mes'] = global_median
-    c['std_mes'] = global_std
-    c['p75_mes'] = global_p75
-    c['p90_mes'] = global_p90
-    c['p95_mes'] = global_p95
-    
-    if hist_mes_df is not None:
-        hist_mes_row = hist_mes_df[(hist_mes_df['atraccion'] == atraccion) & (hist_mes_df['mes'] == mes)]
-        print(f"Histórico mes - Atracción: {atraccion}, Mes: {mes}, Filas encontradas: {len(hist_mes_row)}")
-        if not hist_mes_row.empty:
-            for col in ['count_mes', 'mean_mes', 'median_mes', 'std_mes', 'p75_mes', 'p90_mes', 'p95_mes']:
-                features_historicas_totales += 1
-                if col in hist_mes_row.columns:
-                    c[col] = hist_mes_row[col].values[0]
-                    features_historicas_encontradas += 1
-                    print(f"  -> {col}: {c[col]}")
-        else:
-            print(f"  -> No se encontró histórico para mes {mes} y atracción {atraccion}, usando valores por defecto")
-    
-    # Histórico por hora - Inicializar con valores por defecto primero
-    c['count_hora'] = 0
-    c['mean_hora'] = global_mean
-    c['median_hora'] = global_median
-    c['std_hora'] = global_std
-    c['p75_hora'] = global_p75
-    c['p90_hora'] = global_p90
-    c["hora_hist"] = hora  # Siempre presente
-    
-    if hist_hora_df is not None:
-        hora_col = 'hora' if 'hora' in hist_hora_df.columns else 'hora_int'
-        hist_hora_row = hist_hora_df[(hist_hora_df['atraccion'] == atraccion) & (hist_hora_df[hora_col] == hora_int)]
-        print(f"Histórico hora - Atracción: {atraccion}, Hora: {hora_int}, Filas encontradas: {len(hist_hora_row)}")
-        if not hist_hora_row.empty:
-            for col in ['count_hora', 'mean_hora', 'median_hora', 'std_hora', 'p75_hora', 'p90_hora']:
-                features_historicas_totales += 1
-                if col in hist_hora_row.columns:
-                    c[col] = hist_hora_row[col].values[0]
-                    features_historicas_encontradas += 1
-    
-    # Histórico por día de semana - Inicializar con valores por defecto primero
-    c['count_dia'] = 0
-    c['mean_dia'] = global_mean
-    c['median_dia'] = global_median
-    c['std_dia'] = global_std
-    c['p75_dia'] = global_p75
-    c['p90_dia'] = global_p90
-    
-    if hist_dia_semana_df is not None:
-        hist_dia_row = hist_dia_semana_df[(hist_dia_semana_df['atraccion'] == atraccion) & (hist_dia_semana_df['dia_semana_num'] == dia_semana)]
-        if not hist_dia_row.empty:
-            for col in ['count_dia', 'mean_dia', 'median_dia', 'std_dia', 'p75_dia', 'p90_dia']:
-                if col in hist_dia_row.columns:
-                    c[col] = hist_dia_row[col].values[0]
-    
-    # Histórico por mes y día - Inicializar con valores por defecto primero
-    c['count_mes_dia'] = 0
-    c['mean_mes_dia'] = global_mean
-    c['median_mes_dia'] = global_median
-    c['p75_mes_dia'] = global_p75
-    c['p90_mes_dia'] = global_p90
-    
-    if hist_mes_dia_df is not None:
-        hist_mes_dia_row = hist_mes_dia_df[(hist_mes_dia_df['atraccion'] == atraccion) & (hist_mes_dia_df['mes'] == mes) & (hist_mes_dia_df['dia_semana_num'] == dia_semana)]
-        if not hist_mes_dia_row.empty:
-            for col in ['count_mes_dia', 'mean_mes_dia', 'median_mes_dia', 'p75_mes_dia', 'p90_mes_dia']:
-                if col in hist_mes_dia_row.columns:
-                    c[col] = hist_mes_dia_row[col].values[0]
-    
-    # Histórico por hora y día - Inicializar con valores por defecto primero
-    c['count_hora_dia'] = 0
-    c['mean_hora_dia'] = global_mean
-    c['median_hora_dia'] = global_median
-    c['p75_hora_dia'] = global_p75
-    c["hora_hist_hd"] = hora  # Siempre presente
-    
-    if hist_hora_dia_df is not None:
-        hora_col_hd = 'hora' if 'hora' in hist_hora_dia_df.columns else 'hora_int'
-        hist_hora_dia_row = hist_hora_dia_df[(hist_hora_dia_df['atraccion'] == atraccion) & (hist_hora_dia_df[hora_col_hd] == hora_int) & (hist_hora_dia_df['dia_semana_num'] == dia_semana)]
-        if not hist_hora_dia_row.empty:
-            for col in ['count_hora_dia', 'mean_hora_dia', 'median_hora_dia', 'p75_hora_dia']:
-                if col in hist_hora_dia_row.columns:
-                    c[col] = hist_hora_dia_row[col].values[0]
-    
-    # Histórico por mes y hora - Inicializar con valores por defecto primero
-    c['count_mes_hora'] = 0
-    c['mean_mes_hora'] = global_mean
-    c['median_mes_hora'] = global_median
-    c['p75_mes_hora'] = global_p75
-    c["hora_hist_mh"] = hora  # Siempre presente
-    
-    if hist_mes_hora_df is not None:
-        hora_col_mh = 'hora' if 'hora' in hist_mes_hora_df.columns else 'hora_int'
-        hist_mes_hora_row = hist_mes_hora_df[(hist_mes_hora_df['atraccion'] == atraccion) & (hist_mes_hora_df['mes'] == mes) & (hist_mes_hora_df[hora_col_mh] == hora_int)]
-        if not hist_mes_hora_row.empty:
-            for col in ['count_mes_hora', 'mean_mes_hora', 'median_mes_hora', 'p75_mes_hora']:
-                if col in hist_mes_hora_row.columns:
-                    c[col] = hist_mes_hora_row[col].values[0]
-    
-    print(f"Features históricas encontradas: {features_historicas_encontradas}/{features_historicas_totales}")
-    print(f"Total de features en diccionario c: {len(c)}")
-    print(f"Valores clave en c: hora={c.get('hora')}, mes={c.get('mes')}, atraccion_enc={c.get('atraccion_enc')}, zona_enc={c.get('zona_enc')}")
-    
-    # Añadir frecuencias si existen en las columnas de entrenamiento (según train_model.py líneas 761-766)
-    if "zona_freq" in col_order:
-        zona_freq_map = df_train["zona"].value_counts().to_dict() if "zona" in df_train.columns else {}
-        c["zona_freq"] = zona_freq_map.get(zona, 0)
-        print(f"zona_freq: {c['zona_freq']}")
-    if "atraccion_freq" in col_order:
-        atraccion_freq_map = df_train["atraccion"].value_counts().to_dict() if "atraccion" in df_train.columns else {}
-        c["atraccion_freq"] = atraccion_freq_map.get(atraccion, 0)
-        print(f"atraccion_freq: {c['atraccion_freq']}")
+    log.debug("=== PREPARE INPUT FOR PREDICTION ===")
+    log.debug("Input dict: %s", lazy(json.dumps, input_dict, default=str))
+    
+    # Features con el mismo código (y las mismas definiciones) que el entrenamiento
+    c = build_serving_row(input_dict, artifacts)
+    log.debug("Valores clave en c: hora=%s, mes=%s, atraccion_enc=%s, zona_enc=%s",
+              c.get('hora'), c.get('mes'), c.get('atraccion_enc'), c.get('zona_enc'))
+    
+    # Posiciones y defaults de las columnas no calculadas ya compilados al cargar el modelo
+    layout = get_feature_layout(artifacts, RELLENO_REGLAS)
+    row = fill_feature_row(layout, c, hora=c['hora'], mes=c['mes'])
+    
+    # Diagnóstico del vector (búsquedas de NaN/inf y estadísticos): solo si DEBUG está activo
+    if log.enabled(DEBUG):
+        col_order = layout["columnas"]
+        log.debug("Vector final shape: %s", row.shape)
+        log.debug("Valores NaN: %d", int(np.isnan(row).sum()))
+        log.debug("Primeras 5 columnas y valores: %s", dict(zip(col_order[:5], row[:5].tolist())))
+        log.debug("Valores infinitos en vector final: %d", int(np.isinf(row).sum()))
+    
+    lap("features")
+    return row
 
-    # 4. CONSTRUCCIÓN DEL DATAFRAME FINAL (Garantiza el orden del Scaler)
-    final_row = {}
-    for col in col_order:
-        if col in c:
-            final_row[col] = c[col]
-        elif col.startswith("es_mes_"):
-            final_row[col] = 1 if mes == int(col.split("_")[-1]) else 0
-        elif any(x in col for x in ["_hist", "_hist_hd", "_hist_mh"]):
-            # Columnas creadas por merges con sufijos
-            if "hora" in col:
-                final_row[col] = hora
-            else:
-                final_row[col] = global_median
-        elif "freq" in col:
-            final_row[col] = 0
-        elif "mean" in col:
-            final_row[col] = global_mean
-        elif "median" in col:
-            final_row[col] = global_median
-        else:
-            final_row[col] = global_median  # Fallback seguro
-            
-    df_final = pd.DataFrame([final_row])
-    
-    # Asegurar que todas las columnas estén presentes
-    missing_cols = [col for col in col_order if col not in df_final.columns]
-    if missing_cols:
-        for col in missing_cols:
-            if "hora" in col and ("_hist" in col or "_hist_hd" in col or "_hist_mh" in col):
-                df_final[col] = hora
-            elif "mean" in col:
-                df_final[col] = global_mean
-            elif "median" in col:
-                df_final[col] = global_median
-            else:
-                df_final[col] = global_median
-    
-    # Reordenar en el orden exacto del scaler
-    df_final = df_final[col_order]
-    
-    print(f"DataFrame final shape: {df_final.shape}")
-    print(f"Columnas en df_final: {len(df_final.columns)}")
-    print(f"Valores NaN: {df_final.isna().sum().sum()}")
-    print(f"Primeras 5 columnas y valores: {df_final.iloc[0, :5].to_dict()}")
+def prepare_input_for_prediction(input_dict, artifacts):
+    """Vector de features (1, n_features) listo para el modelo: escalado salvo que el ensemble lleve el scaler plegado"""
+    row = build_feature_row(input_dict, artifacts)
+    layout = get_feature_layout(artifacts, RELLENO_REGLAS)
     
     try:
-        # Verificar valores antes del scaler
-        print(f"Valores NaN en df_final: {df_final.isna().sum().sum()}")
-        print(f"Valores infinitos en df_final: {np.isinf(df_final.select_dtypes(include=[np.number])).sum().sum()}")
-        
-        X_scaled = scaler.transform(df_final)
-        print(f"X_scaled shape: {X_scaled.shape}")
-        print(f"X_scaled primeros valores: {X_scaled[0, :5]}")
-        print(f"X_scaled últimos valores: {X_scaled[0, -5:]}")
-        print(f"X_scaled min: {X_scaled.min()}, max: {X_scaled.max()}, mean: {X_scaled.mean()}")
-        print(f"Valores NaN en X_scaled: {np.isnan(X_scaled).sum()}")
-        print(f"Valores infinitos en X_scaled: {np.isinf(X_scaled).sum()}")
+        X_scaled = model_input(layout, row)
+        lap("scale")
+        if log.enabled(DEBUG):
+            log.debug("X_scaled shape: %s", X_scaled.shape)
+            log.debug("X_scaled primeros valores: %s", X_scaled[0, :5])
+            log.debug("X_scaled últimos valores: %s", X_scaled[0, -5:])
+            log.debug("X_scaled min: %s, max: %s, mean: %s", X_scaled.min(), X_scaled.max(), X_scaled.mean())
+            log.debug("Valores NaN en X_scaled: %d", np.isnan(X_scaled).sum())
+            log.debug("Valores infinitos en X_scaled: %d", np.isinf(X_scaled).sum())
         
         return X_scaled
     except Exception as e:
-        print(f"ERROR en scaler.transform: {str(e)}")
-        print(f"Tipo de error: {type(e).__name__}")
-        traceback.print_exc()
+        log.error("ERROR en escalado (%s): %s", type(e).__name__, e, exc_info=True)
         raise
 
 def predict_wait_time(input_dict, artifacts):
     """Realiza la predicción y aplica lógica de negocio final"""
-    print("=== PREDICT WAIT TIME ===")
+    log.debug("=== PREDICT WAIT TIME ===")
     
     try:
         X_scaled = prepare_input_for_prediction(input_dict, artifacts)
-        print("Features preparadas correctamente")
+        log.debug("Features preparadas correctamente")
     except Exception as e:
-        print(f"ERROR preparando features: {str(e)}")
-        traceback.print_exc()
+        log.error("ERROR preparando features: %s", e, exc_info=True)
         raise
     
     try:
-        model = artifacts['model']
-        print("Modelo obtenido, realizando predicción...")
-        pred_base = float(model.predict(X_scaled)[0])
-        print(f"DEBUG: Predicción del modelo (raw): {pred_base}")
+        log.debug("Modelo obtenido, realizando predicción...")
+        pred_base = float(predict_model(artifacts, X_scaled)[0])
+        lap("model")
+        log.debug("Predicción del modelo (raw): %s", pred_base)
     except Exception as e:
-        print(f"ERROR en predicción del modelo: {str(e)}")
-        traceback.print_exc()
+        log.error("ERROR en predicción del modelo: %s", e, exc_info=True)
         raise
     
+    return apply_business_rules(input_dict, pred_base, artifacts)
+
+def predict_wait_time_batch(inputs, artifacts):
+    """
+    Predice una lista de inputs con una sola llamada al escalador y al modelo.
+
+    Devuelve una lista alineada con inputs: el resultado de predict_wait_time
+    o {"status": "error", "error": ...} para los inputs que fallen.
+    """
+    resultados = [None] * len(inputs)
+    layout = get_feature_layout(artifacts, RELLENO_REGLAS)
+    posiciones = list(range(len(inputs)))
+    try:
+        # Todo el lote columna a columna
+        columnas, contexto = build_serving_features(inputs, artifacts)
+    except Exception:
+        # Algún input no es válido: fila a fila para aislar sus errores y lote con el resto
+        posiciones = []
+        for i, input_dict in enumerate(inputs):
+            try:
+                build_serving_row(input_dict, artifacts)
+                posiciones.append(i)
+            except Exception as e:
+                log.warning("Input %d del lote descartado (%s): %s", i, type(e).__name__, e)
+                resultados[i] = {"status": "error", "error": str(e)}
+        if not posiciones:
+            return resultados
+        columnas, contexto = build_serving_features([inputs[i] for i in posiciones], artifacts)
+    filas = fill_feature_matrix(layout, columnas, len(posiciones), hora=columnas['hora'], mes=columnas['mes'])
+    lap("features")
+    
+    X_scaled = model_input(layout, filas)
+    lap("scale")
+    preds = np.asarray(predict_model(artifacts, X_scaled), dtype=np.float64)
+    lap("model")
+    validos = [inputs[i] for i in posiciones]
+    try:
+        respuestas = apply_business_rules_batch(validos, preds, contexto, artifacts)
+    except Exception:
+        # Mismo aislamiento de errores que con las features
+        respuestas = []
+        for i, input_dict, pred_base in zip(posiciones, validos, preds):
+            try:
+                respuestas.append(apply_business_rules(input_dict, float(pred_base), artifacts))
+            except Exception as e:
+                log.warning("Input %d del lote descartado (%s): %s", i, type(e).__name__, e)
+                respuestas.append({"status": "error", "error": str(e)})
+    for i, respuesta in zip(posiciones, respuestas):
+        resultados[i] = respuesta
+    return resultados
+
+def apply_business_rules(input_dict, pred_base, artifacts):
+    """Combina la predicción del modelo con el histórico y aplica los ajustes de negocio"""
     # Extraer información del input
     fecha = pd.to_datetime(input_dict.get("fecha"), errors="coerce")
     if pd.isna(fecha):
@@ -413,114 +280,71 @@ def predict_wait_time(input_dict, artifacts):
     es_fin_de_semana = 1 if dia_semana in [5, 6] else 0
     atr = input_dict.get("atraccion", "")
     
-    # Parsear hora
+    # Parsear hora (mismo parser que las features; NaN si no es válida)
     hora = parse_hora(input_dict.get("hora", 12))
     if pd.isna(hora):
         hora = 12.0
     hora_int = int(hora)
     
-    # Obtener históricos y datos de entrenamiento
-    df_train = artifacts['df_processed']
-    hist_mes_df = artifacts.get('hist_mes')
-    hist_hora_df = artifacts.get('hist_hora')
-    hist_dia_semana_df = artifacts.get('hist_dia_semana')
-    hist_mes_dia_df = artifacts.get('hist_mes_dia')
-    hist_hora_dia_df = artifacts.get('hist_hora_dia')
-    hist_mes_hora_df = artifacts.get('hist_mes_hora')
-    global_median = df_train["tiempo_espera"].median()
-    global_mean = df_train["tiempo_espera"].mean()
+    # Obtener históricos precalculados
+    hist_index = get_hist_indexes(artifacts)
+    serving_stats = get_serving_stats(artifacts)
+    global_median = serving_stats["global_median"]
+    global_mean = serving_stats["global_mean"]
     
     # Verificar existencia en históricos pre-calculados
-    tiene_mes_hora_dia = False
-    tiene_hora_dia = False
-    tiene_mes_hora = False
-    tiene_hora = False
-    
-    if hist_mes_hora_df is not None and hist_mes_dia_df is not None:
-        hora_col_mh = 'hora' if 'hora' in hist_mes_hora_df.columns else 'hora_int'
-        tiene_mes_hora_dia = (not hist_mes_hora_df[(hist_mes_hora_df['atraccion'] == atr) & 
-                                                    (hist_mes_hora_df['mes'] == mes) & 
-                                                    (hist_mes_hora_df[hora_col_mh] == hora_int)].empty and
-                             not hist_mes_dia_df[(hist_mes_dia_df['atraccion'] == atr) & 
-                                                 (hist_mes_dia_df['mes'] == mes) & 
-                                                 (hist_mes_dia_df['dia_semana_num'] == dia_semana)].empty)
-    
-    if hist_hora_dia_df is not None:
-        hora_col_hd = 'hora' if 'hora' in hist_hora_dia_df.columns else 'hora_int'
-        tiene_hora_dia = not hist_hora_dia_df[(hist_hora_dia_df['atraccion'] == atr) & 
-                                             (hist_hora_dia_df[hora_col_hd] == hora_int) & 
-                                             (hist_hora_dia_df['dia_semana_num'] == dia_semana)].empty
-    
-    if hist_mes_hora_df is not None:
-        hora_col_mh = 'hora' if 'hora' in hist_mes_hora_df.columns else 'hora_int'
-        tiene_mes_hora = not hist_mes_hora_df[(hist_mes_hora_df['atraccion'] == atr) & 
-                                             (hist_mes_hora_df['mes'] == mes) & 
-                                             (hist_mes_hora_df[hora_col_mh] == hora_int)].empty
-    
-    if hist_hora_df is not None:
-        hora_col = 'hora' if 'hora' in hist_hora_df.columns else 'hora_int'
-        tiene_hora = not hist_hora_df[(hist_hora_df['atraccion'] == atr) & 
-                                     (hist_hora_df[hora_col] == hora_int)].empty
+    tiene_mes_hora_dia = ((atr, mes, hora_int) in hist_index['hist_mes_hora'] and
+                          (atr, mes, dia_semana) in hist_index['hist_mes_dia'])
+    tiene_hora_dia = (atr, hora_int, dia_semana) in hist_index['hist_hora_dia']
+    tiene_mes_hora = (atr, mes, hora_int) in hist_index['hist_mes_hora']
+    tiene_hora = (atr, hora_int) in hist_index['hist_hora']
     
     # Si no hay datos exactos por hora, buscar en rango cercano
     if not tiene_hora and hora_int > 0:
         for h in [hora_int-1, hora_int+1]:
-            if 0 <= h < 24 and hist_hora_df is not None:
-                hora_col = 'hora' if 'hora' in hist_hora_df.columns else 'hora_int'
-                if not hist_hora_df[(hist_hora_df['atraccion'] == atr) & (hist_hora_df[hora_col] == h)].empty:
-                    hora_int = h
-                    tiene_hora = True
-                    break
+            if 0 <= h < 24 and (atr, h) in hist_index['hist_hora']:
+                hora_int = h
+                tiene_hora = True
+                break
     
-    # PRIORIZAR históricos que incluyen HORA - buscar directamente en df_train
+    # PRIORIZAR históricos que incluyen HORA - leer del cubo de cuantiles precalculado
+    cube = get_quantile_cube_index(artifacts)
     if tiene_mes_hora_dia:
-        hist_ref = df_train[(df_train['atraccion'] == atr) & 
-                            (df_train['mes'] == mes) & 
-                            (df_train['hora'].astype(int) == hora_int) & 
-                            (df_train['dia_semana_num'] == dia_semana)]
+        hist_ref = cube['mes_hora_dia'].get((atr, mes, hora_int, dia_semana))
         especificidad = "mes_hora_dia"
     elif tiene_hora_dia:
-        hist_ref = df_train[(df_train['atraccion'] == atr) & 
-                            (df_train['hora'].astype(int) == hora_int) & 
-                            (df_train['dia_semana_num'] == dia_semana)]
+        hist_ref = cube['hora_dia'].get((atr, hora_int, dia_semana))
         especificidad = "hora_dia"
     elif tiene_mes_hora:
-        hist_ref = df_train[(df_train['atraccion'] == atr) & 
-                            (df_train['mes'] == mes) & 
-                            (df_train['hora'].astype(int) == hora_int)]
+        hist_ref = cube['mes_hora'].get((atr, mes, hora_int))
         especificidad = "mes_hora"
     elif tiene_hora:
-        hist_ref = df_train[(df_train['atraccion'] == atr) & 
-                           (df_train['hora'].astype(int) == hora_int)]
+        hist_ref = cube['hora'].get((atr, hora_int))
         especificidad = "hora"
     else:
-        hist_mes_dia_ref = df_train[(df_train['atraccion'] == atr) & 
-                                   (df_train['mes'] == mes) & 
-                                   (df_train['dia_semana_num'] == dia_semana)]
-        hist_dia_ref = df_train[(df_train['atraccion'] == atr) & 
-                               (df_train['dia_semana_num'] == dia_semana)]
-        hist_mes_ref = df_train[(df_train['atraccion'] == atr) & 
-                               (df_train['mes'] == mes)]
+        hist_mes_dia_ref = cube['mes_dia'].get((atr, mes, dia_semana))
+        hist_dia_ref = cube['dia'].get((atr, dia_semana))
+        hist_mes_ref = cube['mes'].get((atr, mes))
         
-        if not hist_mes_dia_ref.empty:
+        if hist_mes_dia_ref is not None:
             hist_ref = hist_mes_dia_ref
             especificidad = "mes_dia"
-        elif not hist_dia_ref.empty:
+        elif hist_dia_ref is not None:
             hist_ref = hist_dia_ref
             especificidad = "dia"
-        elif not hist_mes_ref.empty:
+        elif hist_mes_ref is not None:
             hist_ref = hist_mes_ref
             especificidad = "mes"
         else:
-            hist_ref = pd.DataFrame()
+            hist_ref = None
             especificidad = "global"
     
-    # Calcular estadísticas del histórico más específico disponible
-    if not hist_ref.empty:
-        p75_hist = hist_ref['tiempo_espera'].quantile(0.75)
-        median_hist = hist_ref['tiempo_espera'].median()
-        p90_hist = hist_ref['tiempo_espera'].quantile(0.90)
-        count_hist = len(hist_ref)
+    # Estadísticas del histórico más específico disponible
+    if hist_ref is not None:
+        p75_hist = hist_ref['p75']
+        median_hist = hist_ref['p50']
+        p90_hist = hist_ref['p90']
+        count_hist = int(hist_ref['count'])
     else:
         p75_hist = global_median
         median_hist = global_median
@@ -533,33 +357,30 @@ def predict_wait_time(input_dict, artifacts):
     es_hora_valle = (hora_int < 10 or hora_int > 18)
     
     # Detectar puente/festivo
-    es_puente_val = es_puente(fecha)
+    es_puente_val = calendar_row(fecha)["es_puente"]
     
     # PRIORIZAR históricos por hora - si tenemos datos específicos por hora, usarlos directamente
     if especificidad in ["mes_hora_dia", "hora_dia", "mes_hora", "hora"]:
         # Tenemos datos por hora - usar histórico como base y ajustar con modelo
-        if not hist_ref.empty:
+        if hist_ref is not None:
             if es_hora_apertura:
-                hist_base = hist_ref['tiempo_espera'].quantile(0.25) if len(hist_ref) > 10 else median_hist
+                hist_base = hist_ref['p25'] if count_hist > 10 else median_hist
                 peso_historico = 0.80
                 peso_modelo = 0.20
             elif es_hora_pico:
                 hist_base = p75_hist
                 # DETECTAR HISTÓRICOS SOSPECHOSAMENTE BAJOS
                 if p75_hist < 15 and count_hist < 20:
-                    hist_mes_dia_alt = df_train[(df_train['atraccion'] == atr) & 
-                                               (df_train['mes'] == mes) & 
-                                               (df_train['dia_semana_num'] == dia_semana)]
-                    hist_mes_alt = df_train[(df_train['atraccion'] == atr) & 
-                                           (df_train['mes'] == mes)]
+                    hist_mes_dia_alt = cube['mes_dia'].get((atr, mes, dia_semana))
+                    hist_mes_alt = cube['mes'].get((atr, mes))
                     
-                    if not hist_mes_dia_alt.empty:
-                        p75_alt = hist_mes_dia_alt['tiempo_espera'].quantile(0.75)
+                    if hist_mes_dia_alt is not None:
+                        p75_alt = hist_mes_dia_alt['p75']
                         if p75_alt > p75_hist:
                             hist_base = p75_alt
                             especificidad = "mes_dia_fallback"
-                    elif not hist_mes_alt.empty:
-                        p75_alt = hist_mes_alt['tiempo_espera'].quantile(0.75)
+                    elif hist_mes_alt is not None:
+                        p75_alt = hist_mes_alt['p75']
                         if p75_alt > p75_hist:
                             hist_base = p75_alt
                             especificidad = "mes_fallback"
@@ -589,7 +410,7 @@ def predict_wait_time(input_dict, artifacts):
     
     # Calcular predicción base combinada
     pred_combinada = pred_base * peso_modelo + hist_base * peso_historico
-    print(f"DEBUG: pred_base={pred_base:.2f}, hist_base={hist_base:.2f}, pred_combinada={pred_combinada:.2f}")
+    log.debug("pred_base=%.2f, hist_base=%.2f, pred_combinada=%.2f", pred_base, hist_base, pred_combinada)
     
     # AJUSTES ESPECIALES POR CONTEXTO
     if es_hora_apertura:
@@ -654,13 +475,14 @@ def predict_wait_time(input_dict, artifacts):
     # Solo aplicar mínimo si la predicción es negativa o extremadamente baja
     if minutos_final < 1:
         minutos_final = max(global_median * 0.5, 5)  # Usar al menos la mitad de la mediana o 5, lo que sea mayor
-        print(f"WARNING: Predicción muy baja, usando fallback: {minutos_final}")
+        log.warning("Predicción muy baja, usando fallback: %s", minutos_final)
     
     minutos_final = min(180, max(1, minutos_final))  # Mínimo 1 minuto, máximo 180
     
-    print(f"DEBUG: Predicción final: {minutos_final:.2f} minutos")
-    print(f"DEBUG: Ajuste aplicado: {ajuste}")
-    print(f"DEBUG: Especificidad histórico: {especificidad}")
+    log.debug("Predicción final: %.2f minutos", minutos_final)
+    log.debug("Ajuste aplicado: %s", ajuste)
+    log.debug("Especificidad histórico: %s", especificidad)
+    lap("blend")
     
     return {
         "minutos_predichos": round(minutos_final, 1),
@@ -673,17 +495,221 @@ def predict_wait_time(input_dict, artifacts):
         "especificidad_historico": especificidad
     }
 
+def apply_business_rules_batch(inputs, pred_base, contexto, artifacts):
+    """
+    Versión por lotes de apply_business_rules: pesos y ajustes con np.select
+    sobre columnas, reutilizando las fechas y horas ya parseadas en el contexto
+    de build_serving_features. El resultado es idéntico, elemento a elemento,
+    a [apply_business_rules(i, p, artifacts) for i, p in zip(inputs, pred_base)].
+    """
+    n = len(inputs)
+    mes = contexto["mes"]
+    dia_semana = contexto["dia_semana"]
+    es_fin_de_semana = contexto["es_fin_de_semana"]
+    es_puente_val = contexto["es_puente"]
+    atracciones = contexto["atracciones"]
+    hora_int = np.asarray(contexto["hora_int"]).astype(np.int64)
+    
+    hist_index = get_hist_indexes(artifacts)
+    global_median = get_serving_stats(artifacts)["global_median"]
+    cube = get_quantile_cube_index(artifacts)
+    
+    # Selección del histórico más específico: una búsqueda en diccionario por fila
+    especificidad = np.empty(n, dtype=object)
+    refs = [None] * n
+    alt_p75 = np.full(n, np.nan)
+    alt_nivel = np.empty(n, dtype=object)
+    for i, atr in enumerate(atracciones):
+        m, d, h = int(mes[i]), int(dia_semana[i]), int(hora_int[i])
+        tiene_mes_hora_dia = (atr, m, h) in hist_index['hist_mes_hora'] and \
+                             (atr, m, d) in hist_index['hist_mes_dia']
+        tiene_hora_dia = (atr, h, d) in hist_index['hist_hora_dia']
+        tiene_mes_hora = (atr, m, h) in hist_index['hist_mes_hora']
+        tiene_hora = (atr, h) in hist_index['hist_hora']
+        
+        # Si no hay datos exactos por hora, buscar en rango cercano
+        if not tiene_hora and h > 0:
+            for h_alt in [h - 1, h + 1]:
+                if 0 <= h_alt < 24 and (atr, h_alt) in hist_index['hist_hora']:
+                    h = h_alt
+                    tiene_hora = True
+                    break
+        hora_int[i] = h
+        
+        hist_mes_dia_ref = cube['mes_dia'].get((atr, m, d))
+        hist_dia_ref = cube['dia'].get((atr, d))
+        hist_mes_ref = cube['mes'].get((atr, m))
+        if tiene_mes_hora_dia:
+            refs[i], especificidad[i] = cube['mes_hora_dia'].get((atr, m, h, d)), "mes_hora_dia"
+        elif tiene_hora_dia:
+            refs[i], especificidad[i] = cube['hora_dia'].get((atr, h, d)), "hora_dia"
+        elif tiene_mes_hora:
+            refs[i], especificidad[i] = cube['mes_hora'].get((atr, m, h)), "mes_hora"
+        elif tiene_hora:
+            refs[i], especificidad[i] = cube['hora'].get((atr, h)), "hora"
+        elif hist_mes_dia_ref is not None:
+            refs[i], especificidad[i] = hist_mes_dia_ref, "mes_dia"
+        elif hist_dia_ref is not None:
+            refs[i], especificidad[i] = hist_dia_ref, "dia"
+        elif hist_mes_ref is not None:
+            refs[i], especificidad[i] = hist_mes_ref, "mes"
+        else:
+            especificidad[i] = "global"
+        
+        # Alternativa menos específica para históricos sospechosamente bajos en hora pico
+        if hist_mes_dia_ref is not None:
+            alt_p75[i], alt_nivel[i] = hist_mes_dia_ref['p75'], "mes_dia_fallback"
+        elif hist_mes_ref is not None:
+            alt_p75[i], alt_nivel[i] = hist_mes_ref['p75'], "mes_fallback"
+    
+    # Estadísticas del histórico más específico disponible
+    tiene_ref = np.array([r is not None for r in refs], dtype=bool)
+    p75_hist = np.array([r['p75'] if r is not None else global_median for r in refs], dtype=np.float64)
+    median_hist = np.array([r['p50'] if r is not None else global_median for r in refs], dtype=np.float64)
+    p25_hist = np.array([r['p25'] if r is not None else global_median for r in refs], dtype=np.float64)
+    count_hist = np.array([int(r['count']) if r is not None else 0 for r in refs], dtype=np.int64)
+    
+    # Determinar tipo de hora del día
+    es_hora_apertura = (hora_int >= 10) & (hora_int < 11)
+    es_hora_pico = (hora_int >= 11) & (hora_int <= 16)
+    es_hora_valle = (hora_int < 10) | (hora_int > 18)
+    
+    # Pesos modelo/histórico (mismas ramas que apply_business_rules)
+    con_hora = np.isin(especificidad, ["mes_hora_dia", "hora_dia", "mes_hora", "hora"])
+    con_ref = con_hora & tiene_ref
+    sospechoso = con_ref & es_hora_pico & (p75_hist < 15) & (count_hist < 20)
+    usa_alt = sospechoso & (alt_p75 > p75_hist)
+    especificidad = np.where(usa_alt, alt_nivel, especificidad)
+    
+    hist_base = np.select(
+        [con_ref & es_hora_apertura, usa_alt, con_ref & es_hora_pico, con_ref, con_hora, es_hora_pico],
+        [np.where(count_hist > 10, p25_hist, median_hist), alt_p75, p75_hist, median_hist, median_hist, p75_hist],
+        default=median_hist,
+    )
+    condiciones_peso = [
+        con_ref & es_hora_apertura,
+        sospechoso & (hist_base < 15),
+        sospechoso,
+        con_ref & es_hora_pico,
+        con_ref,
+        con_hora,
+    ]
+    peso_historico = np.select(condiciones_peso, [0.80, 0.30, 0.50, 0.70, 0.75, 0.60], default=0.40)
+    peso_modelo = np.select(condiciones_peso, [0.20, 0.70, 0.50, 0.30, 0.25, 0.40], default=0.60)
+    
+    # Calcular predicción base combinada
+    pred_combinada = pred_base * peso_modelo + hist_base * peso_historico
+    
+    # Batman octubre: boost especial según fin de semana y hora pico
+    es_batman_octubre = np.array(["Batman" in a for a in atracciones], dtype=bool) & (mes == 10)
+    batman = np.select(
+        [
+            es_fin_de_semana & es_hora_pico & ((p75_hist < 15) | (hist_base < 15)),
+            es_fin_de_semana & es_hora_pico,
+            es_fin_de_semana & (hist_base < 10),
+            es_fin_de_semana,
+            es_hora_pico & (hist_base < 15),
+            es_hora_pico,
+        ],
+        [
+            np.maximum.reduce([pred_base * 1.50, pred_combinada * 1.40, np.full(n, 25.0)]),
+            np.maximum.reduce([pred_combinada * 1.30, p75_hist * 1.25, hist_base * 1.35, pred_base * 1.25]),
+            np.maximum.reduce([pred_base * 1.30, pred_combinada * 1.20, np.full(n, 15.0)]),
+            np.maximum(pred_combinada * 1.20, hist_base * 1.25),
+            np.maximum.reduce([pred_base * 1.35, pred_combinada * 1.25, np.full(n, 20.0)]),
+            np.maximum(pred_combinada * 1.15, hist_base * 1.20),
+        ],
+        default=np.maximum(pred_combinada * 1.10, hist_base * 1.15),
+    )
+    
+    # AJUSTES ESPECIALES POR CONTEXTO (en el mismo orden de prioridad que apply_business_rules)
+    condiciones_ajuste = [
+        es_hora_apertura,
+        es_batman_octubre,
+        es_puente_val,
+        (mes == 10) & (dia_semana == 6),
+        (mes == 11) & (dia_semana == 6),
+        es_hora_pico,
+        es_hora_valle,
+        es_fin_de_semana,
+    ]
+    minutos_final = np.select(
+        condiciones_ajuste,
+        [
+            pred_combinada * np.where(es_fin_de_semana, 0.50, 0.60),
+            batman,
+            pred_combinada * np.where(es_fin_de_semana, 1.15, 1.10),
+            np.where(es_hora_pico, pred_combinada * 1.10, pred_combinada),
+            np.where(es_hora_pico, pred_combinada * 1.08, pred_combinada),
+            pred_combinada * 1.05,
+            pred_combinada * 0.90,
+            pred_combinada,
+        ],
+        default=pred_combinada,
+    )
+    prefijo_ajuste = np.select(
+        condiciones_ajuste,
+        [
+            "apertura",
+            np.where(es_fin_de_semana, "batman_octubre_fin_semana", "batman_octubre_laborable"),
+            "puente",
+            "octubre_domingo",
+            "noviembre_domingo",
+            "hora_pico",
+            "hora_valle",
+            "fin_semana",
+        ],
+        default="laborable",
+    )
+    
+    resultados = []
+    for i in range(n):
+        minutos = float(minutos_final[i])
+        # Mismo fallback y límites (y mismos tipos en el JSON) que apply_business_rules
+        if minutos < 1:
+            minutos = max(global_median * 0.5, 5)
+            log.warning("Predicción muy baja, usando fallback: %s", minutos)
+        minutos = min(180, max(1, minutos))
+        resultados.append({
+            "minutos_predichos": round(minutos, 1),
+            "status": "success",
+            "atraccion": inputs[i].get("atraccion"),
+            "prediccion_raw": round(float(pred_base[i]), 2),
+            "prediccion_combinada": round(float(pred_combinada[i]), 2),
+            "historico_base": round(float(hist_base[i]), 2),
+            "ajuste_aplicado": f"{prefijo_ajuste[i]}_{especificidad[i]}",
+            "especificidad_historico": especificidad[i],
+        })
+    lap("blend")
+    return resultados
+
 # --- HANDLER PRINCIPAL ---
 
 def lambda_handler(event, context):
+    # Nivel de log de la petición (DEBUG si se muestrea) y tiempos por etapa
+    # (línea EMF y cabecera Server-Timing opcional)
+    log.begin_request()
+    start_request(cold='scaler' not in models_cache)
+    respuesta = _handle_request(event)
+    headers = respuesta.get('headers', {})
+    return finish_request(
+        respuesta,
+        dimensiones={'Origen': headers.get('X-Prediction-Source', 'error')},
+        propiedades={'statusCode': respuesta['statusCode'],
+                     'requestId': getattr(context, 'aws_request_id', None),
+                     'logMuestreado': log.muestreada},
+    )
+
+def _handle_request(event):
     try:
-        print("=== INICIO LAMBDA HANDLER ===")
-        print(f"Event recibido: {json.dumps(event, default=str)}")
+        log.debug("=== INICIO LAMBDA HANDLER ===")
+        log.debug("Event recibido: %s", lazy(json.dumps, event, default=str))
         
         # 1. Cargar artefactos
-        print("Cargando artefactos desde S3...")
+        log.debug("Cargando artefactos desde S3...")
         artifacts = load_model_from_s3()
-        print("Artefactos cargados correctamente")
+        lap("load")
+        log.debug("Artefactos cargados correctamente")
         
         # 2. Parsear Body
         if isinstance(event.get('body'), str):
@@ -691,38 +717,150 @@ def lambda_handler(event, context):
         else:
             body = event.get('body', event)
         
-        print(f"Body parseado: {json.dumps(body, default=str)}")
+        log.debug("Body parseado: %s", lazy(json.dumps, body, default=str))
+        
+        if is_batch_request(body):
+            return _handle_batch(body, artifacts)
         
         # 3. Validaciones de entrada (Seguridad)
         required = ['fecha', 'hora', 'atraccion', 'zona']
         missing = [f for f in required if f not in body]
         if missing:
-            print(f"ERROR: Faltan campos requeridos: {missing}")
+            log.warning("Faltan campos requeridos: %s", missing)
             return {
                 'statusCode': 400,
                 'headers': {'Access-Control-Allow-Origin': '*'},
                 'body': json.dumps({'error': f'Faltan campos: {", ".join(missing)}'})
             }
+        lap("parse")
             
-        # 4. Ejecutar Predicción
-        print("Iniciando predicción...")
-        resultado = predict_wait_time(body, artifacts)
-        print(f"Predicción completada: {resultado}")
+        # 4. Buscar en la caché de predicciones (clave canónica: fecha, tramo de hora, atracción, zona, clima)
+        clave, body_canonico = canonical_prediction_input(body)
+        respuesta = prediction_cache.get(clave) if clave is not None else None
+        hit = respuesta is not None
+        lap("cache")
+        
+        # 5. Tabla de previsiones precalculada (clima por defecto y fechas dentro del horizonte)
+        origen = 'cache' if hit else 'model'
+        if not hit and clave is not None and artifacts.get('forecast_table') is not None:
+            resultado = lookup_forecast(artifacts['forecast_table'], clave)
+            if resultado is not None:
+                origen = 'table'
+                respuesta = json.dumps(resultado)
+                prediction_cache.set(clave, respuesta)
+            lap("table")
+        
+        # 6. Ejecutar Predicción (sobre el input canónico, para que la caché sea coherente)
+        if respuesta is None:
+            log.debug("Iniciando predicción...")
+            resultado = predict_wait_time(body_canonico, artifacts)
+            log.debug("Predicción completada: %s", resultado)
+            respuesta = json.dumps(resultado)
+            if clave is not None:
+                prediction_cache.set(clave, respuesta)
+            lap("serialize")
+        else:
+            log.debug("Predicción servida desde %s: %s", origen, clave)
         
         return {
             'statusCode': 200,
             'headers': {
                 'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Expose-Headers': 'X-Cache, X-Cache-Hits, X-Cache-Misses, X-Cache-Size, X-Prediction-Source, Server-Timing',
+                'X-Prediction-Source': origen,
+                **prediction_cache.headers(hit)
             },
-            'body': json.dumps(resultado)
+            'body': respuesta
         }
         
     except Exception as e:
-        print("--- ERROR DETECTADO ---")
-        traceback.print_exc()
+        log.error("--- ERROR DETECTADO --- %s: %s", type(e).__name__, e, exc_info=True)
         return {
             'statusCode': 500,
             'headers': {'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': str(e), 'type': type(e).__name__})
         }
+
+def _handle_batch(body, artifacts):
+    """
+    Petición en lote (array de inputs o rejilla): cada input pasa por la caché y
+    la tabla de previsiones, y los restantes se predicen juntos en una sola
+    llamada al modelo. Los errores de un input se devuelven en su posición.
+    """
+    try:
+        zonas = get_serving_metadata(artifacts).get('zona_por_atraccion', {})
+        items = expand_batch_request(body, zonas)
+    except BatchRequestError as e:
+        log.warning("Petición en lote inválida: %s", e)
+        return {
+            'statusCode': 400,
+            'headers': {'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)})
+        }
+    lap("parse")
+    
+    resultados = [None] * len(items)
+    origenes = {'cache': 0, 'table': 0, 'model': 0}
+    pendientes = []  # (posición, clave, input canónico) que necesitan el modelo
+    tabla = artifacts.get('forecast_table')
+    for i, item in enumerate(items):
+        error = validate_item(item)
+        if error is not None:
+            resultados[i] = {'status': 'error', 'error': error}
+            continue
+        clave, canonico = canonical_prediction_input(item)
+        if clave is not None:
+            cacheado = prediction_cache.get(clave)
+            if cacheado is not None:
+                resultados[i] = json.loads(cacheado)
+                origenes['cache'] += 1
+                continue
+            if tabla is not None:
+                resultado = lookup_forecast(tabla, clave)
+                if resultado is not None:
+                    resultados[i] = resultado
+                    prediction_cache.set(clave, json.dumps(resultado))
+                    origenes['table'] += 1
+                    continue
+        pendientes.append((i, clave, canonico))
+    lap("cache")
+    
+    if pendientes:
+        predicciones = predict_wait_time_batch([canonico for _, _, canonico in pendientes], artifacts)
+        for (i, clave, _), resultado in zip(pendientes, predicciones):
+            resultados[i] = resultado
+            if resultado.get('status') == 'success':
+                origenes['model'] += 1
+                if clave is not None:
+                    prediction_cache.set(clave, json.dumps(resultado))
+        lap("blend")
+    
+    # Cada resultado lleva la fecha y hora pedidas para poder dibujar la curva
+    for item, resultado in zip(items, resultados):
+        if isinstance(item, dict):
+            resultado.setdefault('atraccion', item.get('atraccion'))
+            resultado['fecha'] = item.get('fecha')
+            resultado['hora'] = item.get('hora')
+    errores = sum(1 for r in resultados if r.get('status') != 'success')
+    respuesta = json.dumps({
+        'status': 'success',
+        'n': len(resultados),
+        'errores': errores,
+        'origenes': origenes,
+        'resultados': resultados,
+    })
+    lap("serialize")
+    log.info("Lote de %d inputs: %s, %d errores", len(items), origenes, errores)
+    
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'X-Prediction-Source, X-Batch-Size, Server-Timing',
+            'X-Prediction-Source': 'batch',
+            'X-Batch-Size': str(len(items)),
+        },
+        'body': respuesta
+    }
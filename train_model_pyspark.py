@@ -14,6 +14,9 @@ import sys
 import math
 warnings.filterwarnings('ignore')
 
+sys.path.insert(0, "ParkBeat")
+from feature_builder import build_base_features, parse_horas
+
 # ====================================================
 # 1) INICIALIZAR SPARK SESSION
 # ====================================================
@@ -100,59 +103,41 @@ print("\n" + "=" * 70)
 print("🔧 CREANDO FUNCIONES UDF")
 print("=" * 70)
 
-def parse_hora_udf(hora_str):
-    """Parsear hora a float"""
-    try:
-        if hora_str is None:
-            return 12.0
-        if isinstance(hora_str, (int, float)):
-            return float(hora_str)
-        s = str(hora_str).strip()
-        if ":" in s:
-            parts = s.split(":")
-            hora = int(float(parts[0]))
-            minuto = int(float(parts[1])) if len(parts) > 1 else 0
-            return hora + minuto / 60.0
-        return float(s)
-    except:
-        return 12.0
-
-def get_temporada_udf(mes):
-    """Determina la temporada del año"""
-    if mes in [7, 8]:
-        return 3  # Muy Alta
-    elif mes == 10:
-        return 3  # Muy Alta
-    elif mes in [4, 5, 6, 12]:
-        return 2  # Alta
-    elif mes in [3, 9, 11]:
-        return 1  # Media
-    else:
-        return 0  # Baja
-
-def es_festivo_espana_udf(fecha):
-    """Detecta festivos en España"""
-    try:
-        if fecha is None:
-            return 0
-        mes = fecha.month
-        dia = fecha.day
-        if mes == 1 and dia == 1: return 1  # Año Nuevo
-        if mes == 1 and dia == 6: return 1  # Reyes
-        if mes == 5 and dia == 1: return 1  # Día del Trabajo
-        if mes == 10 and dia == 12: return 1  # Día de la Hispanidad
-        if mes == 11 and dia == 1: return 1  # Todos los Santos
-        if mes == 12 and dia == 6: return 1  # Constitución
-        if mes == 12 and dia == 8: return 1  # Inmaculada
-        if mes == 12 and dia == 25: return 1  # Navidad
-        return 0
-    except:
-        return 0
-
-# Registrar UDFs
-parse_hora = F.udf(parse_hora_udf, DoubleType())
-get_temporada = F.udf(get_temporada_udf, IntegerType())
-es_festivo_espana = F.udf(es_festivo_espana_udf, IntegerType())
+# Parseo de hora vectorizado con el mismo código que pandas y el serving
+# (las horas que no se pueden parsear quedan nulas y se rellenan con la mediana)
+@F.pandas_udf(DoubleType())
+def parse_hora(horas: pd.Series) -> pd.Series:
+    return pd.Series(parse_horas(horas.to_numpy(dtype=object)))
+
+
+def _tipo_spark(valores):
+    return LongType() if np.asarray(valores).dtype.kind in "iub" else DoubleType()
+
+
+# Tipos de las columnas de build_base_features (de una fila de muestra)
+TIPOS_FEATURES_BASE = {
+    col: _tipo_spark(valores)
+    for col, valores in build_base_features(
+        np.array(["2025-01-01"], dtype="datetime64[D]"), [12.0], [20.0], [60.0], [20.0], [3.0], [""]
+    ).items()
+}
+
+
+def add_base_features(batches):
+    """mapInPandas: añade a cada lote las features de feature_builder.build_base_features"""
+    for pdf in batches:
+        features = build_base_features(
+            pdf["fecha"].to_numpy(), pdf["hora"], pdf["temperatura"], pdf["humedad"],
+            pdf["sensacion_termica"], pdf["codigo_clima"], pdf["atraccion"].tolist()
+        )
+        pdf = pdf.drop(columns=[col for col in features if col in pdf.columns])
+        for col, valores in features.items():
+            # Fechas nulas: componentes de fecha a NaN -> enteros nulos
+            if TIPOS_FEATURES_BASE[col] == LongType() and np.asarray(valores).dtype.kind == "f":
+                valores = pd.array(valores, dtype="Int64")
+            pdf[col] = valores
+        yield pdf
+
 
 print("✅ UDFs creadas")
 
@@ -171,52 +156,6 @@ df = df.withColumn("hora", parse_hora("hora"))
 median_hora = df.select(F.percentile_approx("hora", 0.5).alias("median")).collect()[0]["median"]
 df = df.fillna({"hora": median_hora})
 
-# Features temporales
-df = df.withColumn("mes", F.month("fecha")) \
-       .withColumn("dia_mes", F.dayofmonth("fecha")) \
-       .withColumn("dia_semana_num", F.dayofweek("fecha") - 1) \
-       .withColumn("semana_año", F.weekofyear("fecha")) \
-       .withColumn("trimestre", F.quarter("fecha")) \
-       .withColumn("año", F.year("fecha"))
-
-# Días de semana
-df = df.withColumn("es_lunes", (F.col("dia_semana_num") == 0).cast("int")) \
-       .withColumn("es_martes", (F.col("dia_semana_num") == 1).cast("int")) \
-       .withColumn("es_miercoles", (F.col("dia_semana_num") == 2).cast("int")) \
-       .withColumn("es_jueves", (F.col("dia_semana_num") == 3).cast("int")) \
-       .withColumn("es_viernes", (F.col("dia_semana_num") == 4).cast("int")) \
-       .withColumn("es_sabado", (F.col("dia_semana_num") == 5).cast("int")) \
-       .withColumn("es_domingo", (F.col("dia_semana_num") == 6).cast("int")) \
-       .withColumn("es_fin_de_semana", F.col("dia_semana_num").isin([5, 6]).cast("int")) \
-       .withColumn("es_dia_laborable", F.col("dia_semana_num").isin([0, 1, 2, 3, 4]).cast("int"))
-
-# Meses
-for mes_num in range(1, 13):
-    df = df.withColumn(f"es_mes_{mes_num}", (F.col("mes") == mes_num).cast("int"))
-
-# Temporada
-df = df.withColumn("temporada", get_temporada("mes"))
-
-# Features cíclicas
-pi_value = math.pi
-df = df.withColumn("hora_sin", F.sin(F.lit(2 * pi_value) * F.col("hora") / 24)) \
-       .withColumn("hora_cos", F.cos(F.lit(2 * pi_value) * F.col("hora") / 24)) \
-       .withColumn("mes_sin", F.sin(F.lit(2 * pi_value) * F.col("mes") / 12)) \
-       .withColumn("mes_cos", F.cos(F.lit(2 * pi_value) * F.col("mes") / 12)) \
-       .withColumn("dia_semana_sin", F.sin(F.lit(2 * pi_value) * F.col("dia_semana_num") / 7)) \
-       .withColumn("dia_semana_cos", F.cos(F.lit(2 * pi_value) * F.col("dia_semana_num") / 7)) \
-       .withColumn("dia_mes_sin", F.sin(F.lit(2 * pi_value) * F.col("dia_mes") / 31)) \
-       .withColumn("dia_mes_cos", F.cos(F.lit(2 * pi_value) * F.col("dia_mes") / 31)) \
-       .withColumn("semana_año_sin", F.sin(F.lit(2 * pi_value) * F.col("semana_año") / 52)) \
-       .withColumn("semana_año_cos", F.cos(F.lit(2 * pi_value) * F.col("semana_año") / 52))
-
-# Interacciones
-df = df.withColumn("hora_mes", F.col("hora") * F.col("mes")) \
-       .withColumn("hora_dia_semana", F.col("hora") * F.col("dia_semana_num")) \
-       .withColumn("mes_dia_semana", F.col("mes") * F.col("dia_semana_num")) \
-       .withColumn("fin_semana_mes", F.col("es_fin_de_semana") * F.col("mes")) \
-       .withColumn("temporada_dia_semana", F.col("temporada") * F.col("dia_semana_num"))
-
 # Rellenar numéricos faltantes
 for col in ["temperatura", "humedad", "sensacion_termica", "codigo_clima"]:
     if col in df.columns:
@@ -225,29 +164,15 @@ for col in ["temperatura", "humedad", "sensacion_termica", "codigo_clima"]:
     else:
         df = df.withColumn(col, F.lit(0))
 
-# Features de clima
-if "codigo_clima" in df.columns:
-    df = df.withColumn("es_buen_clima", F.col("codigo_clima").isin([1, 2, 3]).cast("int")) \
-           .withColumn("es_mal_clima", (F.col("codigo_clima") > 3).cast("int"))
-
-# Features de hora del día
-df = df.withColumn("hora_int", F.col("hora").cast("int")) \
-       .withColumn("es_hora_apertura", ((F.col("hora_int") >= 10) & (F.col("hora_int") < 11)).cast("int")) \
-       .withColumn("es_hora_pico", ((F.col("hora_int") >= 11) & (F.col("hora_int") <= 16)).cast("int")) \
-       .withColumn("es_hora_valle_manana", (F.col("hora_int") < 10).cast("int")) \
-       .withColumn("es_hora_valle_tarde", (F.col("hora_int") > 18).cast("int")) \
-       .withColumn("es_hora_valle", ((F.col("es_hora_valle_manana") == 1) | (F.col("es_hora_valle_tarde") == 1)).cast("int"))
-
-# Festivos y puentes
-df = df.withColumn("es_festivo", es_festivo_espana("fecha"))
-
-# Flags especiales
-df = df.withColumn("is_batman_octubre", 
-                   (F.col("atraccion").contains("Batman") & (F.col("mes") == 10)).cast("int")) \
-       .withColumn("is_octubre", (F.col("mes") == 10).cast("int")) \
-       .withColumn("is_noviembre", (F.col("mes") == 11).cast("int")) \
-       .withColumn("is_octubre_fin_semana", ((F.col("mes") == 10) & (F.col("es_fin_de_semana") == 1)).cast("int")) \
-       .withColumn("is_noviembre_fin_semana", ((F.col("mes") == 11) & (F.col("es_fin_de_semana") == 1)).cast("int"))
+# Features temporales, calendario, cíclicas, interacciones, clima, hora del
+# día y flags especiales: el mismo código columnar que train_model.py y el
+# serving, aplicado por lotes de Arrow en lugar de una columna de Spark (o una
+# UDF fila a fila) por feature
+esquema = StructType(
+    [campo for campo in df.schema.fields if campo.name not in TIPOS_FEATURES_BASE]
+    + [StructField(col, tipo) for col, tipo in TIPOS_FEATURES_BASE.items()]
+)
+df = df.mapInPandas(add_base_features, schema=esquema)
 
 print(f"✅ Features creadas: {len(df.columns)} columnas")
 
@@ -550,10 +475,13 @@ print("✅ Encoding maps guardados")
 joblib.dump(numeric_cols, "ParkBeat/models/xgb_columns_professional.pkl")
 print("✅ Columnas guardadas")
 
-# Guardar df procesado (muestra pequeña para referencia)
-df_sample = df.limit(1000).toPandas()
-joblib.dump(df_sample, "ParkBeat/models/df_processed.pkl")
-print("✅ DataFrame procesado guardado")
+# Guardar metadatos de serving (stats globales, frecuencias y listas de atracciones/zonas)
+# calculados sobre todo el dataset, en lugar de una muestra de df procesado
+from serving_metadata import SERVING_METADATA_FILENAME, build_serving_metadata
+df_metadata = df.select("atraccion", "zona", "tiempo_espera", "temperatura", "humedad").toPandas()
+serving_metadata = build_serving_metadata(df_metadata)
+joblib.dump(serving_metadata, f"ParkBeat/models/{SERVING_METADATA_FILENAME}")
+print(f"✅ Metadatos de serving guardados ({serving_metadata['n_registros']} registros)")
 
 # NOTA: Para usar en Lambda, necesitarás convertir el modelo Spark a formato compatible
 # Opción 1: Usar tu modelo pandas/XGBoost existente